@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import DataItem
+from .models import DataItem, Dataset
 
 admin.site.register(DataItem)
+admin.site.register(Dataset)
 
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DataManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data_manager'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .sqlite import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid='data_manager.configure_sqlite')
@@ -0,0 +1,126 @@
+"""
+编译的 asyncio 版本，供 ASGI 部署下的异步视图使用。
+
+pdflatex 通过 asyncio 子进程运行，文件读写放到线程中执行，不阻塞事件循环。
+任务被取消（例如客户端断开连接）时立即终止 pdflatex 的整个进程组，
+被放弃的编译不再占用CPU。资源限制、缓存和调度与同步版本相同。
+"""
+import asyncio
+import os
+import signal
+import subprocess
+
+from django.conf import settings
+
+from .compile_scheduler import get_scheduler, INTERACTIVE
+from .scratch import remove_scratch_dir
+from .latex_compiler import (
+    _broken_formats, collect_pdflatex_run, classify_exit, compute_cache_key,
+    create_latex_body, create_latex_document, document_result, ensure_preamble_format, limited_command,
+    load_cached_result, prepare_pdflatex_run, prepare_table_environment, run_preflight, store_cached_result,
+    table_first_line, table_line_mapper, ERROR_TIMEOUT,
+)
+from .table_analyzer import analyze_table
+
+
+def _kill_process_group(process):
+    """终止子进程及其创建的所有进程，子进程由事件循环回收。"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run_pdflatex_async(latex_source, format_name=None):
+    """
+    run_pdflatex 的异步版本，返回相同的字典，调用方负责通过 remove_scratch_dir 删除临时目录。
+
+    :return: (run 字典, 临时目录) 元组。
+    """
+    command, env, job_dir, tex_file_path = await asyncio.to_thread(prepare_pdflatex_run, latex_source, format_name)
+    try:
+        stdout_file = await asyncio.to_thread(open, tex_file_path.replace('.tex', '.stdout'), 'wb')
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *limited_command(command), stdout=stdout_file, stderr=subprocess.STDOUT, cwd=job_dir, env=env,
+                start_new_session=True,
+            )
+        finally:
+            stdout_file.close()
+
+        error_type = None
+        try:
+            returncode = await asyncio.wait_for(process.wait(), settings.LATEX_COMPILE_TIMEOUT)
+            error_type = classify_exit(returncode)
+        except asyncio.TimeoutError:
+            _kill_process_group(process)
+            returncode = await process.wait()
+            error_type = ERROR_TIMEOUT
+        except BaseException:
+            # 任务被取消，终止编译后继续抛出
+            _kill_process_group(process)
+            raise
+        run = await asyncio.to_thread(collect_pdflatex_run, tex_file_path, returncode, error_type)
+        return run, job_dir
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(remove_scratch_dir, job_dir))
+        raise
+
+
+async def compile_latex_document_async(latex_document, format_name=None, line_mapper=None):
+    """compile_latex_document 的异步版本。"""
+    run, job_dir = await run_pdflatex_async(latex_document, format_name)
+    try:
+        return await asyncio.to_thread(document_result, run, format_name, line_mapper)
+    finally:
+        await asyncio.shield(asyncio.to_thread(remove_scratch_dir, job_dir))
+
+
+async def compile_latex_to_pdf_async(original_table_code, use_cache=True, priority=INTERACTIVE):
+    """
+    compile_latex_to_pdf 的异步版本，结果格式相同。
+
+    :raises SchedulerSaturated: 编译队列已满。
+    :raises asyncio.CancelledError: 任务被取消，此时 pdflatex 已被终止。
+    """
+    structure = analyze_table(original_table_code)
+    table_environment = prepare_table_environment(original_table_code, structure)
+    latex_document = create_latex_document(table_environment)
+    cache_key = compute_cache_key(latex_document)
+    preflight_failure = run_preflight(original_table_code, structure)
+    if preflight_failure is not None:
+        preflight_failure['cache_key'] = cache_key
+        preflight_failure['cached'] = False
+        return preflight_failure
+    if use_cache:
+        cached_result = await asyncio.to_thread(load_cached_result, cache_key)
+        if cached_result is not None:
+            return cached_result
+
+    result = None
+    # 格式文件缺失时会在编译槽中同步运行 pdflatex -ini，放到线程中执行
+    format_name = await asyncio.to_thread(ensure_preamble_format, priority)
+    async with get_scheduler().slot_async(priority):
+        if format_name is not None:
+            result = await compile_latex_document_async(
+                create_latex_body(table_environment), format_name,
+                table_line_mapper(original_table_code, table_environment, structure, table_first_line(format_name)),
+            )
+            if result is None:
+                # 格式文件损坏或与当前编译器不兼容，后续编译不再使用
+                _broken_formats.add(format_name)
+        if result is None:
+            result = await compile_latex_document_async(
+                latex_document, line_mapper=table_line_mapper(
+                    original_table_code, table_environment, structure, table_first_line()),
+            )
+
+    # 超时或资源超限的结果不缓存，可能只是机器繁忙
+    if use_cache and result.get('error_type') is None:
+        await asyncio.to_thread(store_cached_result, cache_key, result)
+    result['cache_key'] = cache_key
+    result['cached'] = False
+    return result
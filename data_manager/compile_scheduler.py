@@ -0,0 +1,228 @@
+"""
+pdflatex 编译的准入控制。
+
+同时运行的 pdflatex 进程数不超过 LATEX_COMPILE_MAX_CONCURRENCY，其余请求在有界队列中等待。
+队列分为两个优先级：用户正在查看的交互请求（INTERACTIVE）总是先于预取、批量编译等
+后台请求（BACKGROUND）获得空闲的编译槽，并且后台请求不能占满所有编译槽，
+保证交互请求的等待时间可预期。队列已满或等待超时时抛出 SchedulerSaturated，
+视图据此返回 429 和 Retry-After。
+
+排队和优先级在进程内处理；同时运行的编译数由 LATEX_COMPILE_SLOT_DIR 中的锁文件（SlotFiles）
+在所有进程间限制：多个 gunicorn/uvicorn worker 和预编译进程池中的进程共用
+LATEX_COMPILE_MAX_CONCURRENCY 个编译槽，其中 LATEX_COMPILE_INTERACTIVE_RESERVED 个只供交互请求使用，
+因此任何进程中的后台编译都不会占满机器。跨进程时不保证先来先服务，等待中的交互请求
+只保证能使用保留的编译槽。没有 fcntl 的平台（Windows）只在进程内限流。
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只在进程内限流
+    fcntl = None
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+class SchedulerSaturated(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'编译队列已满，请在 {retry_after} 秒后重试。')
+        self.retry_after = retry_after
+
+
+class SlotFiles:
+    """
+    跨进程的编译槽：目录中的每个锁文件对应一个编译槽，持有文件的排他锁（flock）即占用该编译槽。
+    进程退出（包括崩溃）时锁由内核释放，不会遗留被占用的编译槽。
+    """
+    # 没有空闲编译槽时轮询的间隔（秒），从 poll_interval 倍增到 max_poll_interval
+    poll_interval = 0.01
+    max_poll_interval = 0.1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _try_lock(self, index):
+        fd = os.open(os.path.join(self.directory, f'slot-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, indices, deadline):
+        """
+        依次尝试 indices 对应的编译槽，直到获得其中一个。
+
+        :param deadline: time.monotonic() 的截止时间。
+        :return: 锁文件的描述符，传给 release；超过截止时间时返回None。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        interval = self.poll_interval
+        while True:
+            for index in indices:
+                fd = self._try_lock(index)
+                if fd is not None:
+                    return fd
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.max_poll_interval)
+
+    @staticmethod
+    def release(fd):
+        os.close(fd)  # 关闭描述符即释放锁
+
+
+class CompileScheduler:
+    # 平均编译时间的平滑系数，用于估算 Retry-After
+    time_smoothing = 0.2
+
+    def __init__(self, max_concurrency, max_queue, max_background_queue, interactive_reserved, queue_timeout,
+                 slot_dir=None):
+        """
+        :param max_concurrency: 同时运行的编译数上限。
+        :param max_queue: 交互请求队列的长度上限。
+        :param max_background_queue: 后台请求队列的长度上限。
+        :param interactive_reserved: 为交互请求保留的编译槽数，后台请求最多使用其余的编译槽（至少一个）。
+        :param queue_timeout: 在队列中等待的最长时间（秒）。
+        :param slot_dir: 跨进程编译槽（SlotFiles）的目录，为None时只在进程内限流。
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_limits = {INTERACTIVE: max_queue, BACKGROUND: max_background_queue}
+        self.background_concurrency = max(1, max_concurrency - interactive_reserved)
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._running = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._waiting = {INTERACTIVE: deque(), BACKGROUND: deque()}
+        self._average_time = 1.0
+        # 后台请求只能使用前 background_concurrency 个跨进程编译槽，其余的保留给交互请求；
+        # 交互请求先尝试保留的编译槽，尽量把共用的编译槽留给后台请求
+        self._slot_files = SlotFiles(slot_dir) if slot_dir is not None and fcntl is not None else None
+        self._slot_indices = {
+            INTERACTIVE: list(reversed(range(max_concurrency))),
+            BACKGROUND: list(range(self.background_concurrency)),
+        }
+        # 异步请求在独立的线程池中排队，排队的线程数不会超过队列长度之和，
+        # 也不会占满事件循环默认线程池、阻塞正在编译的请求的文件读写
+        self._async_executor = ThreadPoolExecutor(
+            max_workers=max_queue + max_background_queue + max_concurrency, thread_name_prefix='compile-queue',
+        )
+
+    def _can_start(self, priority, ticket):
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        if self._waiting[priority][0] is not ticket:
+            return False  # 同一优先级内先来先服务
+        if priority == BACKGROUND:
+            return not self._waiting[INTERACTIVE] and self._running[BACKGROUND] < self.background_concurrency
+        return True
+
+    def _retry_after(self):
+        waiting = sum(len(queue) for queue in self._waiting.values())
+        return max(1, math.ceil(self._average_time * (waiting + 1) / self.max_concurrency))
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        获取一个编译槽，需要与 release 成对调用。先在进程内排队，再获取跨进程的编译槽，
+        两者共用 queue_timeout。
+
+        :return: (获取编译槽的时间, 跨进程编译槽的描述符或None)，传给 release。
+        :raises SchedulerSaturated: 队列已满或等待超时。
+        """
+        with self._condition:
+            queue = self._waiting[priority]
+            ticket = object()
+            queue.append(ticket)
+            try:
+                if not self._can_start(priority, ticket) and len(queue) > self.queue_limits[priority]:
+                    raise SchedulerSaturated(self._retry_after())
+                deadline = time.monotonic() + self.queue_timeout
+                while not self._can_start(priority, ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SchedulerSaturated(self._retry_after())
+                    self._condition.wait(remaining)
+            finally:
+                queue.remove(ticket)
+                # 队首变化后其他等待者可能可以开始
+                self._condition.notify_all()
+            self._running[priority] += 1
+
+        slot_fd = None
+        if self._slot_files is not None:
+            slot_fd = self._slot_files.acquire(self._slot_indices[priority], deadline)
+            if slot_fd is None:
+                # 其他进程占满了编译槽
+                with self._condition:
+                    self._running[priority] -= 1
+                    self._condition.notify_all()
+                    raise SchedulerSaturated(self._retry_after())
+        return time.monotonic(), slot_fd
+
+    def release(self, priority, grant):
+        started, slot_fd = grant
+        if slot_fd is not None:
+            SlotFiles.release(slot_fd)
+        with self._condition:
+            self._running[priority] -= 1
+            elapsed = time.monotonic() - started
+            self._average_time += self.time_smoothing * (elapsed - self._average_time)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        grant = self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority, grant)
+
+    @asynccontextmanager
+    async def slot_async(self, priority=INTERACTIVE):
+        """slot 的异步版本。等待期间任务被取消时，之后获取到的编译槽会立即释放。"""
+        future = asyncio.get_running_loop().run_in_executor(self._async_executor, self.acquire, priority)
+        try:
+            grant = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(lambda done: self._release_abandoned(priority, done))
+            raise
+        try:
+            yield
+        finally:
+            self.release(priority, grant)
+
+    def _release_abandoned(self, priority, future):
+        if not future.cancelled() and future.exception() is None:
+            self.release(priority, future.result())
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CompileScheduler(
+                settings.LATEX_COMPILE_MAX_CONCURRENCY,
+                settings.LATEX_COMPILE_MAX_QUEUE,
+                settings.LATEX_COMPILE_BACKGROUND_MAX_QUEUE,
+                settings.LATEX_COMPILE_INTERACTIVE_RESERVED,
+                settings.LATEX_COMPILE_QUEUE_TIMEOUT,
+                settings.LATEX_COMPILE_SLOT_DIR,
+            )
+        return _scheduler
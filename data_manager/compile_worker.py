@@ -0,0 +1,56 @@
+"""
+进程池中执行的编译函数。
+
+子进程通过 spawn 启动，这里只依赖 latex_compiler，不导入模型，
+因此子进程无需初始化 Django 应用即可运行（设置通过 DJANGO_SETTINGS_MODULE 延迟加载）。
+"""
+import time
+
+from .compile_scheduler import BACKGROUND, SchedulerSaturated
+from .latex_compiler import compile_latex_to_pdf, get_pdf_cache, validate_latex
+
+
+def _wait_for_slot(compile_function, pred_tex_code):
+    """
+    以后台优先级编译。编译槽被其他进程（例如交互请求）占满时等待后重试，
+    而不是让整个预编译任务失败。
+    """
+    while True:
+        try:
+            return compile_function(pred_tex_code, priority=BACKGROUND)
+        except SchedulerSaturated as e:
+            time.sleep(e.retry_after)
+
+
+def compile_item(item_id, pred_tex_code):
+    """编译一个数据项，返回不含PDF数据的结果，PDF保存在编译缓存中。"""
+    started = time.monotonic()
+    result = _wait_for_slot(compile_latex_to_pdf, pred_tex_code)
+    pdf_path = None
+    if result.get('pdf_data') is not None:
+        pdf_path = get_pdf_cache().data_path(result['cache_key'])
+    return {
+        "item_id": item_id,
+        "cache_key": result['cache_key'],
+        "success": result.get('success', False),
+        "message": result.get('message', result.get('error', '')),
+        "errors": result.get('errors', []),
+        "error_type": result.get('error_type'),
+        "pdf_path": pdf_path,
+        "compile_time": time.monotonic() - started,
+    }
+
+
+def validate_item(item_id, pred_tex_code):
+    """只校验一个数据项能否编译（见 latex_compiler.validate_latex），不生成PDF。"""
+    started = time.monotonic()
+    result = _wait_for_slot(validate_latex, pred_tex_code)
+    return {
+        "item_id": item_id,
+        "success": result['success'],
+        "message": result['message'],
+        "errors": result['errors'],
+        "warnings": result['warnings'],
+        "error_type": result['error_type'],
+        "compile_time": time.monotonic() - started,
+    }
@@ -0,0 +1,186 @@
+"""
+基于文件系统的 LRU 缓存。
+
+缓存目录可以被同一台机器上的多个 gunicorn worker 共享：写入使用临时文件加
+os.replace 保证原子性，淘汰过程通过文件锁互斥。每个缓存项由一个元数据文件
+(<key>.json) 和一个可选的数据文件 (<key><suffix>) 组成，元数据文件最后写入，
+因此只要元数据存在，数据文件就一定是完整的。
+"""
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，淘汰时不加锁
+    fcntl = None
+
+
+class DiskCache:
+    # 每写入多少次检查一次是否需要淘汰
+    evict_every = 64
+
+    def __init__(self, directory, max_bytes, max_age, suffix='.bin'):
+        """
+        :param directory: 缓存根目录。
+        :param max_bytes: 缓存总大小上限（字节）。
+        :param max_age: 缓存项在未被访问时的最长保留时间（秒）。
+        :param suffix: 数据文件的扩展名。
+        """
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self._puts_since_evict = 0
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key[:2])
+
+    def meta_path(self, key):
+        return os.path.join(self._entry_dir(key), key + '.json')
+
+    def data_path(self, key):
+        return os.path.join(self._entry_dir(key), key + self.suffix)
+
+    def get(self, key):
+        """
+        读取缓存项。
+
+        :return: (元数据, 数据文件路径) 元组；数据文件不存在时路径为 None。未命中返回 None。
+        """
+        meta_path = self.meta_path(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+        data_path = self.data_path(key) if meta.get('has_data') else None
+        if data_path is not None and not os.path.exists(data_path):
+            # 数据文件被其他进程淘汰了，视为未命中
+            return None
+
+        # 更新访问时间，LRU 按元数据文件的 mtime 排序
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return meta, data_path
+
+    def read(self, key):
+        """
+        读取缓存项及其数据内容。
+
+        :return: (元数据, 数据字节) 元组；没有数据时为 None。未命中返回 None。
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        meta, data_path = entry
+        if data_path is None:
+            return meta, None
+        try:
+            with open(data_path, 'rb') as data_file:
+                return meta, data_file.read()
+        except OSError:
+            return None
+
+    def _write_atomic(self, path, chunks):
+        directory = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in chunks:
+                    tmp_file.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put(self, key, data, meta):
+        """
+        写入缓存项。写入失败（例如磁盘已满）时静默放弃，缓存只是加速手段。
+
+        :param data: 数据字节，可以为 None。
+        :param meta: 可 JSON 序列化的元数据字典。
+        :return: 是否写入成功。
+        """
+        return self.put_stream(key, None if data is None else [data], meta)
+
+    def put_stream(self, key, chunks, meta):
+        """
+        以流的方式写入缓存项，数据不需要整体读入内存。
+        与 put 不同，读取 chunks 时抛出的异常会向上传递，此时不会留下不完整的缓存项。
+
+        :param chunks: 产生数据字节的可迭代对象，可以为 None。
+        :return: 是否写入成功。
+        """
+        meta = dict(meta, has_data=chunks is not None)
+        try:
+            os.makedirs(self._entry_dir(key), exist_ok=True)
+            if chunks is not None:
+                self._write_atomic(self.data_path(key), chunks)
+            self._write_atomic(self.meta_path(key), [json.dumps(meta, ensure_ascii=False).encode('utf-8')])
+        except OSError:
+            return False
+
+        self._puts_since_evict += 1
+        if self._puts_since_evict >= self.evict_every:
+            self._puts_since_evict = 0
+            self.evict()
+        return True
+
+    def delete(self, key):
+        for path in (self.meta_path(key), self.data_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _scan(self):
+        """遍历所有缓存项，返回 (最后访问时间, 总大小, key) 列表。"""
+        entries = []
+        try:
+            shards = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for shard in shards:
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith('.json') or name.startswith('.tmp-'):
+                    continue
+                key = name[:-len('.json')]
+                try:
+                    stat = os.stat(os.path.join(shard_dir, name))
+                except OSError:
+                    continue
+                size = stat.st_size
+                try:
+                    size += os.path.getsize(self.data_path(key))
+                except OSError:
+                    pass
+                entries.append((stat.st_mtime, size, key))
+        return entries
+
+    def evict(self):
+        """删除过期的缓存项，并按最近最少使用的顺序淘汰，直到总大小不超过上限。"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, '.evict.lock')
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return  # 其他进程正在淘汰
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            expire_before = time.time() - self.max_age
+            for mtime, size, key in entries:
+                if mtime >= expire_before and total <= self.max_bytes:
+                    break
+                self.delete(key)
+                total -= size
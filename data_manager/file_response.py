@@ -0,0 +1,116 @@
+"""
+带 ETag 的文件响应，支持条件请求和 Range 请求。
+
+- If-None-Match 与 ETag 相同时返回304，不打开文件；
+- HEAD 请求返回与 GET 相同的响应头，不返回文件内容；
+- Range 只支持单个区间（bytes=a-b、bytes=a-、bytes=-n），多个区间时返回整个文件；
+  区间无法满足时返回416；If-Range 与 ETag 不同时忽略 Range，返回整个文件。
+"""
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    解析 Range 请求头。
+
+    :return: (start, end) 闭区间；请求头格式不支持时返回None，表示返回整个文件。
+    :raises ValueError: 区间无法满足。
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-n：最后 n 个字节
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def iter_file_range(file_obj, start, length, chunk_size=FileResponse.block_size):
+    """逐块读取文件的一段，读完或响应关闭时关闭文件。"""
+    try:
+        file_obj.seek(start)
+        while length > 0:
+            data = file_obj.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file_obj.close()
+
+
+def _set_headers(response, etag, cache_control):
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def not_modified_response(request, etag, cache_control):
+    """请求的条件头与 etag 匹配时返回304（或412），否则返回None。"""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        return None
+    return _set_headers(response, etag, cache_control)
+
+
+def serve_file(request, path, content_type, etag, cache_control, filename=None):
+    """
+    返回文件内容。
+
+    :param etag: 已加引号的强 ETag，例如 django.utils.http.quote_etag 的返回值。
+    :param cache_control: Cache-Control 响应头。
+    :raises OSError: 文件无法打开（例如刚好被缓存淘汰）。
+    """
+    response = not_modified_response(request, etag, cache_control)
+    if response is not None:
+        return response
+
+    file_obj = open(path, 'rb')
+    size = os.fstat(file_obj.fileno()).st_size
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            file_obj.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _set_headers(response, etag, cache_control)
+
+    start, end = byte_range if byte_range is not None else (0, size - 1)
+    if request.method == 'HEAD':
+        # HEAD 请求只返回与 GET 相同的响应头，不读取文件
+        file_obj.close()
+        response = HttpResponse(status=200 if byte_range is None else 206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+    elif byte_range is None:
+        response = FileResponse(file_obj, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(iter_file_range(file_obj, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+    if byte_range is not None:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if filename:
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return _set_headers(response, etag, cache_control)
@@ -0,0 +1,154 @@
+"""
+图片代理。
+
+图片从S3读取后以流的方式写入本地磁盘缓存（IMAGE_CACHE_DIR），所有用户和 worker
+共享，按大小和访问时间淘汰。可以返回缩小后的预览图（需要安装 Pillow，未安装时
+返回原图），并可以在后台预取接下来的若干张图片。
+"""
+import hashlib
+import io
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .disk_cache import DiskCache
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时不生成预览图
+    Image = None
+
+SIZE_ORIGINAL = 'original'
+SIZE_PREVIEW = 'preview'
+IMAGE_SIZES = (SIZE_ORIGINAL, SIZE_PREVIEW)
+
+# 从S3读取图片时每块的大小
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+_image_cache = None
+_prefetch_executor = None
+_executor_lock = threading.Lock()
+# 正在下载或生成的缓存项，同一个缓存项同时只由一个线程生成，其他线程等待
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = DiskCache(settings.IMAGE_CACHE_DIR, settings.IMAGE_CACHE_MAX_BYTES,
+                                 settings.IMAGE_CACHE_MAX_AGE, suffix='.img')
+    return _image_cache
+
+
+def image_cache_key(bucket, key, size):
+    return hashlib.sha256(f"{bucket}\0{key}\0{size}".encode('utf-8')).hexdigest()
+
+
+def _get_or_create(cache_key, create):
+    """
+    返回缓存项 (元数据, 数据文件路径)，未命中时调用 create 生成。
+    同一进程内并发请求同一个缓存项时只生成一次。
+    """
+    cache = get_image_cache()
+    while True:
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry
+        with _inflight_lock:
+            event = _inflight.get(cache_key)
+            owner = event is None
+            if owner:
+                event = _inflight[cache_key] = threading.Event()
+        if not owner:
+            event.wait()
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return entry
+            continue  # 生成失败，自己重试
+        try:
+            return create()
+        finally:
+            with _inflight_lock:
+                _inflight.pop(cache_key, None)
+            event.set()
+
+
+def _download_original(s3_client, bucket, key):
+    cache = get_image_cache()
+    cache_key = image_cache_key(bucket, key, SIZE_ORIGINAL)
+
+    def create():
+        s3_object = s3_client.get_object(Bucket=bucket, Key=key)
+        content_type = s3_object.get('ContentType')
+        if not content_type or content_type == 'binary/octet-stream':
+            content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        meta = {'content_type': content_type, 'etag': s3_object.get('ETag', '')}
+        if not cache.put_stream(cache_key, s3_object['Body'].iter_chunks(DOWNLOAD_CHUNK_SIZE), meta):
+            raise OSError('写入图片缓存失败')
+        return cache.get(cache_key)
+
+    return _get_or_create(cache_key, create)
+
+
+def _render_preview(original_path):
+    """生成不超过 IMAGE_PREVIEW_MAX_SIZE 的预览图，返回 (数据字节, content_type)。"""
+    with Image.open(original_path) as image:
+        image.thumbnail((settings.IMAGE_PREVIEW_MAX_SIZE, settings.IMAGE_PREVIEW_MAX_SIZE))
+        output = io.BytesIO()
+        if image.mode in ('RGB', 'L'):
+            image.save(output, format='JPEG', quality=settings.IMAGE_PREVIEW_QUALITY)
+            return output.getvalue(), 'image/jpeg'
+        image.save(output, format='PNG', optimize=True)
+        return output.getvalue(), 'image/png'
+
+
+def get_image(s3_client, bucket, key, size=SIZE_ORIGINAL):
+    """
+    返回图片的缓存项，未命中时从S3下载。
+
+    :param size: SIZE_ORIGINAL 或 SIZE_PREVIEW；未安装 Pillow 或图片无法解码时预览图退化为原图。
+    :return: (元数据, 数据文件路径) 元组，元数据中包含 content_type。
+    """
+    if size != SIZE_PREVIEW or Image is None:
+        return _download_original(s3_client, bucket, key)
+
+    cache = get_image_cache()
+    cache_key = image_cache_key(bucket, key, SIZE_PREVIEW)
+
+    def create():
+        # 只有预览图未缓存时才需要原图，原图已被淘汰时重新下载
+        original = _download_original(s3_client, bucket, key)
+        meta, original_path = original
+        try:
+            data, content_type = _render_preview(original_path)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return original
+        preview_meta = {'content_type': content_type, 'etag': meta.get('etag', '')}
+        if not cache.put(cache_key, data, preview_meta):
+            return original
+        return cache.get(cache_key) or original
+
+    return _get_or_create(cache_key, create)
+
+
+def _prefetch(s3_client, bucket, key, size):
+    try:
+        get_image(s3_client, bucket, key, size)
+    except Exception:
+        pass  # 预取失败不影响正常请求，真正访问时会重新下载
+
+
+def prefetch_images(s3_client, bucket, keys, size=SIZE_ORIGINAL):
+    """在后台线程池中预取图片，已缓存的图片会被跳过。"""
+    global _prefetch_executor
+    cache = get_image_cache()
+    with _executor_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_PREFETCH_WORKERS,
+                                                    thread_name_prefix='image-prefetch')
+    for key in keys:
+        if cache.get(image_cache_key(bucket, key, size)) is None:
+            _prefetch_executor.submit(_prefetch, s3_client, bucket, key, size)
@@ -0,0 +1,305 @@
+"""
+tables.json 的解析与入库，供 load_json_from_s3 视图和管理命令共用。
+
+文件按块读取并逐项解析，数据项分批写入数据库，内存占用只与单个数据项和批大小有关，
+与文件大小无关。
+
+重新加载同一个文件时是增量同步：数据集记录上次加载时源文件的 ETag / Last-Modified，
+文件未变化时直接跳过；变化时按每个数据项LaTeX代码的哈希比较，只写入新增和变化的数据项，
+删除文件中已不存在的数据项，未变化的数据项及其标注和编译结果保持不动。
+"""
+import codecs
+import hashlib
+import json
+import re
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CompileResult, DataItem, Dataset
+
+S3_PATH_PATTERN = re.compile(r's3://([^/]+)/(.+)/([^/]+\.json)$')
+
+# 读取文件时每块的字节数
+READ_CHUNK_SIZE = 64 * 1024
+# 每个数据库事务写入的数据项数
+WRITE_CHUNK_SIZE = 500
+
+_WHITESPACE = ' \t\n\r'
+# 数字之后的这些字符可能是同一个数字被块边界截断的剩余部分，例如 "3." 之后的 "5"
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+# 重新加载时数据项的同步状态
+ITEM_ADDED = 'added'
+ITEM_CHANGED = 'changed'
+ITEM_UNCHANGED = 'unchanged'
+ITEM_REMOVED = 'removed'
+
+
+def parse_s3_path(s3_path):
+    """
+    解析S3路径获取bucket名称、前缀以及文件名。
+
+    :return: (bucket_name, prefix, json_filename) 元组；格式不正确时返回None。
+    """
+    match = S3_PATH_PATTERN.match(s3_path)
+    if not match:
+        return None
+    return match.groups()
+
+
+def get_dataset(bucket, prefix, json_key):
+    """
+    获取或创建指定位置的数据集，并记录本次加载时间。
+    同时清空记录的源文件版本，加载完成后由 record_source_version 重新记录，
+    这样加载中途失败时下次不会因条件请求而跳过。
+
+    从旧版本迁移来的数据集不知道原始JSON文件名，json_key 记为 "<前缀>/"（见迁移 0004）；
+    第一次从该前缀加载JSON时接管这个数据集，已有的标注和编译结果保持关联。
+    """
+    if bucket and not Dataset.objects.filter(bucket=bucket, json_key=json_key).exists():
+        Dataset.objects.filter(bucket=bucket, prefix=prefix, json_key=f'{prefix}/').update(json_key=json_key)
+    dataset, _ = Dataset.objects.update_or_create(
+        bucket=bucket, json_key=json_key,
+        defaults={'prefix': prefix, 'loaded_at': timezone.now(), 'etag': '', 'last_modified': None},
+    )
+    return dataset
+
+
+def get_source_version(bucket, json_key):
+    """
+    上次完整加载该位置的文件时记录的版本。
+
+    :return: 数据集和 (etag, last_modified)；数据集不存在时数据集为None、版本为 ('', None)。
+    """
+    dataset = Dataset.objects.filter(bucket=bucket, json_key=json_key).first()
+    if dataset is None:
+        return None, ('', None)
+    return dataset, (dataset.etag, dataset.last_modified)
+
+
+def record_source_version(dataset, etag='', last_modified=None):
+    """数据集与源文件同步完成后记录文件的版本。"""
+    dataset.etag = etag or ''
+    dataset.last_modified = last_modified
+    dataset.save(update_fields=['etag', 'last_modified'])
+
+
+def mark_loaded(dataset):
+    """源文件未变化、跳过加载时只更新加载时间。"""
+    dataset.loaded_at = timezone.now()
+    dataset.save(update_fields=['loaded_at'])
+
+
+def iter_file_chunks(file_obj, chunk_size=READ_CHUNK_SIZE):
+    return iter(lambda: file_obj.read(chunk_size), b'')
+
+
+def iter_json_array(chunks):
+    """
+    增量解析顶层为数组的JSON，逐个返回数组元素。
+
+    :param chunks: 字节块的可迭代对象，例如 S3 响应的 Body.iter_chunks()。
+    :raises ValueError: JSON 格式不正确或不是数组时抛出。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        # 读入下一块数据，并丢弃已经解析过的部分
+        nonlocal buffer, pos, eof
+        try:
+            chunk = next(chunks)
+            buffer = buffer[pos:] + text_decoder.decode(chunk)
+        except StopIteration:
+            buffer = buffer[pos:] + text_decoder.decode(b'', final=True)
+            eof = True
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError('JSON文件的顶层必须是数组')
+    pos += 1
+
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError('JSON文件意外结束')
+        if buffer[pos] == ']':
+            return
+        if started:
+            if buffer[pos] != ',':
+                raise ValueError(f'JSON格式错误：位置{pos}处缺少逗号')
+            pos += 1
+            skip_whitespace()
+        started = True
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # 数字等标量可能被块边界截断（例如 "3." | "5" 会被解析为3），
+            # 确认后面有不属于该数字的字符或已到文件末尾再接受
+            if not eof and (end == len(buffer) or (
+                    isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and _NUMBER_TAIL.match(buffer, end).end() == len(buffer))):
+                fill()
+                continue
+            pos = end
+            yield value
+            break
+
+
+def content_hash(pred_tex_code):
+    """数据项LaTeX代码的哈希，重新加载时用于判断数据项是否变化。"""
+    return hashlib.sha256(pred_tex_code.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def load_item_hashes(dataset):
+    """数据集中已有数据项的 {图片名称: 内容哈希}。"""
+    return dict(DataItem.objects.filter(dataset=dataset)
+                .values_list('image_name', 'content_hash').iterator(chunk_size=2000))
+
+
+def _write_chunk(chunk, dataset, image_path_for, known_hashes):
+    """
+    在一个事务中写入一批数据项中新增和变化的部分，一次 bulk_create 完成插入和更新。
+    同一批中重复的图片名称以最后一项为准。
+
+    LaTeX代码未变化的数据项不写入，保留其分类和标注；代码变化的数据项删除旧的编译结果，
+    分类和标注以文件中的为准（标注针对的是旧代码）。
+
+    :param known_hashes: 数据集中已有数据项的 {图片名称: 内容哈希}，写入后同步更新。
+    :return: [(记录字典, 状态)]，状态为 ITEM_ADDED、ITEM_CHANGED 或 ITEM_UNCHANGED。
+    """
+    items_by_name = {}
+    for item in chunk:
+        items_by_name[item['image_name']] = item
+
+    data_items = []
+    changed_names = []
+    results = []
+    for image_name, item in items_by_name.items():
+        record = {
+            'image_name': image_name,
+            'pred_tex_code': item['pred_tex_code'],
+            'image_path': image_path_for(image_name) if image_path_for else None,
+            'category': item.get('category', ''),
+            'is_annotated': item.get('is_annotated', False),
+        }
+        item_hash = content_hash(record['pred_tex_code'])
+        old_hash = known_hashes.get(image_name)
+        if old_hash is None:
+            status = ITEM_ADDED
+        elif old_hash != item_hash:
+            status = ITEM_CHANGED
+            changed_names.append(image_name)
+        else:
+            results.append((record, ITEM_UNCHANGED))
+            continue
+        data_items.append(DataItem(dataset=dataset, content_hash=item_hash, **record))
+        results.append((record, status))
+
+    if data_items:
+        with transaction.atomic():
+            if changed_names:
+                # 代码变化后之前的标注已失效，正在标注这些数据项的请求会因版本不一致被拒绝
+                DataItem.objects.filter(dataset=dataset, image_name__in=changed_names).update(
+                    version=F('version') + 1)
+                CompileResult.objects.filter(item__dataset=dataset, item__image_name__in=changed_names).delete()
+            DataItem.objects.bulk_create(
+                data_items,
+                update_conflicts=True,
+                unique_fields=['dataset', 'image_name'],
+                update_fields=['pred_tex_code', 'content_hash', 'image_path', 'category', 'is_annotated'],
+            )
+        for data_item in data_items:
+            known_hashes[data_item.image_name] = data_item.content_hash
+    return results
+
+
+def _remove_missing(dataset, image_names, chunk_size):
+    """分批删除文件中已不存在的数据项，编译结果随之级联删除。"""
+    image_names = list(image_names)
+    for start in range(0, len(image_names), chunk_size):
+        names = image_names[start:start + chunk_size]
+        with transaction.atomic():
+            # 先直接删除编译结果（一条 DELETE）取得写锁，之后级联删除时的查询
+            # 不会使 SQLite 的读事务在并发写入时升级失败
+            CompileResult.objects.filter(item__dataset=dataset, item__image_name__in=names).delete()
+            DataItem.objects.filter(dataset=dataset, image_name__in=names).delete()
+
+
+def iter_ingest(items, dataset, image_path_for=None, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    将数据项与数据集同步，每批一个事务：先读取已有数据项的内容哈希，只写入新增和变化的数据项，
+    全部数据项处理完后删除文件中已不存在的数据项。重新加载只有少量变化的大文件时，
+    主要开销是解析JSON和计算哈希。
+
+    :param items: 数据项字典的可迭代对象，通常来自 iter_json_array。
+    :param dataset: 数据项所属的 Dataset。
+    :param image_path_for: 根据图片名称返回图片路径的函数。
+    :return: 生成器，每个数据项所在批次提交后返回 (记录字典, 状态)，状态为 ITEM_ADDED、
+             ITEM_CHANGED 或 ITEM_UNCHANGED；最后对每个被删除的数据项返回
+             ({'image_name': 图片名称}, ITEM_REMOVED)。中途出错时不会删除任何数据项。
+    """
+    known_hashes = load_item_hashes(dataset)
+    stale_names = set(known_hashes)
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            for record, status in _write_chunk(chunk, dataset, image_path_for, known_hashes):
+                stale_names.discard(record['image_name'])
+                yield record, status
+            chunk = []
+    if chunk:
+        for record, status in _write_chunk(chunk, dataset, image_path_for, known_hashes):
+            stale_names.discard(record['image_name'])
+            yield record, status
+    if stale_names:
+        _remove_missing(dataset, stale_names, chunk_size)
+        for image_name in stale_names:
+            yield {'image_name': image_name}, ITEM_REMOVED
+
+
+def new_summary():
+    return {'total': 0, ITEM_ADDED: 0, ITEM_CHANGED: 0, ITEM_UNCHANGED: 0, ITEM_REMOVED: 0}
+
+
+def count_status(summary, status):
+    """将一个数据项的同步状态计入汇总信息，total 只统计文件中的数据项。"""
+    summary[status] += 1
+    if status != ITEM_REMOVED:
+        summary['total'] += 1
+
+
+def ingest_items(items, dataset, image_path_for=None):
+    """
+    将数据项与数据集同步并返回汇总信息。
+
+    :return: 包含 total、added、changed、unchanged、removed 的字典。
+    """
+    summary = new_summary()
+    for _, status in iter_ingest(items, dataset, image_path_for):
+        count_status(summary, status)
+    return summary
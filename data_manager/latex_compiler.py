@@ -1,140 +1,116 @@
 import subprocess
 import os
 import re
+import signal
+import hashlib
+import shutil
 import tempfile
+import threading
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from django.conf import settings
-
-def determine_table_type(table_latex_code):
-    long_table_threshold = 30  
-    wide_table_threshold = 6   
-
-    rows = table_latex_code.split("\\\\")
-    max_cols = max(row.count('&') for row in rows) + 1
-
-    if len(rows) > long_table_threshold:
-        return "longtable"
-    elif max_cols > wide_table_threshold:
-        return "wide_table"
-    else:
-        return "standard"
-
-def extract_and_preserve_at_contents(original_def):
-    at_contents = []
-    non_at_parts = []
-    i = 0
-    while i < len(original_def):
-        if original_def[i:i+2] == "@{":  # 检测到@{开始
-            start = i
-            i += 2  # 跳过"@{"
-            balance = 1  # 跟踪括号平衡
-            while i < len(original_def) and balance > 0:
-                if original_def[i] == "{":
-                    balance += 1
-                elif original_def[i] == "}":
-                    balance -= 1
-                i += 1
-            at_contents.append(original_def[start:i])  # 包括闭合的}
-        else:
-            start = i
-            while i < len(original_def) and not (original_def[i] == "@" and original_def[i+1:i+2] == "{"):
-                i += 1
-            non_at_parts.append(original_def[start:i])
-    
-    # 移除空字符串
-    non_at_parts = [part for part in non_at_parts if part.strip()]
-    return at_contents, non_at_parts
-
-
-def create_column_definition(original_def, max_cols, table_type, replace_with='X'):
-    at_contents, non_at_parts = extract_and_preserve_at_contents(original_def)
-    
-    # 初始化新的列定义列表
-    new_col_defs = []
-    # 计算已经存在的列数（考虑到@{}内容不计入列数）
-    existing_cols = sum(len(part.replace('|', '')) for part in non_at_parts)
-
-    # 交错重组@{}内容和非@{}内容
-    for i, non_at_part in enumerate(non_at_parts):
-        new_col_defs.extend(list(non_at_part.replace('|', '')))  # 添加非@{}部分
-        
-        if i < len(at_contents):
-            new_col_defs.append(at_contents[i])  # 添加@{}内容
-    
-    # 检查是否需要添加额外的列来满足max_cols的要求
-    while existing_cols < max_cols:
-        if table_type == "wide_table":
-            # 对于宽表格，在末尾添加replace_with（通常为'X'）
-            new_col_defs.append(replace_with)
-        else:
-            # 对于其他类型的表格，使用'l'填充剩余的列
-            new_col_defs.append('l')
-        existing_cols += 1  # 更新现有的列数
-
-    return ''.join(new_col_defs)
-
- 
-def create_latex_document(table_environment):
-    latex_code = rf'''
-    \documentclass[10pt]{{article}}
-    \usepackage[a3paper, margin=1in]{{geometry}}
-    \usepackage[table,dvipsnames]{{xcolor}}
-    \usepackage{{booktabs}}
-    \usepackage{{tabularx, makecell, multirow}}
-    \usepackage{{graphicx}}
-    \usepackage{{array}}
-    \usepackage{{longtable}}
-    \usepackage{{amsmath}}
-    \usepackage{{amssymb}}
-    \usepackage{{amsbsy}}
-    \pagenumbering{{gobble}}
-    \begin{{document}}
+from .disk_cache import DiskCache
+from .scratch import create_scratch_dir, remove_scratch_dir
+from .table_analyzer import analyze_table
+from .log_parser import TexErrorParser, parse_log_file
+from .preflight import preflight_check, preflight_result, has_fatal_issues, SEVERITY_WARNING, format_issue
+from .compile_scheduler import get_scheduler, SchedulerSaturated, INTERACTIVE, BACKGROUND
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，构建格式文件时只做进程内互斥
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource，只限制运行时间
+    resource = None
+
+# 缓存结果格式的版本号，修改编译结果的结构时需要递增
+CACHE_FORMAT_VERSION = '2'
+
+
+LATEX_PREAMBLE = r'''
+    \documentclass[10pt]{article}
+    \usepackage[a3paper, margin=1in]{geometry}
+    \usepackage[table,dvipsnames]{xcolor}
+    \usepackage{booktabs}
+    \usepackage{tabularx, makecell, multirow}
+    \usepackage{graphicx}
+    \usepackage{array}
+    \usepackage{longtable}
+    \usepackage{amsmath}
+    \usepackage{amssymb}
+    \usepackage{amsbsy}
+    \pagenumbering{gobble}
+'''
+
+
+def create_latex_body(table_environment):
+    """生成不含导言区的文档正文，配合预编译的格式文件使用。"""
+    latex_code = rf'''    \begin{{document}}
     {table_environment}
     \end{{document}}
     '''
     return latex_code
 
-def extract_column_definition_with_indices(latex_code):
-    """
-    从LaTeX代码中提取列定义及其在字符串中的位置。
 
-    :param latex_code: 包含 LaTeX 表格定义的字符串。
-    :return: 列定义字符串及其开始和结束索引的元组。如果未找到，返回None。
+def create_latex_document(table_environment):
+    return LATEX_PREAMBLE + create_latex_body(table_environment)
+
+
+def table_first_line(format_name=None):
+    """表格环境的第一行在生成的文档中的行号；使用格式文件时文档只包含正文。"""
+    marker = '\0'
+    body = create_latex_body(marker)
+    line = body.count('\n', 0, body.index(marker)) + 1
+    if format_name is None:
+        line += LATEX_PREAMBLE.count('\n')
+    return line
+
+
+def table_line_mapper(original_table_code, table_environment, structure, first_line):
     """
-    start = latex_code.find(r"\begin{tabular}{")
-    if start == -1:
-        return None, None, None  # 未找到 \begin{tabular}{
-    
-    start += len(r"\begin{tabular}{")
-    end = start
-    balance = 1  # 初始时，我们已经遇到了一个左大括号
+    返回将文档中的行号映射为原始表格代码行号的函数。
 
-    while end < len(latex_code) and balance > 0:
-        if latex_code[end] == '{':
-            balance += 1
-        elif latex_code[end] == '}':
-            balance -= 1
-        end += 1
+    预处理只改写表格的开始标签和列定义（可能去掉其中的换行），以及结束标签，
+    因此开始标签之后的行整体偏移删掉的换行数。
 
-    if balance == 0:
-        return latex_code[start:end-1], start, end-1  # 返回列定义及其索引范围
-    else:
-        return None, None, None  # 括号未正确闭合
-    
-def generate_modified_latex_table_code(original_table_code, max_cols, replace_with='X'):
+    :param table_environment: prepare_table_environment 的结果。
+    :param structure: analyze_table 的分析结果。
+    :param first_line: 表格环境的第一行在文档中的行号。
+    """
+    header_line = 1 if structure is None else original_table_code.count('\n', 0, structure.begin) + 1
+    removed_lines = original_table_code.count('\n') - table_environment.count('\n')
+    total_lines = original_table_code.count('\n') + 1
+
+    def mapper(tex_line):
+        line = tex_line - first_line + 1
+        if line > header_line:
+            line += removed_lines
+        return line if 1 <= line <= total_lines else None
+    return mapper
+
+def generate_modified_latex_table_code(original_table_code, max_cols, replace_with='X', structure=None):
     """
     根据表格类型替换LaTeX代码中的列定义，并根据需要替换表格的开始和结束标签。
 
     :param latex_code: 原始的LaTeX代码。
     :param max_cols: 最大列数。
     :param replace_with: 宽表格中用于填充的字符。
+    :param structure: analyze_table 的分析结果，为None时重新分析。
     :return: 修改后的LaTeX代码。
     """
-    table_type = determine_table_type(original_table_code)
-    original_col_def, start_index, end_index = extract_column_definition_with_indices(original_table_code)
-    if original_col_def is None:
+    if structure is None:
+        structure = analyze_table(original_table_code)
+    if structure is None or structure.env_name != 'tabular':
         return original_table_code  # 如果未找到列定义，返回原始代码
 
-    new_column_definition = create_column_definition(original_col_def, max_cols, table_type, replace_with)
+    table_type = structure.table_type
+    # 去掉竖线，列数不足时在末尾补齐
+    new_column_definition = ''.join(text for text, _ in structure.spec_tokens if text != '|')
+    padding = replace_with if table_type == "wide_table" else 'l'
+    new_column_definition += padding * max(max_cols - structure.spec_columns, 0)
     # 根据表格类型替换表格的开始标签和结束标签
     if table_type == "wide_table":
         start_tag = r"\begin{tabularx}{\textwidth}{"
@@ -146,107 +122,735 @@ def generate_modified_latex_table_code(original_table_code, max_cols, replace_wi
         start_tag = r"\begin{tabular}{"
         end_tag = r"\end{tabular}"
 
-    # 构造新的LaTeX代码
-    before_start_tag = original_table_code[:start_index-len(r"\begin{tabular}{")]
-    after_end_tag = original_table_code[end_index+1:]
-    new_latex_code = before_start_tag + start_tag + new_column_definition + "}" + after_end_tag
-
-    # 替换结束标签
-    new_latex_code = new_latex_code.replace(r"\end{tabular}", end_tag)
-
-    return new_latex_code
-
-def extract_and_save_all_errors(log_file_path):
-    error_pattern = re.compile(r"! .*?^.*?$", re.MULTILINE | re.DOTALL)
-    errors = []
-    
-    with open(log_file_path, 'r',encoding='utf-8') as file:
-        log_content = file.read()
-    
-    error_matches = error_pattern.findall(log_content)
-    for error in error_matches:
-        errors.append(error.strip())
-    
-    if not errors:
-        return ["无错误"]
-    
-    return errors
-
-
-def compile_latex_to_pdf(original_table_code):
-    # 生成 LaTeX 文档
-    
-    temp_dir = os.path.join(settings.BASE_DIR, 'temp')  # 假设你已经在settings.py中定义了BASE_DIR
-    os.makedirs(temp_dir, exist_ok=True)
-
-    result = {"success": False, "error": "初始化错误"}  # 默认返回值
-    max_cols = max(row.count('&') for row in original_table_code.split("\\\\")) + 1
-    modified_latex_code = generate_modified_latex_table_code(original_table_code, max_cols)
-    latex_document = create_latex_document(modified_latex_code)
-
-    # original_col_def_match = re.search(r"\\begin{tabular}{(.*?)}", original_table_code)
-    # original_col_def = original_col_def_match.group(1)
-    # table_type = determine_table_type(original_table_code)
-    # max_cols = max(row.count('&') for row in original_table_code.split("\\\\")) + 1
-    # column_definition = create_column_definition(original_col_def, max_cols, table_type)
-    # table_latex_code = generate_latex_table_code(original_table_code, table_type, column_definition)
-    # latex_document = create_latex_document(table_latex_code)
-    
-    # 使用临时文件来处理LaTeX文档和PDF输出
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".tex", dir=temp_dir) as tex_file:
-        tex_file_path = tex_file.name
-        tex_file.write(latex_document.encode('utf-8'))
-    log_file_path = tex_file_path.replace('.tex', '.log')
-    pdf_file_path = tex_file_path.replace('.tex', '.pdf')  # 定义日志文件路径
-    # 编译LaTeX文档到PDF
+    # 构造新的LaTeX代码，只替换最外层表格的结束标签，嵌套的表格保持不变
+    before_start_tag = original_table_code[:structure.begin]
+    if structure.end is None:
+        body = original_table_code[structure.spec_end + 1:]
+        after_end_tag = ''
+    else:
+        body = original_table_code[structure.spec_end + 1:structure.end_start]
+        after_end_tag = end_tag + original_table_code[structure.end:]
+    return before_start_tag + start_tag + new_column_definition + "}" + body + after_end_tag
+
+@lru_cache(maxsize=None)
+def get_compiler_version():
+    """返回 pdflatex 的版本信息（第一行），用于区分不同编译器生成的缓存。"""
     try:
-        process = subprocess.run(['pdflatex', '-interaction=nonstopmode', tex_file_path],
-                                 check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=temp_dir)
-    
-        # 检查PDF是否生成
-        pdf_file_path = tex_file_path.replace('.tex', '.pdf')
-        
+        process = subprocess.run(['pdflatex', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return 'pdflatex-unavailable'
+    return process.stdout.decode('utf-8', errors='replace').split('\n', 1)[0].strip()
+
+
+@lru_cache(maxsize=None)
+def get_version_tag():
+    """返回由导言区和编译器版本组成的版本标签。"""
+    preamble_hash = hashlib.sha256(create_latex_document('').encode('utf-8')).hexdigest()[:16]
+    return f"{CACHE_FORMAT_VERSION}:{preamble_hash}:{get_compiler_version()}"
+
+
+def compute_cache_key(latex_document):
+    """根据最终的LaTeX文档和版本标签计算缓存key。"""
+    digest = hashlib.sha256()
+    digest.update(get_version_tag().encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(latex_document.encode('utf-8'))
+    return digest.hexdigest()
+
+
+_pdf_cache = None
+
+
+def get_pdf_cache():
+    """返回进程内共享的编译结果缓存，缓存目录在所有 worker 之间共享。"""
+    global _pdf_cache
+    if _pdf_cache is None:
+        _pdf_cache = DiskCache(settings.PDF_CACHE_DIR, settings.PDF_CACHE_MAX_BYTES,
+                               settings.PDF_CACHE_MAX_AGE, suffix='.pdf')
+    return _pdf_cache
+
+
+def load_cached_result(cache_key):
+    cached = get_pdf_cache().read(cache_key)
+    if cached is None:
+        return None
+    meta, pdf_data = cached
+    result = dict(meta['result'])
+    if pdf_data is not None:
+        result['pdf_data'] = pdf_data
+    result['cache_key'] = cache_key
+    result['cached'] = True
+    return result
 
-        if os.path.exists(pdf_file_path):
-            with open(pdf_file_path, 'rb') as pdf_file:
-                pdf_data = pdf_file.read()
-            result = {"success": True, "pdf_data": pdf_data, "message": "编译成功，PDF文件已生成。"}
-        else:
-            result = {"success": False, "error": "PDF文件未生成。"}
 
-    except subprocess.CalledProcessError:
+def store_cached_result(cache_key, result):
+    meta = {'result': {k: v for k, v in result.items() if k != 'pdf_data'}}
+    get_pdf_cache().put(cache_key, result.get('pdf_data'), meta)
+
+
+def prepare_table_environment(original_table_code, structure=None):
+    """
+    对表格代码做列定义等预处理，返回可直接放入文档正文的表格环境。
+
+    :param structure: analyze_table 的分析结果，为None时重新分析。
+    """
+    if structure is None:
+        structure = analyze_table(original_table_code)
+    if structure is None:
+        return original_table_code
+    return generate_modified_latex_table_code(original_table_code, structure.max_cols, structure=structure)
+
+
+def prepare_latex_document(original_table_code):
+    """对表格代码做预处理，并生成完整的LaTeX文档。"""
+    return create_latex_document(prepare_table_environment(original_table_code))
+
+
+# pdflatex 无法加载格式文件时输出的信息，出现时回退到完整文档编译
+FORMAT_FAILURE_MARKERS = ("can't find the format file", "Fatal format file error")
+
+_format_lock = threading.Lock()
+_broken_formats = set()
+
+
+def get_format_name():
+    """格式文件名包含导言区和编译器版本的哈希，导言区或编译器变化后自动失效。"""
+    digest = hashlib.sha256(f"{LATEX_PREAMBLE}\0{get_compiler_version()}".encode('utf-8')).hexdigest()
+    return f"preamble-{digest[:16]}"
+
+
+def ensure_preamble_format(priority=BACKGROUND):
+    """
+    确保导言区已经预编译为格式文件(.fmt)。格式文件不存在时构建一次，
+    其他线程或进程正在构建时不等待，直接返回None让调用方回退到完整编译。
+    构建时运行 pdflatex -ini，与普通编译一样需要先获取编译槽；编译队列已满时放弃本次构建。
+    调用方不能持有编译槽，否则可能占用两个编译槽。
+
+    :param priority: 构建时在编译调度器中的优先级。
+    :return: 格式名称；不可用时返回None。
+    """
+    if not settings.LATEX_PRECOMPILE_PREAMBLE:
+        return None
+    format_name = get_format_name()
+    if format_name in _broken_formats:
+        return None
+    format_dir = settings.LATEX_FORMAT_DIR
+    if os.path.exists(os.path.join(format_dir, format_name + '.fmt')):
+        return format_name
+
+    if not _format_lock.acquire(blocking=False):
+        return None
+    try:
+        os.makedirs(format_dir, exist_ok=True)
+        with open(os.path.join(format_dir, '.build.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None  # 其他进程正在构建
+            if os.path.exists(os.path.join(format_dir, format_name + '.fmt')):
+                return format_name
+            try:
+                with get_scheduler().slot(priority):
+                    built = _build_preamble_format(format_dir, format_name)
+            except SchedulerSaturated:
+                return None  # 机器繁忙，下次编译时再构建
+            if not built:
+                _broken_formats.add(format_name)
+                return None
+        return format_name
+    finally:
+        _format_lock.release()
+
+
+def _build_preamble_format(format_dir, format_name):
+    build_dir = tempfile.mkdtemp(prefix='fmt-', dir=format_dir)
+    try:
+        with open(os.path.join(build_dir, format_name + '.tex'), 'w', encoding='utf-8') as tex_file:
+            tex_file.write(LATEX_PREAMBLE)
         try:
-            errors = extract_and_save_all_errors(log_file_path)
-        except UnicodeDecodeError as decode_error:
-            errors = [f"日志文件解码错误: {decode_error}"]
-        if os.path.exists(pdf_file_path):
-            # 编译过程中出现错误，但PDF文件仍然生成了
-            with open(pdf_file_path, 'rb') as pdf_file:
-                pdf_data = pdf_file.read()
-            result = {
-                "success": True, 
-                "pdf_data": pdf_data, 
-                "message": "编译出错，但PDF文件已生成，请查看错误信息。",
-                "errors": errors
-            }
+            with open(os.path.join(build_dir, format_name + '.stdout'), 'wb') as stdout_file:
+                returncode, error_type = run_limited(
+                    ['pdflatex', '-ini', '-interaction=nonstopmode', f'-jobname={format_name}',
+                     f'&pdflatex {format_name}.tex\\dump'],
+                    build_dir, stdout_file,
+                )
+        except OSError:
+            return False
+        if returncode != 0 or error_type is not None:
+            return False
+        built_path = os.path.join(build_dir, format_name + '.fmt')
+        if not os.path.exists(built_path):
+            return False
+        os.replace(built_path, os.path.join(format_dir, format_name + '.fmt'))
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    # 清理旧版本导言区的格式文件
+    for name in os.listdir(format_dir):
+        if name.startswith('preamble-') and name.endswith('.fmt') and name != format_name + '.fmt':
+            try:
+                os.remove(os.path.join(format_dir, name))
+            except OSError:
+                pass
+    return True
+
+
+def run_preflight(original_table_code, structure=None):
+    """
+    执行编译前检查（settings.LATEX_PREFLIGHT 为False时跳过）。
+
+    :return: 发现错误时返回 preflight_result 生成的编译结果，否则返回None。
+    """
+    if not settings.LATEX_PREFLIGHT:
+        return None
+    issues = preflight_check(original_table_code, structure)
+    if has_fatal_issues(issues):
+        return preflight_result(issues)
+    return None
+
+
+def compile_latex_to_pdf(original_table_code, use_cache=True, priority=INTERACTIVE):
+    """
+    编译表格代码为PDF。相同文档的编译结果会从磁盘缓存中直接返回。
+
+    :param original_table_code: 原始的表格LaTeX代码。
+    :param use_cache: 是否读写编译结果缓存。
+    :param priority: 缓存未命中时在编译调度器中的优先级，INTERACTIVE 或 BACKGROUND。
+    :return: 编译结果字典，cache_key 为该文档的缓存key。预检查发现错误时不调用 pdflatex，
+             error_type 为 ERROR_PREFLIGHT，issues 为 preflight_check 的检查结果。
+    :raises SchedulerSaturated: 编译队列已满。
+    """
+    structure = analyze_table(original_table_code)
+    table_environment = prepare_table_environment(original_table_code, structure)
+    latex_document = create_latex_document(table_environment)
+    cache_key = compute_cache_key(latex_document)
+    preflight_failure = run_preflight(original_table_code, structure)
+    if preflight_failure is not None:
+        preflight_failure['cache_key'] = cache_key
+        preflight_failure['cached'] = False
+        return preflight_failure
+    if use_cache:
+        cached_result = load_cached_result(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+    result = None
+    format_name = ensure_preamble_format(priority)
+    with get_scheduler().slot(priority):
+        if format_name is not None:
+            result = compile_latex_document(
+                create_latex_body(table_environment), format_name,
+                table_line_mapper(original_table_code, table_environment, structure, table_first_line(format_name)),
+            )
+            if result is None:
+                # 格式文件损坏或与当前编译器不兼容，后续编译不再使用
+                _broken_formats.add(format_name)
+        if result is None:
+            result = compile_latex_document(
+                latex_document, line_mapper=table_line_mapper(
+                    original_table_code, table_environment, structure, table_first_line()),
+            )
+
+    # 超时或资源超限的结果不缓存，可能只是机器繁忙
+    if use_cache and result.get('error_type') is None:
+        store_cached_result(cache_key, result)
+    result['cache_key'] = cache_key
+    result['cached'] = False
+    return result
+
+
+# 编译因超时或资源超限被终止时结果中 error_type 的取值
+ERROR_TIMEOUT = 'timeout'
+ERROR_CPU_LIMIT = 'cpu_limit'
+ERROR_MEMORY_LIMIT = 'memory_limit'
+ERROR_OUTPUT_LIMIT = 'output_limit'
+ERROR_KILLED = 'killed'
+
+RESOURCE_ERROR_MESSAGES = {
+    ERROR_TIMEOUT: "编译超时，已终止。",
+    ERROR_CPU_LIMIT: "编译占用的CPU时间超过限制，已终止。",
+    ERROR_MEMORY_LIMIT: "编译占用的内存超过限制，已终止。",
+    ERROR_OUTPUT_LIMIT: "编译输出的文件超过大小限制，已终止。",
+    ERROR_KILLED: "编译进程被系统终止（可能是内存不足）。",
+}
+
+# 这些原因导致的失败可能只是机器繁忙，不缓存也不作为预编译结果使用，再次请求时重新编译
+RETRYABLE_ERROR_TYPES = frozenset(RESOURCE_ERROR_MESSAGES)
+
+# pdflatex 内存分配失败时的输出
+MEMORY_FAILURE_MARKERS = ("memory exhausted", "Cannot allocate memory", "out of memory")
+
+
+# 设置资源上限后 exec 实际的命令。在 exec 之前的子进程中调用 Python 代码（preexec_fn）
+# 在有其他线程的进程中可能死锁，因此由 shell 设置：超过CPU软限制时收到 SIGXCPU，
+# 再超过一秒被 SIGKILL；ulimit -v 的单位为 KiB，-f 的单位为512字节
+LIMIT_WRAPPER = ('ulimit -S -t "$1" && ulimit -H -t "$2" && ulimit -v "$3" && ulimit -f "$4" '
+                 '&& shift 4 && exec "$@"')
+
+
+def limited_command(command, cpu_limit=None):
+    """
+    返回在资源限制下运行 command 的命令：CPU时间、内存和输出文件大小。
+    没有 resource 模块的平台（Windows）不支持这些限制，原样返回。
+
+    :param cpu_limit: CPU时间上限（秒），默认 LATEX_COMPILE_CPU_LIMIT。
+    """
+    if resource is None:
+        return list(command)
+    cpu_limit = int(cpu_limit or settings.LATEX_COMPILE_CPU_LIMIT)
+    memory_kib = max(settings.LATEX_COMPILE_MEMORY_LIMIT // 1024, 1)
+    output_blocks = max(settings.LATEX_COMPILE_OUTPUT_LIMIT // 512, 1)
+    return ['/bin/sh', '-c', LIMIT_WRAPPER, 'sh', str(cpu_limit), str(cpu_limit + 1), str(memory_kib),
+            str(output_blocks), *command]
+
+
+def _kill_process_group(process):
+    """终止子进程及其创建的所有进程。"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
         else:
-            # 编译失败，且PDF文件未生成
-            result = {
-                "success": False, 
-                "message": "编译出错，PDF文件未生成，请查看错误信息。",
-                "errors": errors
-            }
-# 在 finally 块之后返回结果
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.wait()
+
+
+def run_limited(command, cwd, stdout, env=None, timeout=None, cpu_limit=None):
+    """
+    在独立的进程组中运行外部命令，限制运行时间、CPU时间、内存和输出文件大小。
+    超时时终止整个进程组。
+
+    :param stdout: 写入标准输出和标准错误的文件。输出写入文件而不是管道，大小同样受输出限制约束。
+    :param timeout: 运行时间上限（秒），默认 LATEX_COMPILE_TIMEOUT。
+    :param cpu_limit: CPU时间上限（秒），默认 LATEX_COMPILE_CPU_LIMIT。
+    :return: (returncode, error_type) 元组，正常结束时 error_type 为None。
+    """
+    timeout = timeout or settings.LATEX_COMPILE_TIMEOUT
+    process = subprocess.Popen(limited_command(command, cpu_limit), stdout=stdout, stderr=subprocess.STDOUT,
+                               cwd=cwd, env=env, start_new_session=True)
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(process)
+        return process.returncode, ERROR_TIMEOUT
+    except BaseException:
+        _kill_process_group(process)
+        raise
+    return returncode, classify_exit(returncode)
+
+
+def classify_exit(returncode):
+    """
+    根据退出码判断子进程是否因资源超限被终止，返回 error_type 或None。
+    只有 SIGXCPU 表示超过了CPU时间限制；其他原因的 SIGKILL（例如系统内存不足）
+    无法确定原因，作为 ERROR_KILLED 返回。超时由调用方判断。
+    """
+    if returncode == -getattr(signal, 'SIGXCPU', 0):
+        return ERROR_CPU_LIMIT
+    if returncode == -getattr(signal, 'SIGXFSZ', 0):
+        return ERROR_OUTPUT_LIMIT
+    if returncode == -getattr(signal, 'SIGKILL', 0):
+        return ERROR_KILLED
+    return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def resource_error_result(error_type):
+    return {
+        "success": False,
+        "error_type": error_type,
+        "message": RESOURCE_ERROR_MESSAGES[error_type],
+        "errors": [],
+    }
+
+
+@contextmanager
+def run_pdflatex(latex_source, format_name=None, timeout=None, cpu_limit=None, draft=False):
+    """
+    在临时目录中运行一次 pdflatex，退出上下文时清理所有生成的文件。
+    运行时间和资源受 run_limited 限制。
+
+    :param latex_source: 文档源码；指定 format_name 时只包含正文。
+    :param format_name: 预编译的导言区格式名称。
+    :param timeout: 运行时间上限（秒），默认 LATEX_COMPILE_TIMEOUT。
+    :param cpu_limit: CPU时间上限（秒），默认 LATEX_COMPILE_CPU_LIMIT。
+    :param draft: 是否使用 -draftmode，只检查能否编译，不生成PDF。
+    :return: 包含 returncode、stdout、pdf_path、log_path 和 error_type 的字典；
+             error_type 不为None时编译被终止，生成的文件可能不完整。
+    """
+    command, env, job_dir, tex_file_path = prepare_pdflatex_run(latex_source, format_name, draft)
+    try:
+        with open(tex_file_path.replace('.tex', '.stdout'), 'wb') as stdout_file:
+            returncode, error_type = run_limited(command, job_dir, stdout_file, env, timeout, cpu_limit)
+        yield collect_pdflatex_run(tex_file_path, returncode, error_type)
     finally:
-        # 清理生成的辅助文件
-        for ext in ['.aux', '.log', '.out', '.tex', '.pdf']:
-            file_to_remove = tex_file_path.replace('.tex', ext)
-            if os.path.exists(file_to_remove):
-                os.remove(file_to_remove)
+        remove_scratch_dir(job_dir)
+
 
+def prepare_pdflatex_run(latex_source, format_name=None, draft=False):
+    """
+    在本次编译独立的临时目录中写入 .tex 文件，调用方负责通过 remove_scratch_dir 删除该目录。
+
+    :return: (命令, 环境变量, 临时目录, tex文件路径) 元组。
+    """
+    job_dir = create_scratch_dir()
+    command = ['pdflatex', '-interaction=nonstopmode']
+    if draft:
+        command.append('-draftmode')
+    env = None
+    if format_name is not None:
+        command.append(f'-fmt={format_name}')
+        # 末尾的分隔符表示在自定义目录之后继续搜索默认路径
+        env = dict(os.environ, TEXFORMATS=settings.LATEX_FORMAT_DIR + os.pathsep)
+
+    # 生成的PDF、日志等文件都在该目录中，编译结束后整个目录一起删除
+    tex_file_path = os.path.join(job_dir, 'document.tex')
+    try:
+        with open(tex_file_path, 'wb') as tex_file:
+            tex_file.write(latex_source.encode('utf-8'))
+    except BaseException:
+        remove_scratch_dir(job_dir)
+        raise
+    return command + [tex_file_path], env, job_dir, tex_file_path
+
+
+def collect_pdflatex_run(tex_file_path, returncode, error_type):
+    """读取 pdflatex 的输出，返回 run_pdflatex 产生的字典。"""
+    stdout_path = tex_file_path.replace('.tex', '.stdout')
+    with open(stdout_path, 'r', encoding='utf-8', errors='replace') as stdout_file:
+        stdout = stdout_file.read()
+    pdf_path = tex_file_path.replace('.tex', '.pdf')
+    log_path = tex_file_path.replace('.tex', '.log')
+    if error_type is None and returncode != 0:
+        if any(marker in stdout for marker in MEMORY_FAILURE_MARKERS):
+            error_type = ERROR_MEMORY_LIMIT
+        elif any(_file_size(path) >= settings.LATEX_COMPILE_OUTPUT_LIMIT
+                 for path in (pdf_path, log_path, stdout_path)):
+            # 写入失败而不是被 SIGXFSZ 终止时（例如忽略了该信号），通过文件大小判断
+            error_type = ERROR_OUTPUT_LIMIT
+    return {
+        "returncode": returncode,
+        "stdout": stdout,
+        "pdf_path": pdf_path,
+        "log_path": log_path,
+        "error_type": error_type,
+    }
+
+
+def compile_latex_document(latex_document, format_name=None, line_mapper=None):
+    """
+    调用 pdflatex 编译一份LaTeX文档。
+
+    :param latex_document: 文档源码；指定 format_name 时只包含正文。
+    :param format_name: 预编译的导言区格式名称。
+    :param line_mapper: 将文档行号映射为原始代码行号的函数，见 table_line_mapper。
+    :return: 编译结果字典；格式文件无法加载时返回None。
+             编译被终止时结果中 error_type 为终止原因（ERROR_TIMEOUT 等）。
+    """
+    with run_pdflatex(latex_document, format_name) as run:
+        return document_result(run, format_name, line_mapper)
+
+
+def document_result(run, format_name=None, line_mapper=None):
+    """
+    根据 run_pdflatex 产生的字典生成编译结果，需要在清理临时文件之前调用。
+    errors 为 log_parser 解析出的错误记录，errors_truncated 表示错误数超过了 LATEX_LOG_MAX_ERRORS。
+    """
+    if run['error_type'] is not None:
+        # 被终止时生成的PDF可能不完整，不返回
+        return resource_error_result(run['error_type'])
+
+    pdf_data = None
+    if os.path.exists(run['pdf_path']):
+        with open(run['pdf_path'], 'rb') as pdf_file:
+            pdf_data = pdf_file.read()
+
+    if run['returncode'] == 0:
+        if pdf_data is not None:
+            return {"success": True, "pdf_data": pdf_data, "message": "编译成功，PDF文件已生成。"}
+        return {"success": False, "error": "PDF文件未生成。"}
+
+    if format_name is not None and any(marker in run['stdout'] for marker in FORMAT_FAILURE_MARKERS):
+        return None
+    errors, truncated = parse_log_file(run['log_path'], line_mapper=line_mapper)
+
+    if pdf_data is not None:
+        # 编译过程中出现错误，但PDF文件仍然生成了
+        return {
+            "success": True,
+            "pdf_data": pdf_data,
+            "message": "编译出错，但PDF文件已生成，请查看错误信息。",
+            "errors": errors,
+            "errors_truncated": truncated,
+        }
+    # 编译失败，且PDF文件未生成
+    return {
+        "success": False,
+        "message": "编译出错，PDF文件未生成，请查看错误信息。",
+        "errors": errors,
+        "errors_truncated": truncated,
+    }
+
+
+def validate_latex_document(latex_document, format_name=None, line_mapper=None):
+    """
+    以 -draftmode 运行 pdflatex，只检查文档能否编译，不生成PDF。参数与 compile_latex_document 相同。
+
+    :return: 校验结果字典；格式文件无法加载时返回None。
+    """
+    with run_pdflatex(latex_document, format_name, draft=True) as run:
+        if run['error_type'] is not None:
+            return resource_error_result(run['error_type'])
+        if run['returncode'] == 0:
+            return {"success": True, "message": "校验通过。", "errors": []}
+        if format_name is not None and any(marker in run['stdout'] for marker in FORMAT_FAILURE_MARKERS):
+            return None
+        errors, truncated = parse_log_file(run['log_path'], line_mapper=line_mapper)
+        return {"success": False, "message": "校验失败，请查看错误信息。", "errors": errors,
+                "errors_truncated": truncated}
+
+
+def validate_latex(original_table_code, priority=BACKGROUND):
+    """
+    检查表格代码能否编译而不生成PDF，用于批量筛选数据。
+    先做预检查，通过后以 -draftmode 运行 pdflatex，省去生成PDF的开销；结果不写入编译缓存。
+
+    :param original_table_code: 原始的表格LaTeX代码。
+    :param priority: 在编译调度器中的优先级。
+    :return: 校验结果字典，包含 success、message、errors 和 error_type，
+             warnings 为预检查给出的警告。
+    :raises SchedulerSaturated: 编译队列已满。
+    """
+    structure = analyze_table(original_table_code)
+    issues = preflight_check(original_table_code, structure) if settings.LATEX_PREFLIGHT else []
+    if has_fatal_issues(issues):
+        result = preflight_result(issues)
+    else:
+        table_environment = prepare_table_environment(original_table_code, structure)
+        result = None
+        format_name = ensure_preamble_format(priority)
+        with get_scheduler().slot(priority):
+            if format_name is not None:
+                result = validate_latex_document(
+                    create_latex_body(table_environment), format_name,
+                    table_line_mapper(original_table_code, table_environment, structure, table_first_line(format_name)),
+                )
+                if result is None:
+                    _broken_formats.add(format_name)
+            if result is None:
+                result = validate_latex_document(
+                    create_latex_document(table_environment), line_mapper=table_line_mapper(
+                        original_table_code, table_environment, structure, table_first_line()),
+                )
+    result.setdefault('error_type', None)
+    result['warnings'] = [format_issue(issue) for issue in issues if issue['severity'] == SEVERITY_WARNING]
     return result
 
 
+BATCH_MARKER_PATTERN = re.compile(r"^BATCHITEM:(BEGIN|END):(\d+):(-?\d+)$")
+
+
+def create_batch_body(table_environments):
+    """
+    将多个表格放入同一份文档，每个表格从新的一页开始。
+    表格前后通过 \\typeout 在日志中写入标记，用于还原每个表格的页码范围和错误归属。
+
+    :return: (正文, 每个表格环境的第一行在正文中的行号列表)。
+    """
+    parts = ["    \\begin{document}"]
+    first_lines = []
+    line = 2  # 下一部分在正文中的起始行号
+    for index, table_environment in enumerate(table_environments):
+        prefix = rf'''    \clearpage
+    \typeout{{BATCHITEM:BEGIN:{index}:\the\value{{page}}}}
+    \begingroup
+    '''
+        suffix = rf'''
+    \endgroup
+    \clearpage
+    \typeout{{BATCHITEM:END:{index}:\the\numexpr\value{{page}}-1\relax}}'''
+        part = prefix + table_environment + suffix
+        first_lines.append(line + prefix.count('\n'))
+        parts.append(part)
+        line += part.count('\n') + 1
+    parts.append("    \\end{document}\n")
+    return "\n".join(parts), first_lines
+
+
+def parse_batch_log(log_file_path, item_count, line_mappers=None):
+    """
+    逐行解析批量编译的日志，按标记把错误归属到对应的表格。
+
+    :param line_mappers: 每个表格的行号映射函数（见 table_line_mapper），参数为文档中的行号。
+    :return: (每个表格的信息列表, 不属于任何表格的错误列表)。
+             表格信息包含 begin、end 页码，errors 错误记录列表和 errors_truncated，未出现的标记为None。
+    """
+    max_errors = settings.LATEX_LOG_MAX_ERRORS
+    items = [{"begin": None, "end": None, "errors": [], "errors_truncated": False} for _ in range(item_count)]
+    orphan_errors = []
+    current = None
+    parser = TexErrorParser()
+
+    def add_error(record):
+        if record is None:
+            return
+        if current is None:
+            if len(orphan_errors) < max_errors:
+                orphan_errors.append(record)
+            return
+        item = items[current]
+        if len(item["errors"]) >= max_errors:
+            item["errors_truncated"] = True
+            return
+        if line_mappers is not None and record["line"] is not None:
+            record["source_line"] = line_mappers[current](record["line"])
+        item["errors"].append(record)
+
+    with open(log_file_path, 'r', encoding='utf-8', errors='replace') as log_file:
+        for line in log_file:
+            line = line.rstrip('\n')
+            marker = BATCH_MARKER_PATTERN.match(line)
+            if marker:
+                add_error(parser.flush())
+                kind, index, page = marker.group(1), int(marker.group(2)), int(marker.group(3))
+                if index >= item_count:
+                    continue
+                if kind == 'BEGIN':
+                    items[index]["begin"] = page
+                    current = index
+                else:
+                    items[index]["end"] = page
+                    current = None
+            else:
+                add_error(parser.feed(line))
+    add_error(parser.flush())
+    return items, orphan_errors
+
+
+def _shift_line(mapper, shift, tex_line):
+    return mapper(tex_line - shift)
+
+
+def _compile_batch_once(table_environments, format_name, priority, line_mappers=None):
+    """
+    单次编译一批表格。
+
+    :param line_mappers: 每个表格的行号映射函数，参数为表格环境内的行号。
+    :return: (PDF数据, 表格信息列表, 游离错误列表)；批次被破坏（没有生成PDF或
+             有表格未编译完成）时返回None。
+    """
+    body, first_lines = create_batch_body(table_environments)
+    source = body if format_name is not None else LATEX_PREAMBLE + body
+    document_mappers = None
+    if line_mappers is not None:
+        # 换算为表格环境内的行号后再映射
+        offset = 0 if format_name is not None else LATEX_PREAMBLE.count('\n')
+        document_mappers = [partial(_shift_line, mapper, first_line + offset - 1)
+                            for mapper, first_line in zip(line_mappers, first_lines)]
+    with get_scheduler().slot(priority), \
+            run_pdflatex(source, format_name, settings.LATEX_BATCH_TIMEOUT, settings.LATEX_BATCH_TIMEOUT) as run:
+        if run['error_type'] is not None:
+            return None
+        if not os.path.exists(run['pdf_path']) or not os.path.exists(run['log_path']):
+            return None
+        items, orphan_errors = parse_batch_log(run['log_path'], len(table_environments), document_mappers)
+        if any(item["end"] is None for item in items):
+            return None
+        with open(run['pdf_path'], 'rb') as pdf_file:
+            pdf_data = pdf_file.read()
+    return pdf_data, items, orphan_errors
+
+
+def compile_latex_batch(original_table_codes, priority=BACKGROUND):
+    """
+    在一次 pdflatex 运行中编译多个表格，每个表格占独立的页面。
+    如果某个表格破坏了整个批次，则对批次二分后分别编译，直到定位到出错的表格，
+    单个表格退回到 compile_latex_to_pdf 编译。预检查未通过的表格直接返回预检查的结果。
+
+    :param original_table_codes: 原始表格代码列表。
+    :param priority: 在编译调度器中的优先级，每次 pdflatex 运行单独排队。
+    :return: 结果字典，documents 为PDF数据列表；items 中每项的 document 为所在PDF的下标，
+             pages 为 [起始页, 结束页]（为None时表示整份文档）。
+    """
+    structures = [analyze_table(code) for code in original_table_codes]
+    table_environments = [prepare_table_environment(code, structure)
+                          for code, structure in zip(original_table_codes, structures)]
+    # 表格环境内的行号到原始代码行号的映射
+    line_mappers = [table_line_mapper(code, environment, structure, 1)
+                    for code, environment, structure in zip(original_table_codes, table_environments, structures)]
+    format_name = ensure_preamble_format(priority)
+    documents = []
+    results = [None] * len(original_table_codes)
+
+    def single_result(single):
+        document = None
+        if single.get('pdf_data') is not None:
+            documents.append(single['pdf_data'])
+            document = len(documents) - 1
+        return {
+            "success": single.get('success', False),
+            "document": document,
+            "pages": None,
+            "message": single.get('message', single.get('error', '')),
+            "errors": single.get('errors', []),
+            "errors_truncated": single.get('errors_truncated', False),
+            "error_type": single.get('error_type'),
+        }
+
+    # 预检查未通过的表格不放入批次，避免明显错误的表格破坏批次后反复二分
+    pending = []
+    for index, (code, structure) in enumerate(zip(original_table_codes, structures)):
+        preflight_failure = run_preflight(code, structure)
+        if preflight_failure is None:
+            pending.append(index)
+        else:
+            results[index] = single_result(preflight_failure)
+
+    def compile_range(start, end):
+        indices = pending[start:end]
+        if end - start == 1:
+            results[indices[0]] = single_result(
+                compile_latex_to_pdf(original_table_codes[indices[0]], priority=priority))
+            return
+
+        compiled = _compile_batch_once([table_environments[index] for index in indices], format_name, priority,
+                                       [line_mappers[index] for index in indices])
+        if compiled is None:
+            middle = (start + end) // 2
+            compile_range(start, middle)
+            compile_range(middle, end)
+            return
+
+        pdf_data, items, orphan_errors = compiled
+        documents.append(pdf_data)
+        for index, item in zip(indices, items):
+            has_pages = item["begin"] is not None and item["end"] >= item["begin"]
+            results[index] = {
+                "success": has_pages,
+                "document": len(documents) - 1 if has_pages else None,
+                "pages": [item["begin"], item["end"]] if has_pages else None,
+                "message": "编译出错，但PDF文件已生成，请查看错误信息。" if item["errors"] else "编译成功，PDF文件已生成。",
+                "errors": item["errors"],
+                "errors_truncated": item["errors_truncated"],
+                "error_type": None,
+            }
+        if orphan_errors:
+            # 无法归属到具体表格的错误附加到该批次的第一个表格
+            results[indices[0]]["errors"] = orphan_errors + results[indices[0]]["errors"]
+
+    if pending:
+        compile_range(0, len(pending))
+    return {"documents": documents, "items": results}
+
+
 
 # def process_latex_codes_from_json(json_file_path):
 #     """
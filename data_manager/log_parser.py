@@ -0,0 +1,116 @@
+"""
+pdflatex 日志的流式解析。
+
+逐行读取 .log 文件，不把整个日志读入内存。以 "! " 开头的行是一个错误的开始，
+之后 TeX 用 "l.<行号> ..." 报告出错的行和出错位置前后的内容。每个错误记录包含：
+
+- message：错误信息（"! " 之后的内容）；
+- line：TeX 报告的行号（文档中的行号），没有时为None；
+- context：出错位置的上下文（"l.<行号>" 行及其下一行）；
+- source_line：映射回原始表格代码（pred_tex_code）中的行号，不在表格代码中时为None。
+
+收集到 max_errors 个错误后停止读取，很长的日志也只读取开头的一部分。
+"""
+import re
+
+from django.conf import settings
+
+ERROR_LOCATION_PATTERN = re.compile(r"^l\.(\d+)(?: |$)")
+# 错误信息之后最多向后查找多少行来定位 l.<行号>，超过时该错误没有行号
+MAX_ERROR_LINES = 20
+
+
+def make_error(message, line=None, context='', source_line=None):
+    return {"message": message, "line": line, "context": context, "source_line": source_line}
+
+
+class TexErrorParser:
+    """
+    逐行解析 TeX 日志中的错误。
+
+    :param line_mapper: 将文档行号映射为原始表格代码行号的函数，返回None表示不在表格代码中。
+    """
+
+    def __init__(self, line_mapper=None):
+        self.line_mapper = line_mapper
+        self._current = None
+        self._lines_seen = 0
+        self._awaiting_context = False
+
+    def feed(self, line):
+        """
+        处理一行日志（不含换行符）。
+
+        :return: 因这一行而结束的错误记录，没有时返回None。
+        """
+        if line.startswith('! '):
+            finished = self.flush()
+            self._current = make_error(line[2:].strip())
+            return finished
+        if self._current is None:
+            return None
+        if self._awaiting_context:
+            # l.<行号> 的下一行是出错位置之后尚未读取的内容
+            if line.strip():
+                self._current["context"] += "\n" + line
+            return self.flush()
+
+        match = ERROR_LOCATION_PATTERN.match(line)
+        if match:
+            tex_line = int(match.group(1))
+            self._current["line"] = tex_line
+            self._current["context"] = line
+            if self.line_mapper is not None:
+                self._current["source_line"] = self.line_mapper(tex_line)
+            self._awaiting_context = True
+            return None
+        self._lines_seen += 1
+        if self._lines_seen > MAX_ERROR_LINES:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """结束当前的错误并返回，没有时返回None。"""
+        finished = self._current
+        self._current = None
+        self._lines_seen = 0
+        self._awaiting_context = False
+        return finished
+
+
+def parse_log_lines(lines, max_errors=None, line_mapper=None):
+    """
+    从日志行中收集错误。
+
+    :param lines: 日志行的可迭代对象，可以带换行符。
+    :param max_errors: 最多收集的错误数，默认 settings.LATEX_LOG_MAX_ERRORS。
+    :return: (错误记录列表, 是否因达到 max_errors 而截断)。
+    """
+    if max_errors is None:
+        max_errors = settings.LATEX_LOG_MAX_ERRORS
+    parser = TexErrorParser(line_mapper)
+    errors = []
+    for line in lines:
+        record = parser.feed(line.rstrip('\r\n'))
+        if record is not None:
+            if len(errors) >= max_errors:
+                return errors, True
+            errors.append(record)
+    record = parser.flush()
+    if record is not None:
+        if len(errors) >= max_errors:
+            return errors, True
+        errors.append(record)
+    return errors, False
+
+
+def parse_log_file(log_path, max_errors=None, line_mapper=None):
+    """
+    流式读取日志文件并收集错误，参数和返回值与 parse_log_lines 相同。
+    日志不是合法的 UTF-8 时替换无法解码的字符；文件不存在时返回空列表。
+    """
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as log_file:
+            return parse_log_lines(log_file, max_errors, line_mapper)
+    except FileNotFoundError:
+        return [], False
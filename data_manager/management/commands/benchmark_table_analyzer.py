@@ -0,0 +1,205 @@
+"""
+表格预处理的微基准测试：比较按字符串切分的旧实现与 table_analyzer 的单次扫描实现。
+
+用法：
+    python manage.py benchmark_table_analyzer
+    python manage.py benchmark_table_analyzer tables.json --repeat 20
+
+不指定数据文件时使用生成的表格（不同行数、列数，含 \\multicolumn 和注释）。
+除耗时外还会输出两种实现生成的列定义不同的表格数量。
+
+新实现比旧实现慢：生成的表格上加速比约0.5，不含注释和转义字符的普通表格约0.5~0.8。
+旧实现只按 \\\\ 切分再数 &，不处理注释、转义字符、\\multicolumn 和嵌套分组，结果在这些情况下
+是错的；新实现多出的几遍扫描都用于这些情况。每个表格只在编译前分析一次，数千字符的表格耗时
+为几十微秒，与一次 pdflatex 编译相比可以忽略。
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data_manager.ingest import iter_file_chunks, iter_json_array
+from data_manager.latex_compiler import prepare_table_environment
+
+LEGACY_TAGS = {
+    "wide_table": (r"\begin{tabularx}{\textwidth}{", r"\end{tabularx}"),
+    "longtable": (r"\begin{longtable}{", r"\end{longtable}"),
+    "standard": (r"\begin{tabular}{", r"\end{tabular}"),
+}
+
+
+# 以下为改用 table_analyzer 之前 latex_compiler 中的实现，作为基准保留在这里
+def determine_table_type(table_latex_code):
+    long_table_threshold = 30
+    wide_table_threshold = 6
+
+    rows = table_latex_code.split("\\\\")
+    max_cols = max(row.count('&') for row in rows) + 1
+
+    if len(rows) > long_table_threshold:
+        return "longtable"
+    elif max_cols > wide_table_threshold:
+        return "wide_table"
+    else:
+        return "standard"
+
+
+def extract_and_preserve_at_contents(original_def):
+    at_contents = []
+    non_at_parts = []
+    i = 0
+    while i < len(original_def):
+        if original_def[i:i+2] == "@{":  # 检测到@{开始
+            start = i
+            i += 2  # 跳过"@{"
+            balance = 1  # 跟踪括号平衡
+            while i < len(original_def) and balance > 0:
+                if original_def[i] == "{":
+                    balance += 1
+                elif original_def[i] == "}":
+                    balance -= 1
+                i += 1
+            at_contents.append(original_def[start:i])  # 包括闭合的}
+        else:
+            start = i
+            while i < len(original_def) and not (original_def[i] == "@" and original_def[i+1:i+2] == "{"):
+                i += 1
+            non_at_parts.append(original_def[start:i])
+
+    # 移除空字符串
+    non_at_parts = [part for part in non_at_parts if part.strip()]
+    return at_contents, non_at_parts
+
+
+def create_column_definition(original_def, max_cols, table_type, replace_with='X'):
+    at_contents, non_at_parts = extract_and_preserve_at_contents(original_def)
+
+    # 初始化新的列定义列表
+    new_col_defs = []
+    # 计算已经存在的列数（考虑到@{}内容不计入列数）
+    existing_cols = sum(len(part.replace('|', '')) for part in non_at_parts)
+
+    # 交错重组@{}内容和非@{}内容
+    for i, non_at_part in enumerate(non_at_parts):
+        new_col_defs.extend(list(non_at_part.replace('|', '')))  # 添加非@{}部分
+
+        if i < len(at_contents):
+            new_col_defs.append(at_contents[i])  # 添加@{}内容
+
+    # 检查是否需要添加额外的列来满足max_cols的要求
+    while existing_cols < max_cols:
+        if table_type == "wide_table":
+            # 对于宽表格，在末尾添加replace_with（通常为'X'）
+            new_col_defs.append(replace_with)
+        else:
+            # 对于其他类型的表格，使用'l'填充剩余的列
+            new_col_defs.append('l')
+        existing_cols += 1  # 更新现有的列数
+
+    return ''.join(new_col_defs)
+
+
+def extract_column_definition_with_indices(latex_code):
+    """
+    从LaTeX代码中提取列定义及其在字符串中的位置。
+
+    :param latex_code: 包含 LaTeX 表格定义的字符串。
+    :return: 列定义字符串及其开始和结束索引的元组。如果未找到，返回None。
+    """
+    start = latex_code.find(r"\begin{tabular}{")
+    if start == -1:
+        return None, None, None  # 未找到 \begin{tabular}{
+
+    start += len(r"\begin{tabular}{")
+    end = start
+    balance = 1  # 初始时，我们已经遇到了一个左大括号
+
+    while end < len(latex_code) and balance > 0:
+        if latex_code[end] == '{':
+            balance += 1
+        elif latex_code[end] == '}':
+            balance -= 1
+        end += 1
+
+    if balance == 0:
+        return latex_code[start:end-1], start, end-1  # 返回列定义及其索引范围
+    else:
+        return None, None, None  # 括号未正确闭合
+
+
+def legacy_prepare_table_environment(original_table_code):
+    """改为单次扫描之前的预处理流程。"""
+    max_cols = max(row.count('&') for row in original_table_code.split("\\\\")) + 1
+    table_type = determine_table_type(original_table_code)
+    original_col_def, start_index, end_index = extract_column_definition_with_indices(original_table_code)
+    if original_col_def is None:
+        return original_table_code
+    new_column_definition = create_column_definition(original_col_def, max_cols, table_type)
+    start_tag, end_tag = LEGACY_TAGS[table_type]
+    new_latex_code = (original_table_code[:start_index - len(r"\begin{tabular}{")] + start_tag
+                      + new_column_definition + "}" + original_table_code[end_index + 1:])
+    return new_latex_code.replace(r"\end{tabular}", end_tag)
+
+
+def generate_tables():
+    """生成不同规模的表格。"""
+    tables = []
+    for rows, cols in [(3, 3), (10, 5), (30, 8), (100, 6), (500, 12), (2000, 10)]:
+        header = r"\multicolumn{%d}{c}{Title 50\%% \& more} \\ \hline" % cols
+        body = "\n".join(
+            " & ".join(f"r{row}c{col} {{\\bf x}}" for col in range(cols)) + r" \\ % note & ignored"
+            for row in range(rows)
+        )
+        tables.append(f"\\begin{{tabular}}{{|{'c|' * cols}}}\n{header}\n{body}\n\\end{{tabular}}")
+    return tables
+
+
+class Command(BaseCommand):
+    help = '比较表格预处理新旧实现的耗时。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='tables.json 路径，默认使用生成的表格')
+        parser.add_argument('--repeat', type=int, default=10, help='每种实现重复处理全部表格的次数')
+
+    def load_tables(self, source):
+        if source is None:
+            return generate_tables()
+        try:
+            with open(source, 'rb') as json_file:
+                return [item['pred_tex_code'] for item in iter_json_array(iter_file_chunks(json_file))
+                        if item.get('pred_tex_code')]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'读取JSON文件失败: {e}')
+
+    def measure(self, function, tables, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for table in tables:
+                function(table)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        tables = self.load_tables(options['source'])
+        if not tables:
+            raise CommandError('没有可用的表格代码')
+        total_chars = sum(len(table) for table in tables)
+        self.stdout.write(f'{len(tables)} 个表格，共 {total_chars} 个字符，重复 {options["repeat"]} 次取最短耗时')
+
+        results = {}
+        for name, function in [('legacy', legacy_prepare_table_environment), ('analyzer', prepare_table_environment)]:
+            elapsed = self.measure(function, tables, options['repeat'])
+            results[name] = elapsed
+            self.stdout.write(
+                f'{name:>9}: {elapsed * 1000:.2f} ms  '
+                f'{elapsed * 1e6 / len(tables):.1f} us/表格  {total_chars / elapsed / 1e6:.1f} M字符/秒'
+            )
+        self.stdout.write(f'加速比: {results["legacy"] / results["analyzer"]:.2f}x')
+
+        changed = sum(1 for table in tables
+                      if legacy_prepare_table_environment(table) != prepare_table_environment(table))
+        self.stdout.write(f'预处理结果不同的表格: {changed}/{len(tables)}')
+        self.stdout.write(json.dumps({'tables': len(tables), 'chars': total_chars, 'changed': changed,
+                                      **{f'{name}_seconds': value for name, value in results.items()}}))
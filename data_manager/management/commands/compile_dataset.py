@@ -0,0 +1,211 @@
+"""
+离线并行编译整个数据集。
+
+用法：
+    python manage.py compile_dataset tables.json
+    python manage.py compile_dataset s3://bucket/prefix/tables.json --workers 32
+    python manage.py compile_dataset tables.json --validate-only
+
+数据项先写入数据库，然后在进程池中编译所有尚无编译结果的数据项，结果写入
+数据库并追加到 JSONL 报告中。已有结果的数据项会被跳过，因此中断后重新运行即可继续。
+重新运行时数据文件是增量同步的：文件未变化时跳过加载，变化时只有LaTeX代码变化的数据项需要重新编译。
+
+指定 --validate-only 时只校验所有数据项能否编译（预检查加 pdflatex -draftmode，不生成PDF），
+结果只写入报告，不写入数据库，用于在正式编译前筛选数据。
+"""
+import json
+import os
+import time
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data_manager.ingest import (
+    parse_s3_path, get_dataset, get_source_version, record_source_version, mark_loaded,
+    iter_file_chunks, iter_json_array, ingest_items, READ_CHUNK_SIZE,
+)
+from data_manager.s3 import get_s3_client, get_object_if_modified, image_key
+from data_manager.precompile import run_compile_pool, save_compile_result
+from data_manager.compile_scheduler import get_scheduler
+from data_manager.compile_worker import validate_item
+
+# 每隔多少秒输出一次吞吐量
+REPORT_INTERVAL = 5.0
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = '从本地 tables.json 或 S3 路径加载数据，并行编译所有数据项并生成报告。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='本地 tables.json 路径或 s3://bucket/prefix/name.json')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='编译进程数，默认使用所有CPU核心；不超过后台编译可以使用的编译槽数'
+                                 '（LATEX_COMPILE_MAX_CONCURRENCY - LATEX_COMPILE_INTERACTIVE_RESERVED）')
+        parser.add_argument('--report', default='compile_report.jsonl', help='JSONL 报告的输出路径（追加写入）')
+        parser.add_argument('--validate-only', action='store_true', help='只校验能否编译，不生成PDF、不写入数据库')
+        parser.add_argument('--aws-access-key-id', default=os.environ.get('AWS_ACCESS_KEY_ID'))
+        parser.add_argument('--aws-secret-access-key', default=os.environ.get('AWS_SECRET_ACCESS_KEY'))
+        parser.add_argument('--endpoint-url', default=os.environ.get('AWS_ENDPOINT_URL'))
+
+    def ingest(self, options):
+        """逐项解析数据源并与数据库同步，源文件自上次加载后未变化时跳过，返回数据集。"""
+        source = options['source']
+        if not source.startswith('s3://'):
+            json_path = os.path.abspath(source)
+            try:
+                # 本地文件以大小和修改时间作为版本
+                stat = os.stat(json_path)
+                etag = f'{stat.st_size}-{stat.st_mtime_ns}'
+                dataset, (stored_etag, _) = get_source_version('', json_path)
+                if dataset is not None and stored_etag == etag:
+                    self.stdout.write('JSON文件未变化，跳过加载')
+                    mark_loaded(dataset)
+                    return dataset
+                dataset = get_dataset('', os.path.dirname(json_path), json_path)
+                with open(json_path, 'rb') as json_file:
+                    summary = ingest_items(iter_json_array(iter_file_chunks(json_file)), dataset)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'读取JSON文件失败: {e}')
+            record_source_version(dataset, etag)
+            self.write_ingest_summary(summary)
+            return dataset
+
+        parsed_path = parse_s3_path(source)
+        if parsed_path is None:
+            raise CommandError('提供的S3路径格式不正确。')
+        bucket_name, prefix, json_filename = parsed_path
+        s3_client = get_s3_client(options['aws_access_key_id'], options['aws_secret_access_key'],
+                                  options['endpoint_url'])
+
+        json_key = f"{prefix}/{json_filename}"
+        try:
+            dataset, (etag, last_modified) = get_source_version(bucket_name, json_key)
+            json_object = get_object_if_modified(s3_client, bucket_name, json_key, etag, last_modified)
+            if json_object is None:
+                self.stdout.write('JSON文件未变化，跳过加载')
+                mark_loaded(dataset)
+                return dataset
+            items = iter_json_array(json_object['Body'].iter_chunks(READ_CHUNK_SIZE))
+            dataset = get_dataset(bucket_name, prefix, json_key)
+            summary = ingest_items(items, dataset, partial(image_key, dataset))
+            record_source_version(dataset, json_object.get('ETag', ''), json_object.get('LastModified'))
+        except Exception as e:
+            raise CommandError(f'加载JSON文件失败: {e}')
+        self.write_ingest_summary(summary)
+        return dataset
+
+    def write_ingest_summary(self, summary):
+        self.stdout.write(f'加载 {summary["total"]} 项：新增 {summary["added"]}，变化 {summary["changed"]}，'
+                          f'未变化 {summary["unchanged"]}，删除 {summary["removed"]}')
+
+    def handle(self, *args, **options):
+        # 与服务共用跨进程的编译槽，进程数超过后台编译槽数时多出的进程只会等待
+        options['workers'] = min(options['workers'], get_scheduler().background_concurrency)
+        dataset = self.ingest(options)
+        total = dataset.items.count()
+        self.stdout.write(f'数据集 {dataset} 共 {total} 个数据项')
+        if options['validate_only']:
+            self.validate(dataset, total, options)
+            return
+
+        pending = dataset.items.filter(compile_result__isnull=True)
+        pending_total = pending.count()
+        self.stdout.write(f'待编译 {pending_total} 项，跳过已有结果的 {total - pending_total} 项，'
+                          f'使用 {options["workers"]} 个进程')
+        item_names = {}
+
+        def iter_pending_items():
+            for item_id, image_name, pred_tex_code in pending.values_list(
+                    'id', 'image_name', 'pred_tex_code').iterator(chunk_size=500):
+                item_names[item_id] = image_name
+                yield item_id, pred_tex_code
+
+        compile_times = []
+        failed = 0
+        started = time.monotonic()
+        last_report = started
+
+        with open(options['report'], 'a', encoding='utf-8') as report_file:
+            def on_result(result):
+                nonlocal failed, last_report
+                save_compile_result(result)
+                report_file.write(json.dumps({
+                    'image_name': item_names.pop(result['item_id'], None),
+                    'success': result['success'],
+                    'message': result['message'],
+                    'errors': result['errors'],
+                    'error_type': result['error_type'],
+                    'compile_time': round(result['compile_time'], 4),
+                    'pdf_path': result['pdf_path'],
+                }, ensure_ascii=False) + '\n')
+                compile_times.append(result['compile_time'])
+                if not result['success']:
+                    failed += 1
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    self.report_progress(compile_times, failed, pending_total, started)
+
+            run_compile_pool(iter_pending_items(), on_result, workers=options['workers'])
+
+        self.report_progress(compile_times, failed, pending_total, started)
+        self.stdout.write(self.style.SUCCESS(f'编译完成，报告已写入 {options["report"]}'))
+
+    def validate(self, dataset, total, options):
+        """校验所有数据项，按失败原因（error_type，pdflatex 报错时为 pdflatex）统计。"""
+        self.stdout.write(f'校验 {total} 项，使用 {options["workers"]} 个进程')
+        item_names = {}
+
+        def iter_items():
+            for item_id, image_name, pred_tex_code in dataset.items.values_list(
+                    'id', 'image_name', 'pred_tex_code').iterator(chunk_size=500):
+                item_names[item_id] = image_name
+                yield item_id, pred_tex_code
+
+        compile_times = []
+        failures = {}
+        started = time.monotonic()
+        last_report = started
+
+        with open(options['report'], 'a', encoding='utf-8') as report_file:
+            def on_result(result):
+                nonlocal last_report
+                report_file.write(json.dumps({
+                    'image_name': item_names.pop(result['item_id'], None),
+                    'valid': result['success'],
+                    'error_type': result['error_type'],
+                    'message': result['message'],
+                    'errors': result['errors'],
+                    'warnings': result['warnings'],
+                    'compile_time': round(result['compile_time'], 4),
+                }, ensure_ascii=False) + '\n')
+                compile_times.append(result['compile_time'])
+                if not result['success']:
+                    reason = result['error_type'] or 'pdflatex'
+                    failures[reason] = failures.get(reason, 0) + 1
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    self.report_progress(compile_times, sum(failures.values()), total, started)
+
+            run_compile_pool(iter_items(), on_result, workers=options['workers'], task=validate_item)
+
+        self.report_progress(compile_times, sum(failures.values()), total, started)
+        for reason, count in sorted(failures.items(), key=lambda entry: -entry[1]):
+            self.stdout.write(f'  {reason}: {count}')
+        self.stdout.write(self.style.SUCCESS(f'校验完成，报告已写入 {options["report"]}'))
+
+    def report_progress(self, compile_times, failed, total, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        sorted_times = sorted(compile_times)
+        self.stdout.write(
+            f'{len(compile_times)}/{total} 项 (失败 {failed})  '
+            f'{len(compile_times) / elapsed:.1f} 项/秒  '
+            f'p50 {percentile(sorted_times, 0.5) * 1000:.0f}ms  '
+            f'p95 {percentile(sorted_times, 0.95) * 1000:.0f}ms'
+        )
@@ -0,0 +1,228 @@
+"""
+多人同时标注的负载测试。
+
+用法：
+    python manage.py loadtest_annotations
+    python manage.py loadtest_annotations --annotators 10 --labels 500 --batch 10 --reload-interval 1
+
+创建一个临时数据集，启动 --annotators 个线程模拟标注员，每个线程通过批量分类接口
+（/api/classify/bulk/，请求经过完整的中间件）提交带版本号的标注，--overlap 比例的标注
+落在所有人共享的数据项上以制造冲突。指定 --reload-interval 时另有一个线程按该间隔重新加载
+数据集（修改少量数据项的LaTeX代码），模拟后台加载与标注同时写入。
+
+结束后输出请求延迟的分位数、各状态码的数量，并检查没有被静默覆盖的写入：
+每个数据项的版本号应等于它被接受的标注数加上重新加载时的修改次数。
+测试结束后删除临时数据集（--keep 保留）。
+"""
+import json
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+
+from data_manager.ingest import get_dataset, ingest_items
+from data_manager.models import DataItem
+
+CATEGORIES = ['compilable_consistent', 'compilable_slightly_inconsistent', 'compilable_inconsistent', 'non_compilable']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadStats:
+    """各线程共享的统计信息。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.status_codes = {}
+        self.errors = []
+        self.applied = {}  # item_id -> 被接受的标注数
+        self.conflicts = 0
+        self.reload_changes = {}  # item_id -> 重新加载时的修改次数
+        self.reloads = 0
+
+    def record_request(self, latency, status_code):
+        with self._lock:
+            self.latencies.append(latency)
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+    def record_result(self, applied, conflicts):
+        with self._lock:
+            for item_id in applied:
+                self.applied[item_id] = self.applied.get(item_id, 0) + 1
+            self.conflicts += conflicts
+
+    def record_error(self, error):
+        with self._lock:
+            self.errors.append(str(error))
+
+
+class Command(BaseCommand):
+    help = '模拟多个标注员并发提交标注，输出延迟分布并检查乐观锁。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--annotators', type=int, default=10, help='并发的标注员（线程）数')
+        parser.add_argument('--labels', type=int, default=300, help='每个标注员提交的标注数')
+        parser.add_argument('--batch', type=int, default=10, help='每次请求包含的标注数')
+        parser.add_argument('--items', type=int, default=5000, help='临时数据集的数据项数')
+        parser.add_argument('--overlap', type=float, default=0.1, help='落在共享数据项上的标注比例')
+        parser.add_argument('--shared-items', type=int, default=20, help='所有标注员共享的数据项数')
+        parser.add_argument('--reload-interval', type=float, default=0,
+                            help='后台重新加载数据集的间隔（秒），0表示不重新加载')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='测试结束后保留临时数据集')
+
+    def create_dataset(self, count):
+        dataset = get_dataset('', '', f'loadtest-{uuid.uuid4().hex}')
+        items = [{'image_name': f'{index:06d}.png',
+                  'pred_tex_code': f'\\begin{{tabular}}{{cc}} a & {index} \\\\ \\end{{tabular}}'}
+                 for index in range(count)]
+        ingest_items(items, dataset)
+        return dataset, items
+
+    def annotate(self, client, own_items, shared_items, options, rng, stats):
+        """一个标注员：每批按当前已知的版本号提交，根据响应更新版本号。"""
+        versions = {}
+        remaining = options['labels']
+        while remaining > 0:
+            labels = {}
+            for _ in range(min(options['batch'], remaining)):
+                pool = shared_items if shared_items and rng.random() < options['overlap'] else own_items
+                item_id, version = rng.choice(pool)
+                labels[item_id] = {'item_id': item_id, 'category': rng.choice(CATEGORIES),
+                                   'version': versions.get(item_id, version)}
+            remaining -= options['batch']
+            started = time.perf_counter()
+            try:
+                response = client.post('/api/classify/bulk/', json.dumps({'labels': list(labels.values())}),
+                                       content_type='application/json')
+            except Exception as e:
+                stats.record_error(e)
+                continue
+            stats.record_request(time.perf_counter() - started, response.status_code)
+            if response.status_code != 200:
+                stats.record_error(response.content.decode('utf-8', 'replace')[:200])
+                continue
+            result = response.json()
+            for item_id, version in result['versions'].items():
+                versions[int(item_id)] = version
+            for conflict in result['conflicts']:
+                versions[conflict['item_id']] = conflict['version']
+            stats.record_result(result['applied'], len(result['conflicts']))
+
+    def run_annotator(self, *args):
+        try:
+            # 与服务端相同，通过域名访问，每个线程使用独立的数据库连接
+            self.annotate(Client(SERVER_NAME='localhost'), *args)
+        except Exception as e:
+            args[-1].record_error(e)
+        finally:
+            connection.close()
+
+    def run_reloader(self, dataset, items, interval, rng, stop, stats):
+        """按间隔修改少量数据项的LaTeX代码并重新加载数据集。"""
+        try:
+            while not stop.wait(interval):
+                changed = rng.sample(range(len(items)), min(5, len(items)))
+                for index in changed:
+                    items[index]['pred_tex_code'] += ' %'
+                ingest_items(iter(items), dataset)
+                names = [items[index]['image_name'] for index in changed]
+                with stats._lock:
+                    for item_id in DataItem.objects.filter(dataset=dataset, image_name__in=names).values_list(
+                            'id', flat=True):
+                        stats.reload_changes[item_id] = stats.reload_changes.get(item_id, 0) + 1
+                    stats.reloads += 1
+        except Exception as e:
+            stats.record_error(e)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        if options['annotators'] < 1 or options['batch'] < 1 or options['items'] < options['annotators']:
+            raise CommandError('参数不正确：标注员数和批大小至少为1，数据项数不少于标注员数')
+        rng = random.Random(options['seed'])
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        dataset, source_items = self.create_dataset(options['items'])
+        self.stdout.write(f'数据集 {dataset}：{options["items"]} 项，journal_mode={journal_mode}，'
+                          f'{options["annotators"]} 个标注员各提交 {options["labels"]} 项标注（每批 {options["batch"]} 项）')
+
+        item_versions = list(DataItem.objects.filter(dataset=dataset).order_by('id').values_list('id', 'version'))
+        shared_items = item_versions[:options['shared_items']]
+        own_pool = item_versions[options['shared_items']:] or item_versions
+        stats = LoadStats()
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.run_annotator, args=(
+                own_pool[index::options['annotators']], shared_items, options,
+                random.Random(rng.random()), stats,
+            ))
+            for index in range(options['annotators'])
+        ]
+        reloader = None
+        if options['reload_interval'] > 0:
+            reloader = threading.Thread(target=self.run_reloader, args=(
+                dataset, source_items, options['reload_interval'], random.Random(rng.random()), stop, stats))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        if reloader is not None:
+            reloader.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if reloader is not None:
+            reloader.join()
+
+        try:
+            self.report(dataset, stats, elapsed)
+        finally:
+            if not options['keep']:
+                dataset.delete()
+            connections.close_all()
+
+    def report(self, dataset, stats, elapsed):
+        latencies = sorted(stats.latencies)
+        self.stdout.write(f'{len(latencies)} 次请求，耗时 {elapsed:.2f} 秒，{len(latencies) / elapsed:.1f} 请求/秒')
+        self.stdout.write('延迟(ms): ' + '  '.join(
+            f'{name}={percentile(latencies, fraction) * 1000:.1f}'
+            for name, fraction in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)]
+        ))
+        self.stdout.write(f'状态码: {dict(sorted(stats.status_codes.items()))}')
+        applied = sum(stats.applied.values())
+        self.stdout.write(f'接受的标注 {applied}，版本冲突被拒绝 {stats.conflicts}，重新加载 {stats.reloads} 次')
+
+        # 每次被接受的标注和重新加载时的修改都使版本号加一，版本号之和不同说明有写入被覆盖或丢失
+        lost = 0
+        for item_id, version in DataItem.objects.filter(dataset=dataset).values_list('id', 'version'):
+            if version != stats.applied.get(item_id, 0) + stats.reload_changes.get(item_id, 0):
+                lost += 1
+        self.stdout.write(f'版本号与接受的写入数不一致的数据项: {lost}')
+        for error in stats.errors[:10]:
+            self.stderr.write(f'错误: {error}')
+        self.stdout.write(json.dumps({
+            'requests': len(latencies),
+            'seconds': round(elapsed, 3),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(percentile(latencies, 1.0) * 1000, 2),
+            'applied': applied,
+            'conflicts': stats.conflicts,
+            'errors': len(stats.errors),
+            'inconsistent_items': lost,
+        }))
+        if stats.errors or lost:
+            raise CommandError('负载测试发现错误')
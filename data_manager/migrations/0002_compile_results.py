@@ -0,0 +1,43 @@
+# Generated by Django 4.2.2 on 2026-10-18 11:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecompileJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '运行中'), ('completed', '已完成'), ('cancelled', '已取消'), ('failed', '失败')], default='pending', max_length=20)),
+                ('total_items', models.IntegerField(default=0)),
+                ('compiled_items', models.IntegerField(default=0)),
+                ('failed_items', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('owner', models.CharField(blank=True, max_length=64)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompileResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64)),
+                ('success', models.BooleanField(default=False)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('errors', models.JSONField(default=list)),
+                ('pdf_path', models.CharField(blank=True, max_length=1024, null=True)),
+                ('compile_time', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='compile_result', to='data_manager.dataitem')),
+            ],
+        ),
+    ]
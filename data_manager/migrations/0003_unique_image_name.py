@@ -0,0 +1,33 @@
+# Generated by Django 4.2.2 on 2026-10-18 11:37
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_items(apps, schema_editor):
+    # 添加唯一约束前删除重复的图片名称：优先保留已标注（有分类）的一条，
+    # 标注情况相同时保留最后写入（id最大）的一条
+    DataItem = apps.get_model('data_manager', 'DataItem')
+    duplicate_names = (DataItem.objects.values('image_name')
+                       .annotate(count=Count('id'))
+                       .filter(count__gt=1)
+                       .values_list('image_name', flat=True))
+    for image_name in duplicate_names:
+        items = DataItem.objects.filter(image_name=image_name).values_list('id', 'is_annotated', 'category')
+        keep_id = max(items, key=lambda item: (item[1], bool(item[2]), item[0]))[0]
+        DataItem.objects.filter(image_name=image_name).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0002_compile_results'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dataitem',
+            constraint=models.UniqueConstraint(fields=('image_name',), name='unique_data_item_image_name'),
+        ),
+    ]
@@ -0,0 +1,135 @@
+# Generated by Django 4.2.2 on 2026-10-18 11:45
+
+import posixpath
+from urllib.parse import unquote, urlsplit
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def parse_presigned_url(url):
+    """
+    从旧版本保存的图片预签名URL中解析 (bucket, key)，无法解析时返回None。
+    支持虚拟主机形式（https://bucket.s3.region.amazonaws.com/key）和路径形式（https://endpoint/bucket/key）。
+    """
+    if not url or '://' not in url:
+        return None
+    parts = urlsplit(url)
+    path = unquote(parts.path).lstrip('/')
+    host = parts.hostname or ''
+    for marker in ('.s3.', '.s3-'):
+        if marker in host and not host.startswith('s3.') and not host.startswith('s3-'):
+            bucket = host.split(marker, 1)[0]
+            return (bucket, path) if path else None
+    if '/' not in path:
+        return None
+    bucket, key = path.split('/', 1)
+    return (bucket, key) if bucket and key else None
+
+
+def assign_legacy_dataset(apps, schema_editor):
+    # 旧版本的数据项在 image_path 中保存了图片的预签名URL，从中得到桶和前缀，按位置归入数据集。
+    # 原始 JSON 文件名无法得知，json_key 暂记为 "<前缀>/"；之后从该前缀重新加载 JSON 时
+    # get_dataset 会接管这个数据集，已有的标注和编译结果保持关联。
+    # 无法解析的数据项和所有预编译任务归入一个旧数据集（json_key 为 legacy）
+    Dataset = apps.get_model('data_manager', 'Dataset')
+    DataItem = apps.get_model('data_manager', 'DataItem')
+    PrecompileJob = apps.get_model('data_manager', 'PrecompileJob')
+    if not DataItem.objects.exists() and not PrecompileJob.objects.exists():
+        return
+
+    datasets = {}
+    legacy = None
+    batch = []
+    for item in DataItem.objects.only('id', 'image_name', 'image_path').iterator(chunk_size=1000):
+        location = parse_presigned_url(item.image_path)
+        if location is not None and posixpath.basename(location[1]) == item.image_name:
+            bucket, key = location
+            prefix = posixpath.dirname(key)
+            dataset = datasets.get((bucket, prefix))
+            if dataset is None:
+                dataset = Dataset.objects.create(bucket=bucket, prefix=prefix, json_key=f'{prefix}/')
+                datasets[(bucket, prefix)] = dataset
+            item.image_path = key
+        else:
+            if legacy is None:
+                legacy = Dataset.objects.create(bucket='', prefix='', json_key='legacy')
+            dataset = legacy
+        item.dataset = dataset
+        batch.append(item)
+        if len(batch) >= 1000:
+            DataItem.objects.bulk_update(batch, ['dataset', 'image_path'])
+            batch = []
+    if batch:
+        DataItem.objects.bulk_update(batch, ['dataset', 'image_path'])
+
+    if PrecompileJob.objects.exists():
+        if legacy is None and len(datasets) == 1:
+            legacy = next(iter(datasets.values()))
+        elif legacy is None:
+            legacy = Dataset.objects.create(bucket='', prefix='', json_key='legacy')
+        PrecompileJob.objects.update(dataset=legacy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0003_unique_image_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dataset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(max_length=255)),
+                ('prefix', models.CharField(max_length=1024)),
+                ('json_key', models.CharField(max_length=1024)),
+                ('loaded_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'json_key'), name='unique_dataset_location')],
+            },
+        ),
+        migrations.AddField(
+            model_name='dataitem',
+            name='dataset',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='data_manager.dataset'),
+        ),
+        migrations.AddField(
+            model_name='precompilejob',
+            name='dataset',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='precompile_jobs', to='data_manager.dataset'),
+        ),
+        migrations.RunPython(assign_legacy_dataset, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dataitem',
+            name='dataset',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='data_manager.dataset'),
+        ),
+        migrations.AlterField(
+            model_name='precompilejob',
+            name='dataset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precompile_jobs', to='data_manager.dataset'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='dataitem',
+            name='unique_data_item_image_name',
+        ),
+        migrations.AddConstraint(
+            model_name='dataitem',
+            constraint=models.UniqueConstraint(fields=('dataset', 'image_name'), name='unique_dataset_image_name'),
+        ),
+        migrations.AddIndex(
+            model_name='dataitem',
+            index=models.Index(fields=['dataset', 'category'], name='item_dataset_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataitem',
+            index=models.Index(condition=models.Q(('is_annotated', True)), fields=['dataset', 'category'], name='item_annotated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataitem',
+            index=models.Index(condition=models.Q(('is_annotated', False)), fields=['dataset'], name='item_unannotated_idx'),
+        ),
+    ]
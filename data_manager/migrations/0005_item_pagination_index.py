@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0004_datasets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataitem',
+            index=models.Index(fields=['dataset', 'id'], name='item_dataset_id_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:06
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    # 为已有的数据项计算 pred_tex_code 的哈希，分批更新
+    DataItem = apps.get_model('data_manager', 'DataItem')
+    batch = []
+    for item in DataItem.objects.only('id', 'pred_tex_code').iterator(chunk_size=1000):
+        item.content_hash = hashlib.sha256(item.pred_tex_code.encode('utf-8', 'surrogatepass')).hexdigest()
+        batch.append(item)
+        if len(batch) >= 1000:
+            DataItem.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        DataItem.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0005_item_pagination_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataitem',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='last_modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0006_incremental_reload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataitem',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+# 之前保存的结果没有 error_type，根据编译被终止时的提示信息补上
+TERMINATED_MESSAGES = {
+    'timeout': "编译超时，已终止。",
+    'cpu_limit': "编译占用的CPU时间超过限制，已终止。",
+    'memory_limit': "编译占用的内存超过限制，已终止。",
+    'output_limit': "编译输出的文件超过大小限制，已终止。",
+}
+
+
+def fill_error_type(apps, schema_editor):
+    CompileResult = apps.get_model('data_manager', 'CompileResult')
+    for error_type, message in TERMINATED_MESSAGES.items():
+        CompileResult.objects.filter(success=False, message=message).update(error_type=error_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_manager', '0007_item_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compileresult',
+            name='error_type',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(fill_error_type, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,95 @@
 from django.db import models
 
+class Dataset(models.Model):
+    bucket = models.CharField(max_length=255)  # S3桶名称，本地文件为空
+    prefix = models.CharField(max_length=1024)  # 图片所在的前缀（目录）
+    json_key = models.CharField(max_length=1024)  # tables.json 的完整key（本地文件为路径）
+    loaded_at = models.DateTimeField(null=True, blank=True)  # 最近一次加载的时间
+    # 最近一次完整加载时源文件的 ETag 和 Last-Modified，用于重新加载时的条件请求；加载中途失败时为空
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'json_key'], name='unique_dataset_location'),
+        ]
+
+    def __str__(self):
+        return f"s3://{self.bucket}/{self.json_key}" if self.bucket else self.json_key
+
+
 class DataItem(models.Model):
+    # 唯一约束 (dataset, image_name) 已经以 dataset 开头，不再单独建外键索引
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='items', db_index=False)
     image_name = models.CharField(max_length=255)  # 存储图片名称
     pred_tex_code = models.TextField()  # 存储LaTeX代码
     category = models.CharField(max_length=50, blank=True)  # 用于分类的字段
     is_annotated = models.BooleanField(default=False)  # 是否已标注
-    image_path = models.CharField(max_length=1024, blank=True, null=True)  # 存储图片路径
+    image_path = models.CharField(max_length=1024, blank=True, null=True)  # 图片在S3中的key
+    content_hash = models.CharField(max_length=64, blank=True)  # pred_tex_code 的 SHA-256，重新加载时据此判断是否变化
+    # 乐观锁：每次修改分类或LaTeX代码时加一，携带旧版本号的分类请求会被拒绝而不是覆盖别人的修改
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # 入库时按数据集和图片名称批量 upsert，依赖该唯一约束
+            models.UniqueConstraint(fields=['dataset', 'image_name'], name='unique_dataset_image_name'),
+        ]
+        indexes = [
+            # 分页接口按 id 游标遍历数据集
+            models.Index(fields=['dataset', 'id'], name='item_dataset_id_idx'),
+            # 按分类筛选
+            models.Index(fields=['dataset', 'category'], name='item_dataset_category_idx'),
+            # 按标注状态筛选使用部分索引：SQLite 中布尔条件不写成 "= 1"，普通的列索引无法命中
+            models.Index(fields=['dataset', 'category'], condition=models.Q(is_annotated=True),
+                         name='item_annotated_idx'),
+            models.Index(fields=['dataset'], condition=models.Q(is_annotated=False),
+                         name='item_unannotated_idx'),
+        ]
 
     def __str__(self):
         return self.image_name
+
+
+class CompileResult(models.Model):
+    item = models.OneToOneField(DataItem, on_delete=models.CASCADE, related_name='compile_result')
+    cache_key = models.CharField(max_length=64)  # 编译结果缓存key，即最终文档的哈希
+    success = models.BooleanField(default=False)
+    message = models.CharField(max_length=255, blank=True)
+    errors = models.JSONField(default=list)
+    pdf_path = models.CharField(max_length=1024, blank=True, null=True)  # 缓存中PDF文件的路径
+    compile_time = models.FloatField(default=0)  # 编译耗时（秒）
+    error_type = models.CharField(max_length=32, blank=True)  # 编译被终止或未通过预检查的原因，见 latex_compiler
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.item_id}: {'成功' if self.success else '失败'}"
+
+
+class PrecompileJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '等待中'),
+        (STATUS_RUNNING, '运行中'),
+        (STATUS_COMPLETED, '已完成'),
+        (STATUS_CANCELLED, '已取消'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='precompile_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total_items = models.IntegerField(default=0)
+    compiled_items = models.IntegerField(default=0)  # 已有编译结果的数据项数（含成功和失败）
+    failed_items = models.IntegerField(default=0)
+    message = models.TextField(blank=True)
+    owner = models.CharField(max_length=64, blank=True)  # 正在执行该任务的进程标识
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"PrecompileJob {self.pk} ({self.status})"
@@ -0,0 +1,222 @@
+"""
+数据集的后台预编译。
+
+加载数据后可以启动一个预编译任务，在有界的进程池中编译所有尚无编译结果的数据项，
+结果写入 CompileResult。任务进度保存在 PrecompileJob 中，支持取消；已有结果的
+数据项会被跳过，因此任务中断（例如服务重启）后可以继续执行。
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .compile_scheduler import get_scheduler
+from .compile_worker import compile_item
+from .latex_compiler import RETRYABLE_ERROR_TYPES
+from .models import CompileResult, DataItem, PrecompileJob
+
+# 运行中的任务每隔多少秒更新一次进度和心跳，并检查是否被取消
+PROGRESS_INTERVAL = 1.0
+# 心跳超过该时间未更新的任务视为已中断，可以被其他进程接管
+HEARTBEAT_TIMEOUT = 60
+
+_process_token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def save_compile_result(result):
+    CompileResult.objects.update_or_create(
+        item_id=result['item_id'],
+        defaults={
+            'cache_key': result['cache_key'],
+            'success': result['success'],
+            'message': result['message'][:255],
+            'errors': result['errors'],
+            'pdf_path': result['pdf_path'],
+            'compile_time': result['compile_time'],
+            'error_type': result['error_type'] or '',
+        }
+    )
+
+
+def iter_pending_items(queryset):
+    """遍历还没有编译结果的数据项。"""
+    return queryset.filter(compile_result__isnull=True).values_list('id', 'pred_tex_code').iterator(chunk_size=500)
+
+
+def run_compile_pool(items, on_result, should_stop=None, workers=None, task=compile_item):
+    """
+    在进程池中编译数据项，同时在途的任务数有上限，避免一次性把整个数据集提交到队列中。
+
+    :param items: (id, pred_tex_code) 的可迭代对象。
+    :param on_result: 每个数据项编译完成后在当前线程中调用，参数为 task 的返回值。
+    :param should_stop: 返回True时停止提交新任务并放弃尚未开始的任务。
+    :param workers: 进程数，默认使用 settings.PRECOMPILE_WORKERS；不超过后台编译可以使用的编译槽数，
+                    更多的进程只会等待编译槽。
+    :param task: 在子进程中执行的函数，参数为 (id, pred_tex_code)，默认编译数据项。
+    :return: 是否因 should_stop 而提前结束。
+    """
+    workers = min(workers or settings.PRECOMPILE_WORKERS, get_scheduler().background_concurrency)
+    max_in_flight = workers * 2
+    items = iter(items)
+    in_flight = set()
+    exhausted = False
+    stopped = False
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        try:
+            while True:
+                while not exhausted and not stopped and len(in_flight) < max_in_flight:
+                    try:
+                        item_id, pred_tex_code = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight.add(executor.submit(task, item_id, pred_tex_code))
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_result(future.result())
+                if should_stop is not None and not stopped and should_stop():
+                    stopped = True
+                    for future in in_flight:
+                        future.cancel()
+                    in_flight = {future for future in in_flight if not future.cancelled()}
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return stopped
+
+
+def _claim_job(job_id):
+    """将任务认领给当前进程。任务正在被其他进程执行（心跳未超时）时返回False。"""
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=HEARTBEAT_TIMEOUT)
+    claimable = PrecompileJob.objects.filter(
+        id=job_id, status__in=[PrecompileJob.STATUS_PENDING, PrecompileJob.STATUS_RUNNING],
+    ).exclude(heartbeat_at__gte=stale_before, owner__gt='').exclude(owner=_process_token)
+    return claimable.update(status=PrecompileJob.STATUS_RUNNING, owner=_process_token, heartbeat_at=now) == 1
+
+
+def _refresh_progress(job, queryset):
+    job.compiled_items = CompileResult.objects.filter(item__in=queryset).count()
+    job.failed_items = CompileResult.objects.filter(item__in=queryset, success=False).count()
+
+
+def run_precompile_job(job_id):
+    """执行预编译任务，直到所有数据项都有编译结果或任务被取消。"""
+    try:
+        if not _claim_job(job_id):
+            return
+        job = PrecompileJob.objects.get(id=job_id)
+        queryset = DataItem.objects.filter(dataset_id=job.dataset_id)
+        job.total_items = queryset.count()
+        _refresh_progress(job, queryset)
+        job.save(update_fields=['total_items', 'compiled_items', 'failed_items', 'updated_at'])
+
+        last_update = time.monotonic()
+        cancelled = False
+
+        def on_result(result):
+            save_compile_result(result)
+            job.compiled_items += 1
+            if not result['success']:
+                job.failed_items += 1
+
+        def should_stop():
+            nonlocal last_update, cancelled
+            if time.monotonic() - last_update < PROGRESS_INTERVAL:
+                return False
+            last_update = time.monotonic()
+            # 只更新进度字段，避免覆盖其他请求写入的取消状态
+            PrecompileJob.objects.filter(id=job.id).update(
+                compiled_items=job.compiled_items, failed_items=job.failed_items,
+                heartbeat_at=timezone.now(), updated_at=timezone.now(),
+            )
+            cancelled = PrecompileJob.objects.filter(id=job.id, status=PrecompileJob.STATUS_CANCELLED).exists()
+            return cancelled
+
+        run_compile_pool(iter_pending_items(queryset), on_result, should_stop)
+
+        _refresh_progress(job, queryset)
+        if not cancelled:
+            PrecompileJob.objects.filter(id=job.id).exclude(
+                status=PrecompileJob.STATUS_CANCELLED,
+            ).update(status=PrecompileJob.STATUS_COMPLETED)
+        PrecompileJob.objects.filter(id=job.id).update(
+            compiled_items=job.compiled_items, failed_items=job.failed_items, owner='', heartbeat_at=None,
+        )
+    except Exception as e:
+        PrecompileJob.objects.filter(id=job_id).update(
+            status=PrecompileJob.STATUS_FAILED, message=str(e), owner='', heartbeat_at=None,
+        )
+        raise
+    finally:
+        connection.close()
+
+
+def start_precompile_job(dataset):
+    """
+    启动数据集的预编译任务。如果该数据集已有未完成的任务则继续执行该任务，而不是重新创建。
+
+    :return: PrecompileJob 实例。
+    """
+    job = PrecompileJob.objects.filter(
+        dataset=dataset, status__in=[PrecompileJob.STATUS_PENDING, PrecompileJob.STATUS_RUNNING],
+    ).order_by('-id').first()
+    if job is None:
+        job = PrecompileJob.objects.create(dataset=dataset, total_items=dataset.items.count())
+    threading.Thread(target=run_precompile_job, args=(job.id,), daemon=True).start()
+    return job
+
+
+def resume_interrupted_jobs():
+    """继续执行因服务重启而中断的任务，心跳仍在更新的任务由原进程继续执行。"""
+    close_old_connections()
+    try:
+        job_ids = list(PrecompileJob.objects.filter(
+            status__in=[PrecompileJob.STATUS_PENDING, PrecompileJob.STATUS_RUNNING],
+        ).values_list('id', flat=True))
+    finally:
+        connection.close()
+    for job_id in job_ids:
+        threading.Thread(target=run_precompile_job, args=(job_id,), daemon=True).start()
+
+
+def cancel_precompile_job(job_id):
+    return PrecompileJob.objects.filter(
+        id=job_id, status__in=[PrecompileJob.STATUS_PENDING, PrecompileJob.STATUS_RUNNING],
+    ).update(status=PrecompileJob.STATUS_CANCELLED) == 1
+
+
+def load_stored_result(dataset_id, image_name, pred_tex_code):
+    """
+    读取预编译保存的结果，结果缺失、代码已变化或缓存中的PDF已被淘汰时返回None。
+    预编译时超时或资源超限（RETRYABLE_ERROR_TYPES）的结果也返回None，由调用方重新编译。
+
+    :return: 与 compile_latex_to_pdf 相同格式的结果字典，但不包含 pdf_data，PDF 通过 cache_key 从编译缓存中读取。
+    """
+    stored = CompileResult.objects.filter(
+        item__dataset_id=dataset_id, item__image_name=image_name, item__pred_tex_code=pred_tex_code,
+    ).first()
+    if stored is None or stored.error_type in RETRYABLE_ERROR_TYPES:
+        return None
+    result = {
+        "success": stored.success,
+        "message": stored.message,
+        "errors": stored.errors,
+        "error_type": stored.error_type or None,
+        "cache_key": stored.cache_key,
+        "cached": True,
+    }
+    if stored.pdf_path and not os.path.exists(stored.pdf_path):
+        return None
+    return result
@@ -0,0 +1,189 @@
+"""
+编译前的快速检查。
+
+在调用 pdflatex 之前用纯 Python 检查表格代码中代价很低就能发现的问题：
+花括号不配对、环境缺少 \\end 或开始结束不匹配、未知的环境。这些问题会使编译失败
+或输出无法使用，发现时直接返回结构化的错误，不再占用编译进程。
+行的列数超过列定义只作为警告，预处理时会自动补齐列定义。
+"""
+import re
+
+from .log_parser import make_error
+from .table_analyzer import ENV_PATTERN, _commented_out, analyze_table
+
+# 预检查失败时编译结果中 error_type 的取值
+ERROR_PREFLIGHT = 'preflight'
+
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+
+# 问题的类型
+UNBALANCED_BRACES = 'unbalanced_braces'
+MISSING_END = 'missing_end'
+UNEXPECTED_END = 'unexpected_end'
+ENVIRONMENT_MISMATCH = 'environment_mismatch'
+UNKNOWN_ENVIRONMENT = 'unknown_environment'
+ROW_OVERFLOW = 'row_overflow'
+
+# 导言区（LATEX_PREAMBLE）加载的宏包中可以在表格里使用的环境
+KNOWN_ENVIRONMENTS = frozenset([
+    # LaTeX 内核
+    'tabular', 'tabular*', 'array', 'table', 'table*', 'figure', 'figure*', 'center', 'flushleft',
+    'flushright', 'minipage', 'itemize', 'enumerate', 'description', 'quote', 'quotation', 'verse',
+    'tabbing', 'math', 'displaymath', 'equation', 'eqnarray', 'eqnarray*', 'picture',
+    # 字号和字体声明也可以作为环境使用
+    'tiny', 'scriptsize', 'footnotesize', 'small', 'normalsize', 'large', 'Large', 'LARGE', 'huge', 'Huge',
+    'bfseries', 'mdseries', 'itshape', 'slshape', 'scshape', 'upshape', 'rmfamily', 'sffamily', 'ttfamily',
+    # tabularx、longtable
+    'tabularx', 'longtable',
+    # amsmath
+    'equation*', 'align', 'align*', 'alignat', 'alignat*', 'gather', 'gather*', 'multline', 'multline*',
+    'flalign', 'flalign*', 'split', 'aligned', 'alignedat', 'gathered', 'cases', 'matrix', 'pmatrix',
+    'bmatrix', 'Bmatrix', 'vmatrix', 'Vmatrix', 'smallmatrix', 'subequations',
+])
+
+# 转义字符（\\ 先匹配，避免 \\{ 中的 { 被当作转义）、注释和花括号
+ESCAPED_PATTERN = re.compile(r"\\[\\{}%]")
+COMMENT_PATTERN = re.compile(r"%[^\n]*")
+BRACE_TOKEN_PATTERN = re.compile(r"\\[\s\S]|%[^\n]*|[{}]")
+# 生成骨架时删除除花括号以外的所有字节
+BRACE_SKELETON_DELETE = bytes(set(range(256)) - set(b'{}'))
+
+
+def line_number(code, pos):
+    return code.count('\n', 0, pos) + 1
+
+
+def make_issue(code, severity, kind, message, pos=None):
+    """
+    生成一条检查结果。
+
+    :param code: 被检查的代码，用于计算行号。
+    :param kind: 问题的类型，例如 UNBALANCED_BRACES。
+    :param pos: 问题在代码中的位置，为None时没有行号。
+    """
+    return {
+        "severity": severity,
+        "type": kind,
+        "message": message,
+        "line": line_number(code, pos) if pos is not None else None,
+    }
+
+
+def _braces_balanced(latex_code):
+    """只保留花括号后逐层删除成对的 {}，剩下的就是不配对的花括号。"""
+    body = ESCAPED_PATTERN.sub('', latex_code) if '\\' in latex_code else latex_code
+    if '%' in body:
+        body = COMMENT_PATTERN.sub('', body)
+    skeleton = body.encode('utf-8', 'surrogatepass').translate(None, BRACE_SKELETON_DELETE)
+    while b'{}' in skeleton:
+        skeleton = skeleton.replace(b'{}', b'')
+    return not skeleton
+
+
+def check_braces(latex_code):
+    """检查花括号是否配对。配对时不逐个处理花括号，只有出错时才逐个扫描以定位位置。"""
+    if _braces_balanced(latex_code):
+        return []
+    issues = []
+    open_positions = []
+    for match in BRACE_TOKEN_PATTERN.finditer(latex_code):
+        token = match.group()
+        if token == '{':
+            open_positions.append(match.start())
+        elif token == '}':
+            if open_positions:
+                open_positions.pop()
+            else:
+                issues.append(make_issue(latex_code, SEVERITY_ERROR, UNBALANCED_BRACES,
+                                         '多余的 }', match.start()))
+    for pos in open_positions:
+        issues.append(make_issue(latex_code, SEVERITY_ERROR, UNBALANCED_BRACES, '{ 没有对应的 }', pos))
+    return issues
+
+
+def check_environments(latex_code):
+    """检查 \\begin 和 \\end 是否配对，以及环境是否可以识别。"""
+    issues = []
+    stack = []  # (环境名称, 位置)
+    for match in ENV_PATTERN.finditer(latex_code):
+        if _commented_out(latex_code, match.start()):
+            continue
+        command, env_name = match.groups()
+        if command == 'begin':
+            if env_name not in KNOWN_ENVIRONMENTS:
+                issues.append(make_issue(latex_code, SEVERITY_ERROR, UNKNOWN_ENVIRONMENT,
+                                         f'未知的环境 {env_name}', match.start()))
+            stack.append((env_name, match.start()))
+        elif not stack:
+            issues.append(make_issue(latex_code, SEVERITY_ERROR, UNEXPECTED_END,
+                                     f'\\end{{{env_name}}} 没有对应的 \\begin', match.start()))
+        else:
+            begin_name, begin_pos = stack.pop()
+            if begin_name != env_name:
+                issues.append(make_issue(
+                    latex_code, SEVERITY_ERROR, ENVIRONMENT_MISMATCH,
+                    f'\\begin{{{begin_name}}}（第{line_number(latex_code, begin_pos)}行）'
+                    f'以 \\end{{{env_name}}} 结束', match.start(),
+                ))
+    for env_name, pos in stack:
+        issues.append(make_issue(latex_code, SEVERITY_ERROR, MISSING_END, f'缺少 \\end{{{env_name}}}', pos))
+    return issues
+
+
+def check_rows(latex_code, structure=None):
+    """检查是否有行的列数超过列定义，只返回警告。"""
+    if structure is None:
+        structure = analyze_table(latex_code)
+    if structure is None or not structure.spec_columns:
+        return []
+    overflow = [(index, columns) for index, columns in enumerate(structure.rows, start=1)
+                if columns > structure.spec_columns]
+    if not overflow:
+        return []
+    row, columns = overflow[0]
+    message = f'表格第{row}行有{columns}列，超过列定义的{structure.spec_columns}列'
+    if len(overflow) > 1:
+        message += f'（共{len(overflow)}行超出）'
+    return [make_issue(latex_code, SEVERITY_WARNING, ROW_OVERFLOW, message)]
+
+
+def preflight_check(latex_code, structure=None):
+    """
+    对表格代码做编译前检查。
+
+    :param latex_code: 原始的表格LaTeX代码。
+    :param structure: analyze_table 的分析结果，为None时按需分析。
+    :return: 检查结果列表，每项包含 severity、type、message 和 line（从1开始，可能为None）。
+    """
+    issues = check_braces(latex_code) + check_environments(latex_code)
+    if not issues:
+        # 花括号或环境有问题时表格结构不可靠，不再检查列数
+        issues = check_rows(latex_code, structure)
+    return issues
+
+
+def has_fatal_issues(issues):
+    return any(issue['severity'] == SEVERITY_ERROR for issue in issues)
+
+
+def format_issue(issue):
+    if issue['line'] is None:
+        return issue['message']
+    return f"第{issue['line']}行: {issue['message']}"
+
+
+def preflight_result(issues):
+    """
+    预检查发现错误时返回的编译结果，格式与 compile_latex_to_pdf 的结果相同。
+    errors 与 pdflatex 的错误记录格式相同，行号即原始代码中的行号。
+    """
+    return {
+        "success": False,
+        "error_type": ERROR_PREFLIGHT,
+        "message": "预检查发现错误，未进行编译。",
+        "errors": [make_error(issue['message'], source_line=issue['line'])
+                   for issue in issues if issue['severity'] == SEVERITY_ERROR],
+        "errors_truncated": False,
+        "issues": issues,
+    }
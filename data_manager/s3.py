@@ -0,0 +1,172 @@
+"""
+进程内共享的 S3 客户端。
+
+创建 boto3 客户端需要加载服务模型、解析 endpoint 并建立新的连接池，开销不小。
+这里按凭证和 endpoint_url 缓存客户端，所有访问 S3 的视图和命令共用，
+长时间未使用的客户端会被关闭并移除。boto3 客户端本身是线程安全的。
+
+图片的预签名URL在返回数据项时才生成，并连同过期时间缓存在内存中，
+临近过期时自动重新生成。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+
+def client_key(aws_access_key_id, aws_secret_access_key, endpoint_url):
+    """客户端的缓存key，其中只保存密钥的哈希。"""
+    secret_hash = hashlib.sha256((aws_secret_access_key or '').encode('utf-8')).hexdigest()
+    return aws_access_key_id, secret_hash, endpoint_url
+
+
+class S3ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}  # key -> [client, last_used]
+
+    def _build_config(self):
+        return Config(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=settings.S3_CONNECT_TIMEOUT,
+            read_timeout=settings.S3_READ_TIMEOUT,
+            tcp_keepalive=settings.S3_TCP_KEEPALIVE,
+            retries={'max_attempts': settings.S3_MAX_ATTEMPTS, 'mode': settings.S3_RETRY_MODE},
+        )
+
+    def _evict_idle(self, now):
+        expire_before = now - settings.S3_CLIENT_IDLE_TIMEOUT
+        for key in [key for key, (_, last_used) in self._clients.items() if last_used < expire_before]:
+            client = self._clients.pop(key)[0]
+            client.close()
+
+    def get(self, aws_access_key_id, aws_secret_access_key, endpoint_url):
+        """
+        返回指定凭证和 endpoint 对应的客户端，不存在时创建。
+        凭证为None时使用 boto3 默认的凭证查找顺序（环境变量、配置文件等）。
+        """
+        key = client_key(aws_access_key_id, aws_secret_access_key, endpoint_url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                # boto3 的默认 session 不是线程安全的，每个客户端使用独立的 session 创建
+                session = boto3.session.Session(
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                )
+                client = session.client('s3', endpoint_url=endpoint_url, config=self._build_config())
+                entry = self._clients[key] = [client, now]
+            entry[1] = now
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            for client, _ in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+class PresignedUrlCache:
+    """
+    预签名URL的 LRU 缓存，按 (客户端key, bucket, key) 缓存URL及其过期时间。
+    剩余有效期不足 S3_PRESIGNED_URL_REFRESH_MARGIN 秒的URL视为失效并重新生成，
+    保证返回给前端的URL至少还能使用这么长时间。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()  # (client_key, bucket, key) -> (url, expires_at)
+
+    def get(self, s3_client, owner_key, bucket, key):
+        """
+        :return: (url, 过期时间的 Unix 时间戳) 元组。
+        """
+        cache_key = (owner_key, bucket, key)
+        now = time.time()
+        with self._lock:
+            entry = self._urls.get(cache_key)
+            if entry is not None and entry[1] - settings.S3_PRESIGNED_URL_REFRESH_MARGIN > now:
+                self._urls.move_to_end(cache_key)
+                return entry
+
+        # 签名只是本地计算，不需要持有锁；并发时重复生成也没有问题
+        expires_in = settings.S3_PRESIGNED_URL_EXPIRES
+        url = s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key},
+                                               ExpiresIn=expires_in)
+        entry = (url, now + expires_in)
+        with self._lock:
+            self._urls[cache_key] = entry
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > settings.S3_PRESIGNED_URL_CACHE_SIZE:
+                self._urls.popitem(last=False)
+        return entry
+
+
+_registry = S3ClientRegistry()
+_presigned_urls = PresignedUrlCache()
+
+
+def get_s3_client(aws_access_key_id=None, aws_secret_access_key=None, endpoint_url=None):
+    return _registry.get(aws_access_key_id, aws_secret_access_key, endpoint_url)
+
+
+def _session_credentials(request):
+    credentials = (
+        request.session.get('aws_access_key_id'),
+        request.session.get('aws_secret_access_key'),
+        request.session.get('endpoint_url'),
+    )
+    return credentials if all(credentials) else None
+
+
+def get_session_s3_client(request):
+    """使用会话中保存的凭证获取客户端，凭证未设置或会话过期时返回None。"""
+    credentials = _session_credentials(request)
+    if credentials is None:
+        return None
+    return get_s3_client(*credentials)
+
+
+def get_session_presigner(request):
+    """
+    返回使用会话凭证生成预签名URL的函数，凭证未设置或会话过期时返回None。
+
+    返回的函数参数为 (bucket, key)，返回 (url, 过期时间的 Unix 时间戳)。
+    """
+    credentials = _session_credentials(request)
+    if credentials is None:
+        return None
+    s3_client = get_s3_client(*credentials)
+    owner_key = client_key(*credentials)
+    return lambda bucket, key: _presigned_urls.get(s3_client, owner_key, bucket, key)
+
+
+def image_key(dataset, image_name):
+    """数据项图片在S3中的完整key。"""
+    return f"{dataset.prefix}/{image_name}"
+
+
+def get_object_if_modified(s3_client, bucket, key, etag='', last_modified=None):
+    """
+    条件读取对象：有 etag 时使用 If-None-Match，否则有 last_modified 时使用 If-Modified-Since。
+
+    :return: get_object 的响应；对象未变化（S3 返回 304）时返回None。
+    """
+    conditions = {}
+    if etag:
+        conditions['IfNoneMatch'] = etag
+    elif last_modified is not None:
+        conditions['IfModifiedSince'] = last_modified
+    try:
+        return s3_client.get_object(Bucket=bucket, Key=key, **conditions)
+    except ClientError as e:
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+            return None
+        raise
@@ -0,0 +1,105 @@
+"""
+编译用的临时目录。
+
+每次编译使用独立的目录（job-<pid>-xxxx），位于 LATEX_SCRATCH_ROOTS 中第一个可写的根目录下，
+默认优先使用内存文件系统 /dev/shm，不可用时退回到项目目录下的 temp/scratch。
+编译结束后先将目录原子地重命名为 trash-xxxx 再删除，不会留下写到一半被删除的目录；
+进程崩溃时遗留的目录在启动时由 sweep_scratch_dirs 清理。
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+JOB_PREFIX = 'job-'
+TRASH_PREFIX = 'trash-'
+
+_scratch_root = None
+_root_lock = threading.Lock()
+
+
+def _usable(root):
+    try:
+        os.makedirs(root, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(root, os.W_OK | os.X_OK)
+
+
+def get_scratch_root():
+    """返回第一个可写的根目录，结果在进程内缓存。"""
+    global _scratch_root
+    with _root_lock:
+        if _scratch_root is None or not os.path.isdir(_scratch_root):
+            roots = [str(root) for root in settings.LATEX_SCRATCH_ROOTS]
+            _scratch_root = next((root for root in roots if _usable(root)), None)
+            if _scratch_root is None:
+                raise OSError(f'没有可用的临时目录: {roots}')
+        return _scratch_root
+
+
+def create_scratch_dir():
+    return tempfile.mkdtemp(prefix=f'{JOB_PREFIX}{os.getpid()}-', dir=get_scratch_root())
+
+
+def remove_scratch_dir(path):
+    """将目录重命名后删除。"""
+    root = os.path.dirname(path)
+    trash_path = os.path.join(root, TRASH_PREFIX + os.path.basename(path)[len(JOB_PREFIX):])
+    try:
+        os.rename(path, trash_path)
+    except OSError:
+        trash_path = path
+    shutil.rmtree(trash_path, ignore_errors=True)
+
+
+@contextmanager
+def scratch_dir():
+    """创建一次编译使用的临时目录，退出上下文时删除。"""
+    path = create_scratch_dir()
+    try:
+        yield path
+    finally:
+        remove_scratch_dir(path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_scratch_dirs():
+    """
+    删除遗留的临时目录：所有 trash- 目录，以及创建它的进程已退出或超过
+    LATEX_SCRATCH_MAX_AGE 秒的 job- 目录。
+    """
+    expire_before = time.time() - settings.LATEX_SCRATCH_MAX_AGE
+    for root in settings.LATEX_SCRATCH_ROOTS:
+        root = str(root)
+        try:
+            names = os.listdir(root)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            if name.startswith(TRASH_PREFIX):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not name.startswith(JOB_PREFIX):
+                continue
+            try:
+                pid = int(name[len(JOB_PREFIX):].split('-', 1)[0])
+                stale = os.stat(path).st_mtime < expire_before
+            except (ValueError, OSError):
+                continue
+            if stale or not _pid_alive(pid):
+                remove_scratch_dir(path)
@@ -0,0 +1,24 @@
+"""
+SQLite 连接的初始化。
+
+Django 4.2 的 SQLite 后端不支持在 OPTIONS 中设置 PRAGMA，这里在每个新连接建立时设置
+日志模式和同步级别（见 settings.SQLITE_*）。journal_mode=WAL 会写入数据库文件，
+之后所有连接（包括其他进程）都使用 WAL。
+"""
+from django.conf import settings
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created 信号的处理函数。"""
+    if connection.vendor != 'sqlite':
+        return
+    journal_mode = settings.SQLITE_JOURNAL_MODE.upper()
+    synchronous = settings.SQLITE_SYNCHRONOUS.upper()
+    if journal_mode not in JOURNAL_MODES or synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f'无效的 SQLite 设置: journal_mode={journal_mode}, synchronous={synchronous}')
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
@@ -0,0 +1,34 @@
+"""
+服务启动时在后台执行的任务。
+
+由 myproject/wsgi.py 和 myproject/asgi.py 在创建应用后调用（runserver 也通过 WSGI_APPLICATION
+加载 wsgi.py），migrate、shell 等管理命令不会执行这些任务。
+"""
+import threading
+
+from django.conf import settings
+
+_started = False
+_started_lock = threading.Lock()
+
+
+def start_background_tasks():
+    """启动后台任务，同一进程中只执行一次。"""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    # 清理进程崩溃时遗留的编译临时目录
+    from .scratch import sweep_scratch_dirs
+    threading.Thread(target=sweep_scratch_dirs, daemon=True).start()
+
+    # 启动时在后台预编译导言区（占用一个后台编译槽），首次编译无需等待格式文件构建
+    if settings.LATEX_PRECOMPILE_PREAMBLE:
+        from .latex_compiler import ensure_preamble_format
+        threading.Thread(target=ensure_preamble_format, daemon=True).start()
+
+    if settings.PRECOMPILE_RESUME_ON_STARTUP:
+        from .precompile import resume_interrupted_jobs
+        threading.Thread(target=resume_interrupted_jobs, daemon=True).start()
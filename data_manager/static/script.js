@@ -1,7 +1,13 @@
 document.addEventListener('DOMContentLoaded', function() {
     let currentIndex = 0; // 当前数据的索引
     let totalItems = 0; // 总数据条目数
-    let dataItems = []; // 存储从后端加载的数据项
+    let dataItems = []; // 已加载的数据项（不含LaTeX代码，按需获取）
+    let currentDatasetId = null; // 当前加载的数据集ID
+    let nextCursor = null; // 下一页的游标，为null时表示没有更多数据
+    let pageRequest = null; // 正在进行的分页请求
+    const PAGE_SIZE = 100;
+    const PAGE_PREFETCH_MARGIN = 20; // 距离已加载末尾不足该数量时预取下一页
+    const IMAGE_PREFETCH_COUNT = 3; // 显示图片时让服务端预取之后的图片数量
 
     const pathInput = document.getElementById('path-input');
     const loadButton = document.getElementById('load');
@@ -17,16 +23,36 @@ document.addEventListener('DOMContentLoaded', function() {
     const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
     const loadError = document.getElementById('load-error');
     const setCredentials = document.getElementById('set-credentials');
+    const itemFilter = document.getElementById('item-filter');
+    const precompileCheckbox = document.getElementById('precompile');
+    const precompileProgress = document.getElementById('precompile-progress');
+    const cancelPrecompileButton = document.getElementById('cancel-precompile');
+    let precompileJobId = null;
+    let precompileTimer = null;
+    const PDF_PREFETCH_COUNT = 2; // 在后台预编译当前数据项前后各多少项
+    const PDF_BLOB_CACHE_SIZE = 20; // 最多保留多少个已下载PDF的 blob URL
+    const compileRequests = new Map(); // item.id -> {controller, priority, promise}，离开预取范围时取消
+    const pdfBlobUrls = new Map(); // item.id -> blob URL，按最近使用排序（LRU）
 
     pathInput.value = 's3://bucket-name/prefix/name.json';
     
-    function base64DecodeUnicode(str) {
-        // 将Base64编码的字节转换为百分比编码，然后获取原始字符串。
-        percentEncodedStr = atob(str).split('').map(function(c) {
-            return '%' + ('00' + c.charCodeAt(0).toString(16)).slice(-2);
-        }).join('');
-    
-        return decodeURIComponent(percentEncodedStr);
+    function escapeHtml(text) {
+        return String(text)
+            .replace(/&/g, '&amp;')
+            .replace(/</g, '&lt;')
+            .replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;');
+    }
+
+    // 编译错误记录：message、line（文档行号）、context（出错位置）、source_line（LaTeX代码中的行号）
+    // 旧版本保存的编译结果中错误是字符串
+    function formatCompileError(error) {
+        if (typeof error === 'string') {
+            return `<li><pre>${escapeHtml(error)}</pre></li>`;
+        }
+        const location = error.source_line ? `第${error.source_line}行: ` : '';
+        const context = error.context ? `<pre>${escapeHtml(error.context)}</pre>` : '';
+        return `<li>${escapeHtml(location + error.message)}${context}</li>`;
     }
     
     function showPopup() {
@@ -71,15 +97,98 @@ document.addEventListener('DOMContentLoaded', function() {
     
     
 
+    function resetItems() {
+        clearCompileState();
+        dataItems = [];
+        totalItems = 0;
+        currentIndex = 0; // 重置索引
+        nextCursor = null;
+        pageRequest = null;
+    }
+
+    function fetchNextPage() {
+        // 获取下一页数据项，同一时间只发出一个分页请求
+        if (pageRequest) {
+            return pageRequest;
+        }
+        if (!currentDatasetId || (dataItems.length > 0 && nextCursor === null)) {
+            return Promise.resolve();
+        }
+        const params = new URLSearchParams({ dataset: currentDatasetId, limit: PAGE_SIZE });
+        if (nextCursor !== null) {
+            params.set('cursor', nextCursor);
+        }
+        if (itemFilter.value) {
+            new URLSearchParams(itemFilter.value).forEach((value, key) => params.set(key, value));
+        }
+        const datasetId = currentDatasetId;
+        pageRequest = fetch(`/api/items/?${params}`)
+        .then(response => response.json())
+        .then(page => {
+            if (datasetId !== currentDatasetId) {
+                return; // 请求期间切换了数据集
+            }
+            dataItems.push(...page.items);
+            nextCursor = page.next_cursor;
+            if (page.total !== undefined) {
+                totalItems = page.total;
+            }
+        })
+        .finally(() => {
+            pageRequest = null;
+        });
+        return pageRequest;
+    }
+
+    function ensureItemLoaded(index) {
+        // 确保指定下标的数据项所在的页已经加载
+        if (index < dataItems.length || nextCursor === null) {
+            return Promise.resolve();
+        }
+        return fetchNextPage().then(() => ensureItemLoaded(index));
+    }
+
+    function ensureItemDetail(item) {
+        // 按需获取数据项的LaTeX代码
+        if (item.pred_tex_code !== undefined) {
+            return Promise.resolve(item);
+        }
+        return fetchItemDetail(item);
+    }
+
+    function fetchItemDetail(item) {
+        // 获取数据项的完整信息，同时刷新图片URL
+        return fetch(`/api/items/${item.id}/`)
+        .then(response => response.json())
+        .then(detail => {
+            item.pred_tex_code = detail.pred_tex_code;
+            item.image_url = detail.image_url;
+            item.image_url_expires_at = detail.image_url_expires_at;
+            return item;
+        });
+    }
+
+    function imageProxyUrl(item) {
+        // 图片通过服务端的缓存代理获取，显示预览图并预取之后的图片
+        return `/api/items/${item.id}/image/?size=preview&prefetch=${IMAGE_PREFETCH_COUNT}`;
+    }
+
+    function reloadItems() {
+        resetItems();
+        return fetchNextPage().then(() => {
+            updateDisplay();
+        });
+    }
+
     function loadDataItems(s3Path) {
-        // 使用传入的S3路径发送请求
+        // 使用传入的S3路径发送请求，服务端返回汇总信息，数据项通过分页接口获取
         fetch('/api/load-json-from-s3/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': csrftoken, // 确保这里使用了正确的CSRF Token
             },
-            body: JSON.stringify({ s3_path: s3Path }), // 使用用户输入的S3路径
+            body: JSON.stringify({ s3_path: s3Path, precompile: precompileCheckbox.checked }), // 使用用户输入的S3路径
         })
         .then(response => {
             if (!response.ok) {
@@ -90,12 +199,13 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             return response.json();
           })
-        .then(data => {
-            dataItems = data; // 直接赋值
-            totalItems = dataItems.length;
-            currentIndex = 0; // 重置索引
-            updateDisplay(); // 更新显示
+        .then(summary => {
+            currentDatasetId = summary.dataset_id;
+            if (summary.precompile_job_id) {
+                watchPrecompileJob(summary.precompile_job_id);
+            }
             loadError.textContent='';
+            return reloadItems();
         })
         .catch(error => {
             console.error('Error loading data:', error);
@@ -104,71 +214,213 @@ document.addEventListener('DOMContentLoaded', function() {
             pathInput.focus();
         });
     }
+
+    itemFilter.addEventListener('change', function() {
+        reloadItems();
+    });
     
+    function watchPrecompileJob(jobId) {
+        // 定期查询预编译进度，任务结束后停止
+        precompileJobId = jobId;
+        clearInterval(precompileTimer);
+        cancelPrecompileButton.style.display = 'inline';
+        precompileTimer = setInterval(function() {
+            fetch(`/api/precompile/${jobId}/`)
+            .then(response => response.json())
+            .then(job => {
+                precompileProgress.textContent = `预编译: ${job.compiled_items}/${job.total_items} (失败 ${job.failed_items}) ${job.status}`;
+                if (job.status !== 'pending' && job.status !== 'running') {
+                    clearInterval(precompileTimer);
+                    cancelPrecompileButton.style.display = 'none';
+                }
+            })
+            .catch(error => {
+                console.error('Error fetching precompile progress:', error);
+            });
+        }, 2000);
+    }
+
+    cancelPrecompileButton.addEventListener('click', function() {
+        if (!precompileJobId) {
+            return;
+        }
+        fetch(`/api/precompile/${precompileJobId}/cancel/`, {
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': csrftoken,
+            },
+        })
+        .catch(error => {
+            console.error('Error cancelling precompile:', error);
+        });
+    });
+
     function hideAllDisplayAreas() {
         errorDisplayArea.style.display = 'none';
         pdfDisplayArea.style.display = 'none';
         latexDisplayArea.style.display = 'none';
     }
 
-    function compileAndDisplayPDF() {
-        const currentItem = dataItems[currentIndex];
-        if (!currentItem) {
-            console.error('No current item available for PDF compilation');
-            return;
+    function pdfSource(item) {
+        // 已预取的PDF使用本地的 blob URL，否则使用服务端编译缓存中的地址
+        const blobUrl = pdfBlobUrls.get(item.id);
+        if (blobUrl) {
+            pdfBlobUrls.delete(item.id); // 移到最近使用的位置
+            pdfBlobUrls.set(item.id, blobUrl);
+            return blobUrl;
         }
-        const latexCode = currentItem.pred_tex_code;
-        const filename=currentItem.image_name
-        if (!latexCode) {
-            console.error('No LaTeX code available for the current item');
-            return;
+        return item.pdf_url || '';
+    }
+
+    function cachePdfBlob(item, blob) {
+        // blob URL 在被淘汰时释放；不淘汰当前显示的数据项
+        const oldUrl = pdfBlobUrls.get(item.id);
+        if (oldUrl) {
+            URL.revokeObjectURL(oldUrl);
+            pdfBlobUrls.delete(item.id);
+        }
+        pdfBlobUrls.set(item.id, URL.createObjectURL(blob));
+        const current = dataItems[currentIndex];
+        for (const [itemId, url] of pdfBlobUrls) {
+            if (pdfBlobUrls.size <= PDF_BLOB_CACHE_SIZE) {
+                break;
+            }
+            if (current && itemId === current.id) {
+                continue;
+            }
+            URL.revokeObjectURL(url);
+            pdfBlobUrls.delete(itemId);
         }
+    }
 
-        const requestBody = {
-            file_name: filename, 
-            pred_tex_code: latexCode,
-        };
+    function clearCompileState() {
+        // 切换数据集时取消所有编译请求并释放所有 blob URL
+        compileRequests.forEach(request => request.controller.abort());
+        compileRequests.clear();
+        pdfBlobUrls.forEach(url => URL.revokeObjectURL(url));
+        pdfBlobUrls.clear();
+    }
 
-        fetch('/compile_pdf/', {
+    function requestCompile(item, priority) {
+        // 编译数据项并把PDF下载为 blob，同一数据项同时只有一个请求；返回的 Promise 在PDF可以显示时完成
+        if (pdfBlobUrls.has(item.id)) {
+            return Promise.resolve(item);
+        }
+        const pending = compileRequests.get(item.id);
+        if (pending) {
+            if (pending.priority === 'background' && priority === 'interactive') {
+                // 沿用正在进行的预取；预取因队列已满等原因失败时再以交互优先级编译
+                return pending.promise.catch(error => {
+                    if (error.name === 'AbortError' || item.compileFailed) {
+                        throw error;
+                    }
+                    return requestCompile(item, priority);
+                });
+            }
+            return pending.promise;
+        }
+        const request = { controller: new AbortController(), priority: priority, promise: null };
+        const signal = request.controller.signal;
+        // 只发送数据项ID，服务端从数据库读取LaTeX代码
+        request.promise = fetch('/compile_pdf_async/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-                'X-CSRFToken': csrftoken, 
+                'X-CSRFToken': csrftoken,
             },
-            body: JSON.stringify(requestBody),
+            body: JSON.stringify({ item_id: item.id, priority: priority }),
+            signal: signal,
         })
         .then(response => {
-            const messageEncoded = response.headers.get('X-Compile-Message') || '';
-            const compileMessage = base64DecodeUnicode(messageEncoded);
-            const compileErrorsJson = response.headers.get('X-Compile-Errors');
-            const compileErrors = compileErrorsJson ? JSON.parse(compileErrorsJson) : [];
-            currentItem.compileMessage = compileMessage;
-            currentItem.compileErrors = compileErrors;
-            if (response.ok) {
-                return response.blob();
-            } else {
-                // 编译失败，提取错误信息后抛出错误
-                return response.json().then(err => {
-                    throw err;
-                });
+            // 编译结果和错误信息都在响应体中，PDF 通过 pdf_url 单独加载
+            return response.json().then(result => {
+                if (response.status === 429) {
+                    throw new Error(result.message || '编译队列已满'); // 稍后可以重试，不记录为编译失败
+                }
+                item.compileMessage = result.message || '';
+                item.compileErrors = result.errors || [];
+                item.compileErrorsTruncated = !!result.errors_truncated;
+                if (!response.ok || !result.pdf_url) {
+                    item.compileFailed = true;
+                    throw result;
+                }
+                item.pdf_url = result.pdf_url;
+                return fetch(result.pdf_url, { signal: signal });
+            });
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`获取PDF失败: ${response.status}`);
             }
+            return response.blob();
         })
         .then(blob => {
-            // 创建 Blob URL 并保存到当前数据项
-            const pdfUrl = URL.createObjectURL(blob);
-            currentItem.pdf_url = pdfUrl;
+            cachePdfBlob(item, blob);
+            return item;
+        })
+        .finally(() => {
+            if (compileRequests.get(item.id) === request) {
+                compileRequests.delete(item.id);
+            }
+        });
+        compileRequests.set(item.id, request);
+        return request.promise;
+    }
+
+    function updatePrefetch() {
+        // 取消已离开预取范围的编译请求，并在后台预取当前数据项前后各 PDF_PREFETCH_COUNT 项
+        const wanted = new Map();
+        for (let offset = 1; offset <= PDF_PREFETCH_COUNT; offset++) {
+            [currentIndex + offset, currentIndex - offset].forEach(index => {
+                const item = dataItems[index];
+                if (item) {
+                    wanted.set(item.id, item);
+                }
+            });
+        }
+        const current = dataItems[currentIndex];
+        compileRequests.forEach((request, itemId) => {
+            if (!wanted.has(itemId) && !(current && current.id === itemId)) {
+                request.controller.abort();
+                compileRequests.delete(itemId);
+            }
+        });
+        wanted.forEach(item => {
+            if (!item.compileFailed) {
+                requestCompile(item, 'background').catch(() => {}); // 预取失败时在显示该项时再编译
+            }
+        });
+    }
+
+    function compileAndDisplayPDF() {
+        const currentItem = dataItems[currentIndex];
+        if (!currentItem) {
+            console.error('No current item available for PDF compilation');
+            return;
+        }
+        requestCompile(currentItem, 'interactive')
+        .then(() => {
+            if (dataItems[currentIndex] !== currentItem) {
+                return; // 编译期间切换到了其他数据项
+            }
             updateDisplay();
             const pdfIframe = document.getElementById('pdf-render');
-            pdfIframe.src = currentItem.pdf_url; // 直接设置 iframe 的 src 属性
+            pdfIframe.src = pdfSource(currentItem); // 直接设置 iframe 的 src 属性
             pdfDisplayArea.style.display = 'block'; // 显示 PDF 区域
-            
         })
         .catch(error => {
+            if (error.name === 'AbortError') {
+                return; // 已切换到其他数据项
+            }
             console.error('Error compiling or displaying PDF:', error);
-            currentItem.compileMessage = error.message || '编译失败';
-            currentItem.compileErrors = error.errors || [];
-            updateDisplay(); // 即使编译失败也更新显示，以显示错误信息
-
+            if (!currentItem.compileFailed) {
+                currentItem.compileMessage = error.message || '编译失败';
+                currentItem.compileErrors = [];
+                currentItem.compileErrorsTruncated = false;
+            }
+            if (dataItems[currentIndex] === currentItem) {
+                updateDisplay(); // 即使编译失败也更新显示，以显示错误信息
+            }
         });
     }
     
@@ -231,14 +483,16 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
     
-        // 检查当前项是否包含预编译的 PDF URL
-        if (currentItem.pdf_url) {
+        // 检查当前项是否已有编译好的PDF（预取的 blob 或编译缓存中的地址）
+        const source = pdfSource(currentItem);
+        if (source) {
             const pdfIframe = document.getElementById('pdf-render');
-            pdfIframe.src = currentItem.pdf_url;
+            pdfIframe.src = source;
             pdfDisplayArea.style.display = 'block';
         } else {
             compileAndDisplayPDF();
         }
+        updatePrefetch();
     });
     
 
@@ -255,7 +509,7 @@ document.addEventListener('DOMContentLoaded', function() {
             //重置旋转状态
             imageDisplay.style.transform = 'rotate(0deg)';
             imageDisplay.setAttribute('data-rotation', '0');
-            imageDisplay.src = item.image_path;
+            imageDisplay.src = imageProxyUrl(item);
             // 图片加载完成后的操作
             imageDisplay.onload = function() {
                 this.style.maxWidth = '70%'; // 限制最大宽度
@@ -268,15 +522,23 @@ document.addEventListener('DOMContentLoaded', function() {
                 imageDisplay.onload();
             }
             const pdfIframe = document.getElementById('pdf-render');
-            if (item.pdf_url) {
-                pdfIframe.src = item.pdf_url; // 使用更新后的 PDF URL 或 Blob URL
+            const pdfSrc = pdfSource(item);
+            if (pdfSrc) {
+                pdfIframe.src = pdfSrc; // 预取的 blob URL 或编译缓存中的 PDF 地址
             } else {
                 pdfIframe.src = ''; // 如果没有 URL，清空之前的 PDF 显示
             }
                  
-            // 显示 LaTeX 代码
+            // 显示 LaTeX 代码，尚未获取时按需加载
             const latexCodeElement = document.getElementById('latex-code');
-            latexCodeElement.textContent = item.pred_tex_code;
+            latexCodeElement.textContent = item.pred_tex_code || '';
+            if (item.pred_tex_code === undefined) {
+                ensureItemDetail(item).then(() => {
+                    if (dataItems[currentIndex] === item) {
+                        latexCodeElement.textContent = item.pred_tex_code;
+                    }
+                });
+            }
 
             counter.textContent = `${currentIndex + 1}/${totalItems}`;
             const compileMessageDisplay = document.getElementById('compile-message-display');
@@ -284,13 +546,16 @@ document.addEventListener('DOMContentLoaded', function() {
             compileMessageDisplay.innerHTML = ''; 
             compileErrorDisplay.innerHTML = '';// 清空之前的内容
             if (item.compileMessage) {
-                compileMessageDisplay.innerHTML += `<div>Compile Message: ${item.compileMessage}</div>`;
+                compileMessageDisplay.innerHTML += `<div>Compile Message: ${escapeHtml(item.compileMessage)}</div>`;
             }
             if (item.compileErrors && item.compileErrors.length > 0) {
-                compileErrorDisplay.innerHTML += `<div>Errors:<ul>${item.compileErrors.map(error => `<li>${error}</li>`).join('')}</ul></div>`;
+                const truncated = item.compileErrorsTruncated ? '<div>错误过多，只显示前面的部分。</div>' : '';
+                compileErrorDisplay.innerHTML += `<div>Errors:<ul>${item.compileErrors.map(formatCompileError).join('')}</ul>${truncated}</div>`;
             }
             compileMessageDisplay.style.display = compileMessageDisplay.innerHTML ? 'block' : 'none';
             compileErrorDisplay.style.display = compileMessageDisplay.innerHTML ? 'block' : 'none';
+        } else {
+            counter.textContent = '0/0'; // 没有符合筛选条件的数据项
         }
     }
     
@@ -318,54 +583,187 @@ document.addEventListener('DOMContentLoaded', function() {
 
     nextButton.addEventListener('click', function() {
         if (currentIndex < totalItems - 1) {
-            currentIndex++;
-            updateDisplay();
-            document.getElementById('show-pdf').click();
+            ensureItemLoaded(currentIndex + 1).then(() => {
+                if (currentIndex + 1 >= dataItems.length) {
+                    return;
+                }
+                currentIndex++;
+                updateDisplay();
+                document.getElementById('show-pdf').click();
+                if (dataItems.length - currentIndex < PAGE_PREFETCH_MARGIN) {
+                    fetchNextPage(); // 提前加载下一页
+                }
+            });
         }
     });
 
+    // 分类标注先保存在本地队列（localStorage）中，再批量提交到服务端；
+    // 提交失败时按指数退避重试，页面关闭或刷新后未提交的标注在下次打开时继续提交。
+    // 每项标注带有数据项的版本号，数据项已被其他人修改时服务端拒绝该标注（乐观锁）
+    const LABEL_QUEUE_KEY = 'pendingLabels';
+    const LABEL_FLUSH_DELAY = 1000; // 最后一次标注后等待多久提交（毫秒）
+    const LABEL_BATCH_SIZE = 50; // 队列中攒够该数量时立即提交，也是每次提交的最大数量
+    const LABEL_RETRY_MAX_DELAY = 30000; // 重试间隔的上限（毫秒）
+    let labelQueue = loadLabelQueue(); // item_id -> {category, version}
+    let labelFlushTimer = null;
+    let labelFlushPromise = null; // 正在进行的提交
+    let labelRetryDelay = LABEL_FLUSH_DELAY;
+
+    function loadLabelQueue() {
+        let queue;
+        try {
+            queue = JSON.parse(localStorage.getItem(LABEL_QUEUE_KEY)) || {};
+        } catch (error) {
+            return {};
+        }
+        Object.keys(queue).forEach(itemId => {
+            if (typeof queue[itemId] === 'string') {
+                queue[itemId] = { category: queue[itemId], version: null }; // 旧版本保存的标注没有版本号
+            }
+        });
+        return queue;
+    }
+
+    function saveLabelQueue() {
+        try {
+            localStorage.setItem(LABEL_QUEUE_KEY, JSON.stringify(labelQueue));
+        } catch (error) {
+            console.error('保存未提交的标注失败:', error);
+        }
+    }
+
+    function findLoadedItem(itemId) {
+        return dataItems.find(item => item.id === itemId);
+    }
+
+    function queueLabel(item, category) {
+        // 已在队列中的数据项保留原来的版本号，即服务端上尚未被本次修改的版本
+        const queued = labelQueue[item.id];
+        const version = queued ? queued.version : (item.version === undefined ? null : item.version);
+        labelQueue[item.id] = { category: category, version: version };
+        saveLabelQueue();
+        item.category = category;
+        item.is_annotated = true;
+        if (Object.keys(labelQueue).length >= LABEL_BATCH_SIZE) {
+            flushLabels();
+        } else {
+            scheduleLabelFlush(LABEL_FLUSH_DELAY);
+        }
+    }
+
+    function scheduleLabelFlush(delay) {
+        clearTimeout(labelFlushTimer);
+        labelFlushTimer = setTimeout(flushLabels, delay);
+    }
+
+    function flushLabels(keepalive) {
+        // 返回的 Promise 在队列提交完（或提交失败、等待重试）后完成
+        clearTimeout(labelFlushTimer);
+        if (labelFlushPromise) {
+            return labelFlushPromise; // 当前提交结束后会继续提交队列中剩余的标注
+        }
+        const batch = Object.entries(labelQueue).slice(0, LABEL_BATCH_SIZE);
+        if (batch.length === 0) {
+            return Promise.resolve();
+        }
+        labelFlushPromise = fetch('/api/classify/bulk/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrftoken,
+            },
+            body: JSON.stringify({
+                labels: batch.map(([itemId, label]) => ({
+                    item_id: Number(itemId), category: label.category, version: label.version,
+                })),
+            }),
+            keepalive: !!keepalive,
+        })
+        .then(response => {
+            if (response.status >= 500) {
+                throw new Error(`服务端错误 ${response.status}`);
+            }
+            return response.json().then(result => {
+                if (!response.ok) {
+                    // 请求本身无效，重试也不会成功
+                    console.error('标注被拒绝:', result.message);
+                }
+                const versions = result.versions || {};
+                const conflicts = result.conflicts || [];
+                const conflictIds = new Set(conflicts.map(conflict => String(conflict.item_id)));
+                batch.forEach(([itemId, label]) => {
+                    const queued = labelQueue[itemId];
+                    if (!queued) {
+                        return;
+                    }
+                    if (conflictIds.has(itemId) || (queued.category === label.category && queued.version === label.version)) {
+                        delete labelQueue[itemId];
+                    } else if (versions[itemId] !== undefined) {
+                        // 提交期间又被重新标注，基于刚保存的版本继续提交
+                        queued.version = versions[itemId];
+                    }
+                });
+                saveLabelQueue();
+                Object.entries(versions).forEach(([itemId, version]) => {
+                    const item = findLoadedItem(Number(itemId));
+                    if (item) {
+                        item.version = version;
+                    }
+                });
+                // 版本冲突的数据项以服务端的当前状态为准
+                conflicts.forEach(conflict => {
+                    const item = findLoadedItem(conflict.item_id);
+                    if (item) {
+                        item.category = conflict.category;
+                        item.is_annotated = conflict.is_annotated;
+                        item.version = conflict.version;
+                    }
+                });
+                if (conflicts.length > 0) {
+                    loadError.textContent = `${conflicts.length}个数据项已被其他人修改，本次分类未保存，请重新查看后再分类`;
+                }
+                labelRetryDelay = LABEL_FLUSH_DELAY;
+            });
+        })
+        .then(() => {
+            labelFlushPromise = null;
+            if (Object.keys(labelQueue).length > 0) {
+                return flushLabels();
+            }
+        }, error => {
+            labelFlushPromise = null;
+            console.error('提交标注失败，稍后重试:', error);
+            scheduleLabelFlush(labelRetryDelay);
+            labelRetryDelay = Math.min(labelRetryDelay * 2, LABEL_RETRY_MAX_DELAY);
+        });
+        return labelFlushPromise;
+    }
+
+    window.addEventListener('online', () => flushLabels());
+    window.addEventListener('pagehide', () => flushLabels(true));
+    flushLabels(); // 提交上次未完成的标注
+
     // 实现分类按钮的事件监听
     const classifyButtons = document.querySelectorAll('.classify');
     classifyButtons.forEach(button => {
         button.addEventListener('click', function() {
             const category = this.getAttribute('data-category');
             const currentItem = dataItems[currentIndex]; // 从当前索引获取数据项
-            const imageName = currentItem.image_name; // 获取数据项的 image_name
-
-            fetch('/classify_data_item/', { // 确保这个URL与你的Django路由匹配
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': csrftoken, // 从HTML中获取CSRF token
-                },
-                body: JSON.stringify({
-                    image_name: imageName, // 发送 image_name 和 category
-                    category: category,
-                    
-                }),
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    console.log('分类成功:', data);
-                    currentItem.category = category; // 更新当前项的分类信息
-                } else {
-                    console.error('分类失败:', data.message);
-                    // 显示错误信息
-                }
-            })
-            .catch(error => {
-                console.error('请求失败:', error);
-            });
+            if (!currentItem) {
+                return;
+            }
+            queueLabel(currentItem, category);
         });
     });
 
     exportButton.addEventListener('click', function() {
         // 构建导出数据的 URL
-        const exportUrl = '/export_all_classified_data/'; 
+        const exportUrl = currentDatasetId ? `/export_all_classified_data/?dataset=${currentDatasetId}` : '/export_all_classified_data/';
 
-        // 发起请求以触发文件下载
-        window.location.href = exportUrl;
+        // 先提交尚未提交的标注，再发起请求以触发文件下载
+        flushLabels().then(() => {
+            window.location.href = exportUrl;
+        });
     });
 
 });
@@ -0,0 +1,329 @@
+"""
+LaTeX 表格结构分析。
+
+一次扫描表格代码，得到表格环境的位置、列定义及其列数、每行的有效列数等信息，
+供编译前的预处理使用。与按 \\\\ 切分再数 & 的做法相比：
+
+- 跳过 % 注释，\\& 等转义字符不计入；
+- \\multicolumn{n}{..}{..} 按 n 列计算；
+- 只统计最外层表格的行和列，嵌套环境和花括号内的 & 与 \\\\ 不计入；
+- 列定义中的 p{..}、*{n}{..}、@{..}、>{..} 等按实际列数计算。
+
+表格正文先归一化（见 count_row_columns），再由 str.split / str.count 统计每行的列数，
+所有步骤都在C层完成，普通文本不需要逐字符处理。
+"""
+import re
+
+# 可以识别的表格环境；需要先跳过宽度参数的环境
+TABLE_ENVIRONMENTS = ('tabular', 'tabular*', 'tabularx', 'longtable')
+WIDTH_ENVIRONMENTS = ('tabular*', 'tabularx')
+
+# 行数超过该值时使用长表格，列数超过该值时使用宽表格
+LONG_TABLE_THRESHOLD = 30
+WIDE_TABLE_THRESHOLD = 6
+
+# 环境的开始、结束标签；位于注释中的标签由 _commented_out 排除
+ENV_PATTERN = re.compile(r"\\(begin|end)\s*\{\s*([^{}]*?)\s*\}")
+# 一行中的第一个注释符（\% 不是注释，\\% 是换行后跟注释）
+LINE_COMMENT_PATTERN = re.compile(r"(?:[^\\%]|\\.)*%")
+TOKEN_PATTERN = re.compile(r"\\(?:[A-Za-z]+\*?|.)", re.DOTALL)
+OPTIONAL_ARG_PATTERN = re.compile(r"\s*\[[^\]]*\]")
+# 不含嵌套花括号和转义字符的参数，可以直接匹配
+SIMPLE_GROUP_PATTERN = re.compile(r"\s*\{([^{}\\]*)\}")
+
+# 以下用于归一化表格正文：换行命令替换为 ROW_SEPARATOR，\multicolumn{n} 替换为 n-1 个 &，
+# 嵌套环境和花括号分组整体删除，之后每行的有效列数就是 & 的个数加一
+ROW_SEPARATOR = '\x00'
+NESTED_BEGIN = '\x01'
+NESTED_END = '\x02'
+COMMENT_PATTERN = re.compile(r"%[^\n]*")
+ESCAPED_PATTERN = re.compile(r"\\[&{}%]")
+ROW_BREAK_PATTERN = re.compile(r"\\(?:tabularnewline|cr)(?![A-Za-z])")
+MULTICOLUMN_PATTERN = re.compile(r"\\multicolumn\s*\{\s*(\d+)\s*\}")
+NESTED_BEGIN_PATTERN = re.compile(r"\\begin\s*\{[^{}]*\}")
+NESTED_END_PATTERN = re.compile(r"\\end\s*\{[^{}]*\}")
+NESTED_ENV_PATTERN = re.compile(f"{NESTED_BEGIN}[^{NESTED_BEGIN}{NESTED_END}]*{NESTED_END}")
+GROUP_PATTERN = re.compile(r"\{[^{}]*\}")
+# 生成骨架时删除的字节：只保留花括号、& 和各种标记，用于判断是否有花括号分组中包含 & 或换行
+SKELETON_DELETE = bytes(set(range(256)) - set(f"{{}}&{ROW_SEPARATOR}{NESTED_BEGIN}{NESTED_END}".encode()))
+# 只包含空白、换行命令的可选参数和横线命令的行不计入行数
+EMPTY_ROW_PATTERN = re.compile(
+    r"\*?(?:\s*\[[^\]]*\])?(?:\s|\\(?:hline|toprule|midrule|bottomrule|cline|cmidrule|addlinespace)"
+    r"(?![A-Za-z])(?:\([^)]*\))?(?:\s*\[[^\]]*\])?(?:\s*\{[^{}]*\})?)*"
+)
+
+# 列定义中不占列且带一个参数的记号，以及占一列且带一个参数的记号
+SPEC_DECORATIONS = '@!<>'
+SPEC_SIZED_COLUMNS = 'pmb'
+
+# 列定义的记号，findall 一次切分出全部记号；花括号参数最多嵌套三层。切分结果中单独的 { } * \\
+# 说明有不完整或嵌套更深的参数，这时由 _tokenize_column_spec_slow 逐字符处理
+_SPEC_GROUP = r"\{(?:[^{}\\]|\\.|\{(?:[^{}\\]|\\.|\{(?:[^{}\\]|\\.)*\})*\})*\}"
+SPEC_TOKEN_PATTERN = re.compile(
+    rf"\s*([^\s{re.escape(SPEC_DECORATIONS)}{SPEC_SIZED_COLUMNS}*\\{{\[]"
+    rf"|[{re.escape(SPEC_DECORATIONS)}{SPEC_SIZED_COLUMNS}](?:\s*{_SPEC_GROUP})?"
+    rf"|\*\s*\{{\s*\d+\s*\}}\s*{_SPEC_GROUP}"
+    r"|\\(?:[A-Za-z]+\*?|.)"
+    rf"|{_SPEC_GROUP}|\[[^\]]*\]?|\S)",
+    re.DOTALL,
+)
+SPEC_REPEAT_PATTERN = re.compile(r"\*\s*\{\s*(\d+)\s*\}\s*\{(.*)\}", re.DOTALL)
+SPEC_INVALID_TOKENS = frozenset('{}*\\')
+# 按记号的第一个字符确定占用的列数，其余记号（包括 p{..} 等）占一列
+SPEC_TOKEN_COLUMNS = dict.fromkeys(SPEC_DECORATIONS + '\\{[|', 0)
+
+
+class TableStructure:
+    """
+    最外层表格环境的结构。位置都是原始代码中的下标。
+
+    :ivar env_name: 表格环境名称，例如 tabular。
+    :ivar begin: \\begin 的起始位置。
+    :ivar spec_start: 列定义内容（不含花括号）的起始位置。
+    :ivar spec_end: 列定义内容的结束位置，即右花括号的位置。
+    :ivar end_start: 对应的 \\end 的起始位置，环境未闭合时为 None。
+    :ivar end: \\end{...} 之后的位置，环境未闭合时为 None。
+    :ivar rows: 每个非空行的有效列数。
+    :ivar column_spec: 列定义的内容。
+    :ivar spec_tokens: tokenize_column_spec 切分列定义得到的记号。
+    :ivar spec_columns: 列定义中声明的列数。
+    """
+
+    def __init__(self, env_name, begin, spec_start, spec_end):
+        self.env_name = env_name
+        self.begin = begin
+        self.spec_start = spec_start
+        self.spec_end = spec_end
+        self.end_start = None
+        self.end = None
+        self.rows = []
+        self.column_spec = ''
+        self.spec_tokens = []
+        self.spec_columns = 0
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    @property
+    def max_cols(self):
+        """所有行中最大的有效列数，没有行时为列定义的列数。"""
+        return max(self.rows, default=self.spec_columns)
+
+    @property
+    def table_type(self):
+        if self.row_count > LONG_TABLE_THRESHOLD:
+            return "longtable"
+        elif self.max_cols > WIDE_TABLE_THRESHOLD:
+            return "wide_table"
+        return "standard"
+
+
+def _read_group(code, pos):
+    """
+    读取从 pos 开始（可以有前导空白）的花括号参数。
+
+    :return: (参数内容, 右花括号之后的位置)；没有参数或花括号未闭合时返回 (None, pos)。
+    """
+    match = SIMPLE_GROUP_PATTERN.match(code, pos)
+    if match is not None:
+        return match.group(1), match.end()
+    start = pos
+    while start < len(code) and code[start].isspace():
+        start += 1
+    if start >= len(code) or code[start] != '{':
+        return None, pos
+    depth = 0
+    i = start
+    while i < len(code):
+        char = code[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return code[start + 1:i], i + 1
+        i += 1
+    return None, pos
+
+
+def tokenize_column_spec(spec):
+    """
+    将列定义切分为记号。
+
+    :return: (记号文本, 占用的列数) 列表；例如 p{2cm} 占一列，@{} 和 | 不占列，
+             *{3}{c} 占三列。
+    """
+    texts = SPEC_TOKEN_PATTERN.findall(spec)
+    if not SPEC_INVALID_TOKENS.isdisjoint(texts):
+        return _tokenize_column_spec_slow(spec)
+    tokens = [(text, SPEC_TOKEN_COLUMNS.get(text[0], 1)) for text in texts]
+    if '*' in spec:
+        tokens = [(text, _repeated_columns(text) if text[0] == '*' else columns) for text, columns in tokens]
+    return tokens
+
+
+def _repeated_columns(text):
+    """*{n}{..} 占用的列数。"""
+    count, repeated = SPEC_REPEAT_PATTERN.fullmatch(text).groups()
+    return int(count) * sum(columns for _, columns in tokenize_column_spec(repeated))
+
+
+def _tokenize_column_spec_slow(spec):
+    """逐字符切分列定义，处理 SPEC_TOKEN_PATTERN 无法识别的列定义，结果格式同 tokenize_column_spec。"""
+    tokens = []
+    i = 0
+    while i < len(spec):
+        char = spec[i]
+        if char.isspace():
+            i += 1
+            continue
+        if char in SPEC_DECORATIONS or char in SPEC_SIZED_COLUMNS:
+            _, end = _read_group(spec, i + 1)
+            tokens.append((spec[i:end], 1 if char in SPEC_SIZED_COLUMNS else 0))
+            i = max(end, i + 1)
+        elif char == '*':
+            count, count_end = _read_group(spec, i + 1)
+            repeated, end = _read_group(spec, count_end)
+            try:
+                columns = int(count) * sum(columns for _, columns in _tokenize_column_spec_slow(repeated or ''))
+            except (TypeError, ValueError):
+                columns = 0
+            tokens.append((spec[i:end], columns))
+            i = max(end, i + 1)
+        elif char == '\\':
+            match = TOKEN_PATTERN.match(spec, i)
+            tokens.append((match.group(), 0))
+            i = match.end()
+        elif char == '{':
+            _, end = _read_group(spec, i)
+            tokens.append((spec[i:end], 0))
+            i = max(end, i + 1)
+        elif char == '[':
+            # 列类型的可选参数，例如 siunitx 的 S[table-format=2.1]
+            end = spec.find(']', i)
+            end = len(spec) if end == -1 else end + 1
+            tokens.append((spec[i:end], 0))
+            i = end
+        else:
+            tokens.append((char, 0 if char == '|' else 1))
+            i += 1
+    return tokens
+
+
+def _parse_table_begin(code, begin, env_name, pos):
+    """解析表格环境的参数，返回 TableStructure；列定义缺失时返回 None。"""
+    if env_name in WIDTH_ENVIRONMENTS:
+        width, pos = _read_group(code, pos)
+        if width is None:
+            return None
+    optional = OPTIONAL_ARG_PATTERN.match(code, pos)
+    if optional is not None:
+        pos = optional.end()
+    spec, spec_end = _read_group(code, pos)
+    if spec is None:
+        return None
+    structure = TableStructure(env_name, begin, spec_end - 1 - len(spec), spec_end - 1)
+    structure.column_spec = spec
+    structure.spec_tokens = tokenize_column_spec(spec)
+    structure.spec_columns = sum(columns for _, columns in structure.spec_tokens)
+    return structure
+
+
+def _multicolumn_padding(match):
+    return '&' * max(int(match.group(1)) - 1, 0)
+
+
+def _has_nested_separators(body):
+    """是否有嵌套环境，或者花括号分组中包含 & 或换行。大多数表格没有，可以跳过逐层删除分组。"""
+    if NESTED_BEGIN in body:
+        return True
+    if '{' not in body:
+        return False
+    skeleton = body.encode('utf-8', 'surrogatepass').translate(None, SKELETON_DELETE)
+    while b'{}' in skeleton:
+        skeleton = skeleton.replace(b'{}', b'')
+    return b'{' in skeleton
+
+
+def count_row_columns(body):
+    """
+    统计表格正文中每个非空行的有效列数。
+
+    :param body: 列定义之后、\end 之前的表格正文。
+    """
+    # 先替换 \\，避免 \\& 中的 \& 被当作转义字符；去掉 \% 之后剩下的 % 都是注释
+    # 各步骤先用子串判断是否需要，大多数表格只需要其中少数几步。
+    # 替换 \\ 用 split/join 而不是 replace：replace 要先数一遍匹配再替换，长表格上慢近一倍
+    body = ROW_SEPARATOR.join(body.split('\\\\'))
+    if '\\' in body:
+        body = ESCAPED_PATTERN.sub('', body)
+    if '%' in body:
+        body = COMMENT_PATTERN.sub('', body)
+    if '\\tabularnewline' in body or '\\cr' in body:
+        body = ROW_BREAK_PATTERN.sub(ROW_SEPARATOR, body)
+    if '\\multicolumn' in body:
+        body = MULTICOLUMN_PATTERN.sub(_multicolumn_padding, body)
+    if '\\begin' in body:
+        body = NESTED_BEGIN_PATTERN.sub(NESTED_BEGIN, body)
+        body = NESTED_END_PATTERN.sub(NESTED_END, body)
+    if _has_nested_separators(body):
+        # 由内向外删除嵌套环境和花括号分组，其中的 & 和换行不属于最外层表格
+        while True:
+            body, removed_envs = NESTED_ENV_PATTERN.subn('', body)
+            body, removed_groups = GROUP_PATTERN.subn('', body)
+            if not removed_envs and not removed_groups:
+                break
+    rows = []
+    for row in body.split(ROW_SEPARATOR):
+        separators = row.count('&')
+        if separators or not EMPTY_ROW_PATTERN.fullmatch(row):
+            rows.append(separators + 1)
+    return rows
+
+
+def _commented_out(code, pos):
+    """pos 所在的行在 pos 之前是否有注释符。"""
+    line_start = code.rfind('\n', 0, pos) + 1
+    if code.find('%', line_start, pos) == -1:
+        return False
+    match = LINE_COMMENT_PATTERN.match(code, line_start, pos)
+    return match is not None
+
+
+def analyze_table(latex_code):
+    """
+    分析代码中第一个表格环境的结构。
+
+    :param latex_code: 表格的LaTeX代码。
+    :return: TableStructure；没有找到表格环境时返回 None。
+    """
+    structure = None
+    nesting = 0  # 表格内部同名环境的嵌套层数
+    for match in ENV_PATTERN.finditer(latex_code):
+        command, env_name = match.groups()
+        if _commented_out(latex_code, match.start()):
+            continue
+        if structure is None:
+            if command == 'begin' and env_name in TABLE_ENVIRONMENTS:
+                structure = _parse_table_begin(latex_code, match.start(), env_name, match.end())
+            continue
+        if env_name != structure.env_name or match.start() <= structure.spec_end:
+            continue
+        if command == 'begin':
+            nesting += 1
+        elif nesting:
+            nesting -= 1
+        else:
+            structure.end_start = match.start()
+            structure.end = match.end()
+            break
+
+    if structure is None:
+        return None
+    body_end = structure.end_start if structure.end_start is not None else len(latex_code)
+    structure.rows = count_row_columns(latex_code[structure.spec_end + 1:body_end])
+    return structure
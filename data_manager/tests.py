@@ -1,3 +1,213 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .compile_scheduler import BACKGROUND, INTERACTIVE, CompileScheduler, SchedulerSaturated
+from .file_response import parse_range, serve_file
+from .ingest import iter_json_array
+from .models import DataItem, Dataset
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    # 包含多字节字符、字符串中的 , 和 ]、嵌套数组，以及紧挨着 , 和 ] 的顶层数字
+    DATA = '[{"name": "表格", "code": "a & b \\\\"}, 12.5e3, true, null, "x,]", [1, 2], -7]'.encode('utf-8')
+
+    def parse(self, chunks):
+        return list(iter_json_array(chunks))
+
+    def test_every_split_point(self):
+        expected = json.loads(self.DATA)
+        for split in range(len(self.DATA) + 1):
+            with self.subTest(split=split):
+                self.assertEqual(self.parse([self.DATA[:split], self.DATA[split:]]), expected)
+
+    def test_single_byte_chunks(self):
+        self.assertEqual(self.parse(bytes([byte]) for byte in self.DATA), json.loads(self.DATA))
+
+    def test_number_at_chunk_edge(self):
+        # "3." | "5" 不能被解析为3，"10" | "0]" 不能被解析为10
+        self.assertEqual(self.parse([b'[3.', b'5]']), [3.5])
+        self.assertEqual(self.parse([b'[10', b'0]']), [100])
+        self.assertEqual(self.parse([b'[1e', b'3, 2', b']']), [1000.0, 2])
+
+    def test_bom_and_whitespace(self):
+        self.assertEqual(self.parse([b'\xef\xbb\xbf \n[', b' 1 ,\t2 ', b'] ']), [1, 2])
+
+    def test_invalid_json(self):
+        for data in (b'{"a": 1}', b'[1 2]', b'[1, 2', b''):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    self.parse([data])
+
+
+class RangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=50-200', 100), (50, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+
+    def test_unsupported_range_returns_whole_file(self):
+        for header in ('bytes=0-9,20-29', 'items=0-9', 'bytes=-', 'bytes=9-0'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 100))
+
+    def test_unsatisfiable_range(self):
+        for header, size in (('bytes=100-', 100), ('bytes=-0', 100), ('bytes=-5', 0)):
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(ValueError):
+                    parse_range(header, size)
+
+    def test_serve_file(self):
+        with tempfile.NamedTemporaryFile(delete=False) as pdf_file:
+            pdf_file.write(bytes(range(100)))
+        self.addCleanup(os.remove, pdf_file.name)
+        factory = RequestFactory()
+
+        def get(**headers):
+            return serve_file(factory.get('/', headers=headers), pdf_file.name, 'application/pdf',
+                              '"etag"', 'no-cache')
+
+        response = get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = get(Range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(95, 100)))
+
+        response = get(Range='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        response = get(Range='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+
+        # If-Range 与 ETag 不同时忽略 Range
+        response = get(Range='bytes=0-9', **{'If-Range': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        response = get(**{'If-None-Match': '"etag"'})
+        self.assertEqual(response.status_code, 304)
+
+
+class CompileSchedulerTests(SimpleTestCase):
+    def make_scheduler(self, max_concurrency=1, max_queue=4, interactive_reserved=0, queue_timeout=5):
+        scheduler = CompileScheduler(max_concurrency, max_queue, max_queue, interactive_reserved, queue_timeout)
+        self.addCleanup(scheduler._async_executor.shutdown)
+        return scheduler
+
+    def wait_until_waiting(self, scheduler, priority, count):
+        deadline = time.monotonic() + 5
+        while len(scheduler._waiting[priority]) < count:
+            self.assertLess(time.monotonic(), deadline, '等待者没有进入队列')
+            time.sleep(0.001)
+
+    def test_saturated_queue(self):
+        scheduler = self.make_scheduler(max_queue=0)
+        grant = scheduler.acquire(INTERACTIVE)
+        with self.assertRaises(SchedulerSaturated) as context:
+            scheduler.acquire(INTERACTIVE)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        scheduler.release(INTERACTIVE, grant)
+        scheduler.release(INTERACTIVE, scheduler.acquire(INTERACTIVE))
+
+    def test_queue_timeout(self):
+        scheduler = self.make_scheduler(queue_timeout=0.05)
+        grant = scheduler.acquire(INTERACTIVE)
+        with self.assertRaises(SchedulerSaturated):
+            scheduler.acquire(INTERACTIVE)
+        scheduler.release(INTERACTIVE, grant)
+
+    def test_interactive_overtakes_background(self):
+        scheduler = self.make_scheduler()
+        order = []
+
+        def run(priority):
+            grant = scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release(priority, grant)
+
+        grant = scheduler.acquire(BACKGROUND)
+        background = threading.Thread(target=run, args=(BACKGROUND,))
+        background.start()
+        self.wait_until_waiting(scheduler, BACKGROUND, 1)
+        interactive = threading.Thread(target=run, args=(INTERACTIVE,))
+        interactive.start()
+        self.wait_until_waiting(scheduler, INTERACTIVE, 1)
+        scheduler.release(BACKGROUND, grant)
+        background.join(5)
+        interactive.join(5)
+        self.assertEqual(order, [INTERACTIVE, BACKGROUND])
+
+    def test_reserved_slot(self):
+        scheduler = self.make_scheduler(max_concurrency=2, interactive_reserved=1, queue_timeout=0.05)
+        grant = scheduler.acquire(BACKGROUND)
+        with self.assertRaises(SchedulerSaturated):
+            scheduler.acquire(BACKGROUND)
+        scheduler.release(INTERACTIVE, scheduler.acquire(INTERACTIVE))
+        scheduler.release(BACKGROUND, grant)
+
+    @override_settings(LATEX_PRECOMPILE_PREAMBLE=False)
+    def test_compile_pdf_returns_429(self):
+        scheduler = self.make_scheduler(max_queue=0)
+        grant = scheduler.acquire(INTERACTIVE)
+        self.addCleanup(scheduler.release, INTERACTIVE, grant)
+        with mock.patch('data_manager.latex_compiler.get_scheduler', return_value=scheduler), \
+                mock.patch('data_manager.latex_compiler.load_cached_result', return_value=None):
+            response = self.client.post('/compile_pdf/', json.dumps({
+                'pred_tex_code': '\\begin{tabular}{cc}\na & b \\\\\n\\end{tabular}',
+            }), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertFalse(response.json()['success'])
+
+
+class ClassifyDataItemTests(TestCase):
+    def setUp(self):
+        self.dataset = Dataset.objects.create(bucket='bucket', prefix='images', json_key='images/tables.json')
+        self.item = DataItem.objects.create(dataset=self.dataset, image_name='a.png', pred_tex_code='x')
+
+    def classify(self, **data):
+        body = dict({'dataset_id': self.dataset.id, 'image_name': 'a.png', 'category': 'good'}, **data)
+        return self.client.post('/classify_data_item/', json.dumps(body), content_type='application/json')
+
+    def test_version_increments(self):
+        response = self.classify(version=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], 1)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.category, self.item.is_annotated, self.item.version), ('good', True, 1))
+
+    def test_stale_version_conflict(self):
+        self.classify(version=0)
+        response = self.classify(category='bad', version=0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['category'], 'good')
+        self.assertEqual(response.json()['version'], 1)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.category, self.item.version), ('good', 1))
+
+    def test_without_version_overwrites(self):
+        self.classify(version=0)
+        response = self.classify(category='bad')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], 2)
+
+    def test_missing_fields(self):
+        response = self.client.post('/classify_data_item/', json.dumps({'image_name': 'a.png'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dataset_id', response.json()['message'])
+
+    def test_missing_item(self):
+        self.assertEqual(self.classify(image_name='missing.png').status_code, 404)
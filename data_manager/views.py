@@ -1,12 +1,32 @@
-import boto3
 from django.http import JsonResponse
 import json
 import base64
+import zlib
+from functools import partial
 from django.views.decorators.clickjacking import xframe_options_exempt
-from django.http import JsonResponse, HttpResponse
-from django.views.decorators.http import require_http_methods
-from .latex_compiler import compile_latex_to_pdf
-from .models import DataItem
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse, HttpResponseNotAllowed
+from django.views.decorators.http import require_http_methods, require_safe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from asgiref.sync import sync_to_async
+from django.urls import reverse
+from django.utils.http import quote_etag
+from .latex_compiler import (
+    compile_latex_to_pdf, compile_latex_batch, compute_cache_key, get_pdf_cache, prepare_latex_document,
+    store_cached_result,
+)
+from .async_compiler import compile_latex_to_pdf_async
+from .compile_scheduler import SchedulerSaturated, INTERACTIVE, PRIORITIES
+from .models import DataItem, Dataset, PrecompileJob
+from .precompile import start_precompile_job, cancel_precompile_job, load_stored_result
+from .s3 import get_session_presigner, get_session_s3_client, get_object_if_modified, image_key
+from .image_proxy import get_image, prefetch_images, IMAGE_SIZES, SIZE_ORIGINAL
+from .file_response import not_modified_response, serve_file
+from .ingest import (
+    parse_s3_path, get_dataset, get_source_version, record_source_version, mark_loaded, iter_json_array,
+    iter_ingest, ingest_items, new_summary, count_status, READ_CHUNK_SIZE, ITEM_UNCHANGED,
+)
 from django.shortcuts import render
 from django.http import JsonResponse
 import re
@@ -15,38 +35,225 @@ import re
 def index(request):
     return render(request, 'index.html') 
 
+
+def saturated_response(error):
+    """编译队列已满时的响应。"""
+    response = JsonResponse({'success': False, 'message': str(error)}, status=429)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def parse_compile_request(data):
+    """
+    解析编译请求：指定 item_id 时从数据库读取LaTeX代码，否则使用请求中的 pred_tex_code。
+
+    :return: ((latex_code, file_name, dataset_id, priority), None)；请求无效时为 (None, 错误响应)。
+    """
+    latex_code = data.get('pred_tex_code')
+    file_name = data.get('file_name')
+    dataset_id = data.get('dataset_id')
+    if data.get('item_id'):
+        # 指定数据项时从数据库读取LaTeX代码，前端无需持有源码
+        try:
+            item = DataItem.objects.get(id=data['item_id'])
+        except DataItem.DoesNotExist:
+            return None, JsonResponse({'success': False, 'message': '未找到指定的数据项'}, status=404)
+        latex_code, file_name, dataset_id = item.pred_tex_code, item.image_name, item.dataset_id
+    if not latex_code:
+        return None, JsonResponse({'success': False, 'message': '请求中缺少表格代码'}, status=400)
+    # 预取等后台请求使用 background，不与用户正在查看的数据项争抢编译槽
+    priority = data.get('priority', INTERACTIVE)
+    if priority not in PRIORITIES:
+        return None, JsonResponse({'success': False, 'message': '无效的优先级'}, status=400)
+    return (latex_code, file_name, dataset_id, priority), None
+
+
+def compile_result_response(compile_result):
+    """
+    编译结果的JSON响应：success、message、errors（错误记录，见 log_parser）和 pdf_url。
+    PDF不放在响应中，pdf_url 指向编译缓存中的PDF（compiled_pdf 视图）。
+    """
+    body = {
+        'success': bool(compile_result.get('success')),
+        'message': compile_result.get('message', compile_result.get('error', '编译失败。')),
+        'errors': compile_result.get('errors', []),
+        'errors_truncated': compile_result.get('errors_truncated', False),
+        'pdf_url': None,
+    }
+    if compile_result.get('success'):
+        # 写入缓存失败或已被淘汰时重新写入，否则 pdf_url 无法访问
+        cached_pdf_path(compile_result)
+        body['pdf_url'] = reverse('compiled_pdf', args=[compile_result['cache_key']])
+        return JsonResponse(body)
+    # error_type 不为空时表示编译超时、资源超限被终止或未通过预检查（issues 为检查结果）
+    body['error_type'] = compile_result.get('error_type')
+    body['issues'] = compile_result.get('issues', [])
+    return JsonResponse(body, status=500)
+
+
+CACHE_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# 按 cache_key（最终文档的哈希）访问的PDF内容不会变化，浏览器和反向代理可以长期缓存
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 按数据项访问的PDF随LaTeX代码变化，可以缓存但每次使用前要用 ETag 向服务端验证
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+PDF_NOT_FOUND = {'success': False, 'message': '未找到PDF'}
+
+
+def cached_pdf_path(compile_result):
+    """编译成功的结果在编译缓存中的PDF路径，缓存中缺失时重新写入；没有PDF时返回None。"""
+    cache_key = compile_result['cache_key']
+    entry = get_pdf_cache().get(cache_key)
+    if (entry is None or entry[1] is None) and compile_result.get('pdf_data') is not None:
+        store_cached_result(cache_key, compile_result)
+        entry = get_pdf_cache().get(cache_key)
+    return entry[1] if entry is not None else None
+
+
+def serve_pdf(request, path, cache_key, cache_control):
+    try:
+        return serve_file(request, path, 'application/pdf', quote_etag(cache_key), cache_control,
+                          filename='compiled_document.pdf')
+    except OSError:
+        # 刚好被淘汰
+        return JsonResponse(PDF_NOT_FOUND, status=404)
+
+
+@require_safe
+def compiled_pdf(request, cache_key):
+    """
+    返回编译缓存中的PDF，cache_key 为编译结果中的 cache_key。
+    内容由 cache_key 唯一确定：ETag 即 cache_key，If-None-Match 命中时直接返回304，支持 Range 请求；
+    HEAD 请求只返回响应头。
+    """
+    if not CACHE_KEY_PATTERN.match(cache_key):
+        return JsonResponse(PDF_NOT_FOUND, status=404)
+    response = not_modified_response(request, quote_etag(cache_key), IMMUTABLE_CACHE_CONTROL)
+    if response is not None:
+        return response
+    entry = get_pdf_cache().get(cache_key)
+    if entry is None or entry[1] is None:
+        return JsonResponse(PDF_NOT_FOUND, status=404)
+    return serve_pdf(request, entry[1], cache_key, IMMUTABLE_CACHE_CONTROL)
+
+
+@require_safe
+def item_pdf(request, item_id):
+    """
+    数据项编译后的PDF，可以直接作为 iframe 的地址并被浏览器和反向代理缓存。
+
+    ETag 为编译缓存key，由LaTeX代码决定：If-None-Match 命中时只计算哈希就返回304，不编译也不读取文件。
+    否则优先使用预编译保存的结果，没有时编译（查询参数 priority 同 compile_pdf）。
+    编译失败时返回与 compile_pdf 相同的JSON。
+    """
+    priority = request.GET.get('priority', INTERACTIVE)
+    if priority not in PRIORITIES:
+        return JsonResponse({'success': False, 'message': '无效的优先级'}, status=400)
+    item = DataItem.objects.filter(id=item_id).only('id', 'dataset_id', 'image_name', 'pred_tex_code').first()
+    if item is None:
+        return JsonResponse({'success': False, 'message': '未找到指定的数据项'}, status=404)
+    response = not_modified_response(request, quote_etag(compute_cache_key(prepare_latex_document(
+        item.pred_tex_code))), REVALIDATE_CACHE_CONTROL)
+    if response is not None:
+        return response
+
+    compile_result = load_stored_result(item.dataset_id, item.image_name, item.pred_tex_code)
+    if compile_result is None:
+        try:
+            compile_result = compile_latex_to_pdf(item.pred_tex_code, priority=priority)
+        except SchedulerSaturated as e:
+            return saturated_response(e)
+    if not compile_result.get('success'):
+        return compile_result_response(compile_result)
+    path = cached_pdf_path(compile_result)
+    if path is None:
+        return JsonResponse(PDF_NOT_FOUND, status=404)
+    return serve_pdf(request, path, compile_result['cache_key'], REVALIDATE_CACHE_CONTROL)
+
+
 @require_http_methods(["POST"])
 
 def compile_pdf(request):
     try:
         data = json.loads(request.body)
-        latex_code = data.get('pred_tex_code')
-        
-        compile_result = compile_latex_to_pdf(latex_code)
-
-        if compile_result.get('success'):
-            pdf_data = compile_result.get('pdf_data')
-            # 创建HttpResponse对象，直接返回PDF二进制数据
-            response = HttpResponse(pdf_data, content_type='application/pdf')
-            response['Content-Disposition'] = 'inline; filename="compiled_document.pdf"'            
-            # 检查是否有编译消息或错误信息需要传递
-            if compile_result.get('message'):
-                encoded_message = base64.b64encode(compile_result.get('message', '').encode('utf-8')).decode('ascii')
-                response['X-Compile-Message'] = encoded_message
-            
-            # 错误信息，直接转为JSON字符串
-            if compile_result.get('errors'):
-                response['X-Compile-Errors'] = json.dumps(compile_result.get('errors', []))
-            
-            return response
-        else:
-            return JsonResponse({
-                'success': False, 
-                'message': compile_result.get('message', '编译失败。'), 
-                'errors': compile_result.get('errors', [])
-            }, status=500)
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'message': '无效的请求格式'}, status=400)
+    params, error_response = parse_compile_request(data)
+    if error_response is not None:
+        return error_response
+    latex_code, file_name, dataset_id, priority = params
+
+    # 优先使用后台预编译保存的结果
+    compile_result = None
+    if dataset_id and file_name:
+        compile_result = load_stored_result(dataset_id, file_name, latex_code)
+    if compile_result is None:
+        try:
+            compile_result = compile_latex_to_pdf(latex_code, priority=priority)
+        except SchedulerSaturated as e:
+            return saturated_response(e)
+    return compile_result_response(compile_result)
+
+
+async def compile_pdf_async(request):
+    """
+    compile_pdf 的异步版本，请求和响应格式相同。
+    在 ASGI 下运行时不占用线程，客户端断开连接后编译会被终止（见 myproject/asgi.py）。
+    """
+    # Django 4.2 的 require_http_methods 不支持异步视图
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '无效的请求格式'}, status=400)
+    params, error_response = await sync_to_async(parse_compile_request)(data)
+    if error_response is not None:
+        return error_response
+    latex_code, file_name, dataset_id, priority = params
+
+    compile_result = None
+    if dataset_id and file_name:
+        compile_result = await sync_to_async(load_stored_result)(dataset_id, file_name, latex_code)
+    if compile_result is None:
+        try:
+            compile_result = await compile_latex_to_pdf_async(latex_code, priority=priority)
+        except SchedulerSaturated as e:
+            return saturated_response(e)
+    # 生成响应时会读写编译缓存（磁盘），放到线程中执行，不阻塞事件循环
+    return await sync_to_async(compile_result_response, thread_sensitive=False)(compile_result)
+
+
+@require_http_methods(["POST"])
+def compile_pdf_batch(request):
+    """
+    在一次 pdflatex 运行中编译多个表格。
+    请求体为 {"items": [{"file_name": ..., "pred_tex_code": ...}, ...]}，
+    返回的 documents 为 Base64 编码的PDF，每个表格通过 document 和 pages 定位到所在页面。
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '无效的请求格式'}, status=400)
+
+    items = data.get('items')
+    if not isinstance(items, list) or not all(isinstance(item, dict) and item.get('pred_tex_code') for item in items):
+        return JsonResponse({'success': False, 'message': '请求中缺少表格代码'}, status=400)
+    if len(items) > settings.LATEX_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            'success': False,
+            'message': f'单次最多编译{settings.LATEX_BATCH_MAX_ITEMS}个表格'
+        }, status=400)
+
+    try:
+        batch_result = compile_latex_batch([item['pred_tex_code'] for item in items])
+    except SchedulerSaturated as e:
+        return saturated_response(e)
+    for item, item_result in zip(items, batch_result['items']):
+        item_result['file_name'] = item.get('file_name')
+    return JsonResponse({
+        'success': True,
+        'documents': [base64.b64encode(pdf_data).decode('ascii') for pdf_data in batch_result['documents']],
+        'items': batch_result['items'],
+    })
 
 
 
@@ -72,94 +279,399 @@ def set_aws_credentials(request):
 
 @require_http_methods(["POST"])
 def load_json_from_s3(request):
-    """从S3桶动态加载并返回JSON数据，数据存储到数据库中。"""
+    """
+    从S3桶流式加载JSON数据并分批存储到数据库中。
+    默认返回汇总信息；请求体中 stream 为 true 时以NDJSON格式逐行返回数据项。
+    重新加载时使用条件请求，文件未变化时返回 not_modified 为 true 的汇总信息；
+    变化时只写入新增和变化的数据项，汇总信息中包含 added、changed、unchanged、removed。
+    """
     body = json.loads(request.body)
     s3_path = body.get('s3_path', '')
     
     # 解析S3路径获取bucket名称和前缀以及文件名
-    match = re.match(r's3://([^/]+)/(.+)/([^/]+\.json)$', s3_path)
-    if not match:
+    parsed_path = parse_s3_path(s3_path)
+    if parsed_path is None:
         return JsonResponse({'status': 'error', 'message': '提供的S3路径格式不正确。'}, status=400)
-    bucket_name, prefix, json_filename = match.groups()
+    bucket_name, prefix, json_filename = parsed_path
     print(bucket_name, prefix, json_filename)
 
-    aws_access_key_id = request.session.get('aws_access_key_id')
-    aws_secret_access_key = request.session.get('aws_secret_access_key')
-    endpoint_url = request.session.get('endpoint_url')
-
-    # 确保凭证已设置
-    if not all([aws_access_key_id, aws_secret_access_key, endpoint_url]):
+    # 使用会话中的凭证获取共享的 S3 客户端，确保凭证已设置
+    s3_client = get_session_s3_client(request)
+    if s3_client is None:
         return JsonResponse({'message': 'AWS credentials not provided or session expired.'}, status=400)
 
-    # 使用会话中的凭证初始化 S3 客户端
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        endpoint_url=endpoint_url
-    )
-    
     json_key = f"{prefix}/{json_filename}"
+
     try:
-        # 读取并加载JSON文件
-        json_object = s3_client.get_object(Bucket=bucket_name, Key=json_key)
-        json_data = json.loads(json_object['Body'].read().decode('utf-8'))
-        updated_data_items = []
-    
-        for item in json_data:
-            image_name = item['image_name']
-            image_key = f"{prefix}/{image_name}"  # S3中的完整key路径
-            # 生成预签名URL
-            image_url = s3_client.generate_presigned_url('get_object',
-                                                        Params={'Bucket': bucket_name, 'Key': image_key},
-                                                        ExpiresIn=3600)  # URL有效期为3600秒（1小时）
-            # 保存图片名称和其他信息到数据库
-            DataItem.objects.update_or_create(
-                image_name=image_name,
-                defaults={
-                    'pred_tex_code': item['pred_tex_code'],
-                    'image_path': image_url,  # 使用预签名URL保存图片的路径
-                    'category': item.get('category', ''),
-                    'is_annotated': item.get('is_annotated', False),
-                }
-            )
-            updated_data_items.append({
-                'image_name': image_name,
-                'pred_tex_code': item['pred_tex_code'],
-                'image_path': image_url,
-                'category': item.get('category', ''),
-                'is_annotated': item.get('is_annotated', False),
-            })
-
-        return JsonResponse(updated_data_items, safe=False)
+        # 文件自上次完整加载后未变化时不再读取和解析
+        dataset, (etag, last_modified) = get_source_version(bucket_name, json_key)
+        json_object = get_object_if_modified(s3_client, bucket_name, json_key, etag, last_modified)
+        if json_object is None:
+            mark_loaded(dataset)
+            summary = unchanged_summary(dataset, body.get('precompile', False))
+            if body.get('stream', False):
+                return StreamingHttpResponse([json.dumps(dict(summary, type='summary'), ensure_ascii=False) + '\n'],
+                                             content_type='application/x-ndjson')
+            return JsonResponse(dict(summary, status='success'))
+
+        # 按块读取JSON文件，逐项解析并只写入新增和变化的数据项
+        items = iter_json_array(json_object['Body'].iter_chunks(READ_CHUNK_SIZE))
+        dataset = get_dataset(bucket_name, prefix, json_key)
+        # 只记录图片在S3中的key，预签名URL在返回数据项时才生成
+        image_path_for = partial(image_key, dataset)
+        source_version = (json_object.get('ETag', ''), json_object.get('LastModified'))
+
+        if body.get('stream', False):
+            return StreamingHttpResponse(stream_ingest_ndjson(items, dataset, image_path_for,
+                                                              body.get('precompile', False), source_version),
+                                         content_type='application/x-ndjson')
+
+        summary = ingest_items(items, dataset, image_path_for)
+        record_source_version(dataset, *source_version)
+        summary['dataset_id'] = dataset.id
+        summary['not_modified'] = False
+        if body.get('precompile', False):
+            # 在后台预编译整个数据集
+            summary['precompile_job_id'] = start_precompile_job(dataset).id
+        return JsonResponse(dict(summary, status='success'))
     except s3_client.exceptions.NoSuchKey:
         return JsonResponse({'status': 'error', 'message': '未找到JSON文件。'}, status=404)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'加载JSON文件失败: {str(e)}'}, status=500)
 
 
+def unchanged_summary(dataset, precompile):
+    """源文件未变化时的汇总信息，所有数据项都算作未变化。"""
+    summary = new_summary()
+    summary['total'] = summary[ITEM_UNCHANGED] = dataset.items.count()
+    summary['dataset_id'] = dataset.id
+    summary['not_modified'] = True
+    if precompile:
+        summary['precompile_job_id'] = start_precompile_job(dataset).id
+    return summary
+
+
+def stream_ingest_ndjson(items, dataset, image_path_for, precompile, source_version):
+    """
+    以NDJSON格式逐行返回数据项（type为item，status为同步状态），最后一行为汇总信息（type为summary）。
+    出错时最后一行的type为error。
+
+    :param source_version: 源文件的 (etag, last_modified)，同步完成后记录到数据集。
+    """
+    summary = dict(new_summary(), dataset_id=dataset.id, not_modified=False)
+    try:
+        for record, status in iter_ingest(items, dataset, image_path_for):
+            count_status(summary, status)
+            yield json.dumps(dict(record, type='item', status=status), ensure_ascii=False) + '\n'
+        record_source_version(dataset, *source_version)
+        if precompile:
+            summary['precompile_job_id'] = start_precompile_job(dataset).id
+        yield json.dumps(dict(summary, type='summary'), ensure_ascii=False) + '\n'
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'message': f'加载JSON文件失败: {str(e)}'}, ensure_ascii=False) + '\n'
+
+
+# 分页接口每页的默认和最大条数
+ITEMS_PAGE_SIZE = 100
+ITEMS_MAX_PAGE_SIZE = 500
+
+
+def get_image_url_builder(request, dataset):
+    """
+    返回为数据项生成图片预签名URL的函数，会话中没有凭证或数据集不在S3上时返回None。
+    """
+    presign = get_session_presigner(request)
+    if presign is None or not dataset.bucket:
+        return None
+    return lambda item: presign(dataset.bucket, image_key(dataset, item.image_name))
+
+
+def item_to_summary(item, image_url_for=None):
+    """
+    数据项的轻量表示，不包含LaTeX代码。
+
+    :param image_url_for: get_image_url_builder 返回的函数，为None时不返回图片URL。
+    """
+    compile_result = getattr(item, 'compile_result', None)
+    if compile_result is None:
+        compile_status = 'pending'
+    else:
+        compile_status = 'success' if compile_result.success else 'failed'
+    image_url, image_url_expires_at = image_url_for(item) if image_url_for else (None, None)
+    return {
+        'id': item.id,
+        'image_name': item.image_name,
+        'image_path': item.image_path,
+        'image_url': image_url,
+        'image_url_expires_at': image_url_expires_at,
+        'category': item.category,
+        'is_annotated': item.is_annotated,
+        'version': item.version,
+        'compile_status': compile_status,
+    }
+
+
+@require_http_methods(["GET"])
+def list_items(request):
+    """
+    按 id 游标分页返回数据集中的数据项（不含LaTeX代码）。
+
+    查询参数：dataset（必填）、cursor（上一页最后一项的id）、limit、category、
+    annotated（true/false）、compile_status（success/failed/pending）、prefix（图片名称前缀）。
+    第一页（不带 cursor）会额外返回符合条件的总数 total。
+    """
+    try:
+        dataset_id = int(request.GET['dataset'])
+        cursor = int(request.GET.get('cursor', 0))
+        limit = min(int(request.GET.get('limit', ITEMS_PAGE_SIZE)), ITEMS_MAX_PAGE_SIZE)
+    except (KeyError, ValueError):
+        return JsonResponse({'status': 'error', 'message': '无效的查询参数'}, status=400)
+    if limit < 1:
+        # limit 为0时游标不会前进，客户端会无限请求空页
+        return JsonResponse({'status': 'error', 'message': 'limit 必须大于0'}, status=400)
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if dataset is None:
+        return JsonResponse({'status': 'error', 'message': '未找到指定的数据集'}, status=404)
+    image_url_for = get_image_url_builder(request, dataset)
+
+    items = DataItem.objects.filter(dataset_id=dataset_id)
+    if request.GET.get('category'):
+        items = items.filter(category=request.GET['category'])
+    if request.GET.get('annotated') in ('true', 'false'):
+        items = items.filter(is_annotated=request.GET['annotated'] == 'true')
+    compile_status = request.GET.get('compile_status')
+    if compile_status == 'pending':
+        items = items.filter(compile_result__isnull=True)
+    elif compile_status in ('success', 'failed'):
+        items = items.filter(compile_result__success=compile_status == 'success')
+    if request.GET.get('prefix'):
+        items = items.filter(image_name__startswith=request.GET['prefix'])
+
+    page = list(items.filter(id__gt=cursor).select_related('compile_result')
+                .only('id', 'image_name', 'image_path', 'category', 'is_annotated', 'version',
+                      'compile_result__success')
+                .order_by('id')[:limit + 1])
+    response = {
+        'items': [item_to_summary(item, image_url_for) for item in page[:limit]],
+        'next_cursor': page[limit - 1].id if len(page) > limit else None,
+    }
+    if not cursor:
+        response['total'] = items.count()
+    return JsonResponse(response)
+
+
+@require_http_methods(["GET"])
+def get_item(request, item_id):
+    """返回单个数据项的完整信息，包括LaTeX代码。"""
+    try:
+        item = DataItem.objects.select_related('compile_result', 'dataset').get(id=item_id)
+    except DataItem.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': '未找到指定的数据项'}, status=404)
+    summary = item_to_summary(item, get_image_url_builder(request, item.dataset))
+    return JsonResponse(dict(summary, dataset_id=item.dataset_id, pred_tex_code=item.pred_tex_code))
+
+
+@require_http_methods(["GET"])
+def item_image(request, item_id):
+    """
+    通过本地磁盘缓存返回数据项的图片。
+
+    查询参数：size（original/preview，默认original）、prefetch（在后台预取之后多少个数据项的图片）。
+    """
+    size = request.GET.get('size', SIZE_ORIGINAL)
+    try:
+        prefetch = min(int(request.GET.get('prefetch', 0)), settings.IMAGE_PREFETCH_MAX)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': '无效的查询参数'}, status=400)
+    if size not in IMAGE_SIZES:
+        return JsonResponse({'status': 'error', 'message': '无效的查询参数'}, status=400)
+
+    try:
+        item = DataItem.objects.select_related('dataset').get(id=item_id)
+    except DataItem.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': '未找到指定的数据项'}, status=404)
+    dataset = item.dataset
+    if not dataset.bucket:
+        return JsonResponse({'status': 'error', 'message': '数据集不在S3上'}, status=404)
+    # 缓存的图片也只返回给设置了凭证的用户
+    s3_client = get_session_s3_client(request)
+    if s3_client is None:
+        return JsonResponse({'message': 'AWS credentials not provided or session expired.'}, status=400)
+
+    if prefetch > 0:
+        next_names = DataItem.objects.filter(dataset=dataset, id__gt=item.id).order_by('id') \
+            .values_list('image_name', flat=True)[:prefetch]
+        prefetch_images(s3_client, dataset.bucket, [image_key(dataset, name) for name in next_names], size)
+
+    try:
+        meta, data_path = get_image(s3_client, dataset.bucket, image_key(dataset, item.image_name), size)
+        response = FileResponse(open(data_path, 'rb'), content_type=meta['content_type'])
+    except s3_client.exceptions.NoSuchKey:
+        return JsonResponse({'status': 'error', 'message': '未找到图片。'}, status=404)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': f'读取图片失败: {str(e)}'}, status=502)
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def precompile_job_to_dict(job):
+    return {
+        'id': job.id,
+        'dataset_id': job.dataset_id,
+        'status': job.status,
+        'total_items': job.total_items,
+        'compiled_items': job.compiled_items,
+        'failed_items': job.failed_items,
+        'message': job.message,
+    }
+
+
+@require_http_methods(["POST"])
+def start_precompile(request):
+    """启动数据集的后台预编译，存在未完成的任务时继续执行该任务。"""
+    try:
+        data = json.loads(request.body)
+        dataset = Dataset.objects.get(id=data['dataset_id'])
+    except (json.JSONDecodeError, KeyError):
+        return JsonResponse({'status': 'error', 'message': '无效的请求格式'}, status=400)
+    except Dataset.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': '未找到指定的数据集'}, status=404)
+    job = start_precompile_job(dataset)
+    return JsonResponse(precompile_job_to_dict(job))
+
+
+@require_http_methods(["GET"])
+def precompile_progress(request, job_id):
+    try:
+        job = PrecompileJob.objects.get(id=job_id)
+    except PrecompileJob.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': '未找到预编译任务'}, status=404)
+    return JsonResponse(precompile_job_to_dict(job))
+
+
+@require_http_methods(["POST"])
+def cancel_precompile(request, job_id):
+    if not cancel_precompile_job(job_id):
+        return JsonResponse({'status': 'error', 'message': '任务不存在或已结束'}, status=409)
+    return JsonResponse({'status': 'success', 'message': '任务已取消'})
+
+
+def conflict_record(item):
+    """乐观锁冲突时返回数据项的当前状态，客户端据此更新显示。"""
+    return {'item_id': item.id, 'category': item.category, 'is_annotated': item.is_annotated,
+            'version': item.version}
+
 
 @require_http_methods(["POST"])
 def classify_data_item(request):
+    """
+    对单个数据项分类。请求中带有 version 时只在数据项的当前版本与之相同时才写入，
+    否则返回409和数据项的当前状态；不带 version 时直接覆盖。
+    """
     try:
         data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': '无效的请求格式'}, status=400)
+    missing = [field for field in ('dataset_id', 'image_name', 'category')
+               if not isinstance(data, dict) or data.get(field) is None]
+    if missing:
+        return JsonResponse({'status': 'error', 'message': f'请求中缺少字段: {", ".join(missing)}'}, status=400)
+
+    try:
+        dataset_id = data['dataset_id']
         image_name = data['image_name']
         category = data['category']
+        version = data.get('version')
 
-        # 根据 image_name 查找对应的数据项
-        try:
-            data_item = DataItem.objects.get(image_name=image_name)
-            # 更新分类信息
-            data_item.category = category
-            data_item.is_annotated = True 
-            data_item.save()
-            return JsonResponse({'status': 'success', 'message': '分类成功'})
-        except DataItem.DoesNotExist:
-            return JsonResponse({'status': 'error', 'message': '未找到指定的数据项'}, status=404)
+        # 根据数据集和 image_name 查找对应的数据项，只更新分类信息
+        items = DataItem.objects.filter(dataset_id=dataset_id, image_name=image_name)
+        matched = items if version is None else items.filter(version=version)
+        updated = matched.update(category=category, is_annotated=True, version=F('version') + 1)
+        if not updated:
+            item = items.first()
+            if item is None:
+                return JsonResponse({'status': 'error', 'message': '未找到指定的数据项'}, status=404)
+            return JsonResponse(dict(conflict_record(item), status='conflict',
+                                     message='数据项已被其他人修改'), status=409)
+        new_version = version + 1 if version is not None else items.values_list('version', flat=True).first()
+        return JsonResponse({'status': 'success', 'message': '分类成功', 'version': new_version})
 
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
-    
+
+
+def parse_bulk_labels(data):
+    """
+    解析批量分类请求中的标注，同一数据项以最后一项为准。
+
+    :return: ({item_id: (category, version)}, None)，version 可以为None；请求无效时为 (None, 错误信息)。
+    """
+    labels = data.get('labels') if isinstance(data, dict) else None
+    if not isinstance(labels, list):
+        return None, '缺少 labels 列表'
+    if len(labels) > settings.CLASSIFY_BULK_MAX_ITEMS:
+        return None, f'每次最多提交{settings.CLASSIFY_BULK_MAX_ITEMS}项标注'
+    max_length = DataItem._meta.get_field('category').max_length
+    labels_by_id = {}
+    for label in labels:
+        try:
+            item_id = int(label['item_id'])
+            category = label['category']
+            version = label.get('version')
+            version = None if version is None else int(version)
+        except (TypeError, KeyError, ValueError, AttributeError):
+            return None, '标注格式不正确'
+        if not isinstance(category, str) or len(category) > max_length:
+            return None, '分类名称不正确'
+        labels_by_id[item_id] = (category, version)
+    return labels_by_id, None
+
+
+@require_http_methods(["POST"])
+def classify_items_bulk(request):
+    """
+    批量分类，请求体为 {"labels": [{"item_id": 1, "category": "...", "version": 3}, ...]}。
+
+    不带 version 的标注按分类分组更新，每个分类一条 UPDATE，已经是该分类的数据项不写入；
+    带 version 的标注逐项按版本号条件更新，版本不一致的不写入。所有写入在一个事务中完成，
+    先执行 UPDATE 再查询，避免 SQLite 的读事务升级为写事务时因并发写入而失败。
+
+    :return: applied（已保存的数据项ID）、versions（已保存数据项的新版本号）、
+             missing（不存在的数据项ID，客户端应丢弃这些标注）、conflicts（版本冲突的数据项的当前状态）。
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': '请求体不是合法的JSON'}, status=400)
+    labels, error = parse_bulk_labels(data)
+    if error is not None:
+        return JsonResponse({'status': 'error', 'message': error}, status=400)
+
+    unversioned = {}
+    rejected = set()
+    with transaction.atomic():
+        for item_id, (category, version) in labels.items():
+            if version is None:
+                unversioned.setdefault(category, []).append(item_id)
+            elif not DataItem.objects.filter(id=item_id, version=version).update(
+                    category=category, is_annotated=True, version=F('version') + 1):
+                rejected.add(item_id)
+        for category, item_ids in unversioned.items():
+            DataItem.objects.filter(id__in=item_ids).exclude(category=category, is_annotated=True).update(
+                category=category, is_annotated=True, version=F('version') + 1)
+        items = {item.id: item for item in DataItem.objects.filter(id__in=list(labels)).only(
+            'id', 'category', 'is_annotated', 'version')}
+
+    applied = sorted(item_id for item_id in items if item_id not in rejected)
+    return JsonResponse({
+        'status': 'success',
+        'applied': applied,
+        'versions': {item_id: items[item_id].version for item_id in applied},
+        'missing': sorted(set(labels) - set(items)),
+        'conflicts': [conflict_record(items[item_id]) for item_id in sorted(rejected & set(items))],
+    })
+
 
 CATEGORY_MAPPING = {
     'compilable_consistent': '可编译表一致',
@@ -168,25 +680,98 @@ CATEGORY_MAPPING = {
     'non_compilable': '不可编译',
 }
 
-def export_classified_data(request):
-    # 根据分类查询数据项
-    data_items = DataItem.objects.filter(is_annotated=True).values('image_name', 'pred_tex_code','category')
+# 导出时每次从数据库读取的行数，以及攒够多少字节再输出一次
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
 
-    # 转换queryset为list，仅包含需要的字段
-    data_list = [
-        {
+def iter_export_records(data_items, export_format):
+    """将数据项逐条序列化为JSON数组（与 json.dumps(indent=4) 的格式一致）或JSONL文本。"""
+    if export_format == 'json':
+        yield '['
+    first = True
+    for item in data_items.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        record = {
             'image_name': item['image_name'],
             'pred_tex_code': item['pred_tex_code'],
             'category': CATEGORY_MAPPING.get(item['category'], item['category']),  # 使用映射转换分类
         }
-        for item in data_items
-     ]
-    # 转换为 JSON 字符串
-    data_json = json.dumps(data_list, ensure_ascii=False, indent=4)
-
-    # 设置响应内容类型为 JSON 并设置一个合适的文件名
-    response = HttpResponse(data_json, content_type='application/json')
-    response['Content-Disposition'] = f'attachment; filename="all_classified_data.json"'
- 
-    return response
+        if export_format == 'jsonl':
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+        else:
+            text = json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+            yield ('\n    ' if first else ',\n    ') + text
+        first = False
+    if export_format == 'json':
+        yield ']' if first else '\n]'
 
+
+def iter_export_chunks(records, compress):
+    """把文本片段合并成较大的字节块输出，需要时用gzip压缩。"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 生成gzip格式
+    buffer = []
+    size = 0
+    for record in records:
+        data = record.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= EXPORT_BUFFER_SIZE:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+@require_http_methods(["GET"])
+def export_classified_data(request):
+    """
+    流式导出已标注的数据项。
+
+    查询参数：dataset（数据集ID）、category（分类）、format（json 或 jsonl，默认json）、
+    gzip（为1时以gzip压缩）。
+    """
+    export_format = request.GET.get('format', 'json')
+    if export_format not in ('json', 'jsonl'):
+        return JsonResponse({'status': 'error', 'message': '不支持的导出格式'}, status=400)
+    compress = request.GET.get('gzip') == '1'
+
+    dataset_id = request.GET.get('dataset')
+    if dataset_id is not None:
+        try:
+            dataset_id = int(dataset_id)
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': '无效的查询参数'}, status=400)
+
+    # 根据分类查询数据项，指定 dataset 参数时只导出该数据集
+    data_items = DataItem.objects.filter(is_annotated=True)
+    if dataset_id is not None:
+        data_items = data_items.filter(dataset_id=dataset_id)
+    category = request.GET.get('category')
+    if category:
+        data_items = data_items.filter(category=category)
+    data_items = data_items.order_by('id').values('image_name', 'pred_tex_code', 'category')
+
+    filename = 'all_classified_data'
+    if dataset_id is not None:
+        filename += f'_{dataset_id}'
+    if category:
+        filename += '_' + re.sub(r'[^\w-]', '_', category)
+    filename += '.jsonl' if export_format == 'jsonl' else '.json'
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    else:
+        content_type = 'application/x-ndjson' if export_format == 'jsonl' else 'application/json'
+
+    response = StreamingHttpResponse(
+        iter_export_chunks(iter_export_records(data_items, export_format), compress),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -7,10 +7,67 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
+from data_manager.startup import start_background_tasks
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
-application = get_asgi_application()
+
+class CancelOnDisconnect:
+    """
+    客户端在响应完成前断开连接时取消请求的处理。
+
+    Django 4.2 的 ASGIHandler 读取完请求体后不再监听 http.disconnect，
+    异步视图会一直运行到结束。这里转发 receive 的消息并在收到断开事件时取消处理任务，
+    异步编译因此会终止 pdflatex（见 data_manager/async_compiler.py）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        messages = asyncio.Queue()
+        response_complete = False
+        disconnected = False
+
+        async def tracking_send(message):
+            nonlocal response_complete
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                response_complete = True
+            await send(message)
+
+        app_task = asyncio.create_task(self.app(scope, messages.get, tracking_send))
+
+        async def listen():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message['type'] == 'http.disconnect':
+                    # 响应发送完成后服务器也会返回断开事件，此时不再取消
+                    if not response_complete and not app_task.done():
+                        disconnected = True
+                        app_task.cancel()
+                    return
+
+        listener = asyncio.create_task(listen())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            listener.cancel()
+
+
+application = CancelOnDisconnect(get_asgi_application())
+
+# 服务启动时的后台任务（预编译导言区等）；管理命令不加载本模块，不会执行
+start_background_tasks()
@@ -75,10 +75,23 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite 并发设置（多人同时标注、后台加载）：WAL 模式下读写互不阻塞，synchronous=NORMAL 在 WAL 模式下
+# 只在检查点时同步磁盘；写锁被占用时最多等待 SQLITE_BUSY_TIMEOUT 秒，而不是立即报 "database is locked"。
+# 由 data_manager.sqlite.configure_sqlite 在每个新连接上设置
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT = 20
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+        },
+        # 连接在请求之间复用，不必每个请求重新打开数据库和设置 PRAGMA
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -121,6 +134,83 @@ STATIC_URL = 'static/'
 # STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') 
 TEMP_DIR = os.path.join(BASE_DIR, 'temp')
 
+# 编译使用的临时目录，依次尝试，使用第一个可写的目录（优先使用内存文件系统）
+LATEX_SCRATCH_ROOTS = [
+    os.path.join('/dev/shm', 's3tableviewer'),
+    os.path.join(TEMP_DIR, 'scratch'),
+]
+# 超过该时间（秒）的遗留临时目录在启动时删除，即使创建它的进程仍在运行
+LATEX_SCRATCH_MAX_AGE = 24 * 60 * 60
+
+# 编译结果缓存，多个 worker 共享同一目录
+PDF_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'pdf')
+PDF_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB
+PDF_CACHE_MAX_AGE = 7 * 24 * 3600  # 7天未访问即过期
+
+# 将固定的导言区预编译为格式文件(.fmt)，编译时跳过宏包加载
+LATEX_PRECOMPILE_PREAMBLE = True
+LATEX_FORMAT_DIR = os.path.join(BASE_DIR, 'cache', 'fmt')
+
+# 编译前用 Python 检查花括号、环境配对等问题，发现错误时不调用 pdflatex
+LATEX_PREFLIGHT = True
+
+# 每次编译最多从日志中收集的错误数（批量编译时为每个表格的上限）
+LATEX_LOG_MAX_ERRORS = 50
+
+# 批量编译接口单次允许的最大表格数
+LATEX_BATCH_MAX_ITEMS = 200
+
+# 单次编译的运行时间和CPU时间上限（秒）、地址空间上限和输出文件大小上限（字节），
+# 超过时终止整个进程组。批量编译使用 LATEX_BATCH_TIMEOUT 作为运行时间和CPU时间上限
+LATEX_COMPILE_TIMEOUT = 30
+LATEX_COMPILE_CPU_LIMIT = 20
+LATEX_COMPILE_MEMORY_LIMIT = 2 * 1024 ** 3
+LATEX_COMPILE_OUTPUT_LIMIT = 64 * 1024 ** 2
+LATEX_BATCH_TIMEOUT = 300
+
+# 后台预编译使用的进程数
+PRECOMPILE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# 编译调度：同时运行的 pdflatex 数量、交互/后台请求的等待队列长度、为交互请求保留的编译槽数
+# 以及在队列中等待的最长时间（秒）。队列已满或等待超时的请求返回 429
+LATEX_COMPILE_MAX_CONCURRENCY = os.cpu_count() or 2
+LATEX_COMPILE_MAX_QUEUE = 32
+LATEX_COMPILE_BACKGROUND_MAX_QUEUE = 8
+LATEX_COMPILE_INTERACTIVE_RESERVED = 1
+LATEX_COMPILE_QUEUE_TIMEOUT = 30
+# 跨进程编译槽的锁文件目录：所有 worker 进程和预编译进程共用上面的并发上限
+LATEX_COMPILE_SLOT_DIR = os.path.join(BASE_DIR, 'cache', 'slots')
+# 启动时是否继续执行因重启而中断的预编译任务
+PRECOMPILE_RESUME_ON_STARTUP = False
+
+# S3 客户端：按凭证和 endpoint 复用，超过空闲时间（秒）未使用时关闭
+S3_MAX_POOL_CONNECTIONS = 50
+S3_CONNECT_TIMEOUT = 10
+S3_READ_TIMEOUT = 60
+S3_TCP_KEEPALIVE = True
+S3_MAX_ATTEMPTS = 5
+S3_RETRY_MODE = 'standard'
+S3_CLIENT_IDLE_TIMEOUT = 30 * 60
+
+# 图片预签名URL的有效期（秒）；剩余有效期不足 REFRESH_MARGIN 时重新生成
+S3_PRESIGNED_URL_EXPIRES = 60 * 60
+S3_PRESIGNED_URL_REFRESH_MARGIN = 5 * 60
+S3_PRESIGNED_URL_CACHE_SIZE = 100000
+
+# 图片代理的磁盘缓存，所有 worker 共享
+IMAGE_CACHE_DIR = BASE_DIR / 'cache' / 'images'
+IMAGE_CACHE_MAX_BYTES = 10 * 1024 ** 3
+IMAGE_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+# 预览图的最大边长（像素）和 JPEG 质量，需要安装 Pillow
+IMAGE_PREVIEW_MAX_SIZE = 1600
+IMAGE_PREVIEW_QUALITY = 85
+# 后台预取图片的线程数，以及单次请求最多预取的数据项数
+IMAGE_PREFETCH_WORKERS = 4
+IMAGE_PREFETCH_MAX = 10
+
+# 批量分类接口每次请求最多包含的标注数
+CLASSIFY_BULK_MAX_ITEMS = 500
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -24,10 +24,21 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', data_manager_views.index, name='index'),  # 主页设置为 data_manager 的 index 视图
     path('compile_pdf/', data_manager_views.compile_pdf, name='compile_pdf'),
+    path('compile_pdf_async/', data_manager_views.compile_pdf_async, name='compile_pdf_async'),
+    path('compile_pdf_batch/', data_manager_views.compile_pdf_batch, name='compile_pdf_batch'),
+    path('compiled/<str:cache_key>/', data_manager_views.compiled_pdf, name='compiled_pdf'),
     path('classify_data_item/', data_manager_views.classify_data_item, name='classify_data_item'),
+    path('api/classify/bulk/', data_manager_views.classify_items_bulk, name='classify_items_bulk'),
     path('export_all_classified_data/', data_manager_views.export_classified_data, name='export_classified_data'),
     path('api/load-json-from-s3/', data_manager_views.load_json_from_s3, name='load_json_from_s3'),
+    path('api/items/', data_manager_views.list_items, name='list_items'),
+    path('api/items/<int:item_id>/', data_manager_views.get_item, name='get_item'),
+    path('api/items/<int:item_id>/image/', data_manager_views.item_image, name='item_image'),
+    path('api/items/<int:item_id>/pdf/', data_manager_views.item_pdf, name='item_pdf'),
     path('set_aws_credentials/', data_manager_views.set_aws_credentials, name='set_aws_credentials'),
+    path('api/precompile/', data_manager_views.start_precompile, name='start_precompile'),
+    path('api/precompile/<int:job_id>/', data_manager_views.precompile_progress, name='precompile_progress'),
+    path('api/precompile/<int:job_id>/cancel/', data_manager_views.cancel_precompile, name='cancel_precompile'),
 
     # ... 其他可能的 URL
 ]
@@ -11,6 +11,11 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from data_manager.startup import start_background_tasks
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
 application = get_wsgi_application()
+
+# 服务启动时的后台任务（预编译导言区等）；管理命令不加载本模块，不会执行
+start_background_tasks()